@@ -0,0 +1,230 @@
+# admission_control.py
+"""Admission control: concurrency budgets per class of route, so reports cannot crowd out checkout.
+
+Every request is put in a class: checkout (POS writes and lookups), interactive (ordinary pages and
+forms) or reports (history, low stock, analytics and their APIs). Metrics, admin and static files are
+never held back. Each class may run at most its own limit of requests at once, and all classes
+together at most ADMISSION_MAX_CONCURRENT. A request over budget waits in its class queue for up to
+the class timeout; when a slot frees, waiting checkout requests are admitted before interactive ones,
+and interactive before reports. A full queue or an expired wait is answered with 503 and Retry-After.
+
+Budgets count requests in one worker process. Enable with ADMISSION_CONTROL_ENABLED=1; limits are set
+per class as "checkout=16,interactive=10,reports=3" in ADMISSION_LIMITS, ADMISSION_QUEUE_LENGTHS and
+ADMISSION_TIMEOUT_SECONDS. Keeping interactive + reports below ADMISSION_MAX_CONCURRENT leaves slots
+that only checkout can use.
+"""
+import math
+import os
+import threading
+import time
+
+import app_logging
+
+logger = app_logging.get_logger(__name__)
+
+CHECKOUT, INTERACTIVE, REPORTS = 'checkout', 'interactive', 'reports'
+# Highest priority first
+PRIORITY_ORDER = (CHECKOUT, INTERACTIVE, REPORTS)
+
+def _parse_class_settings(setting, defaults, cast):
+    values = dict(defaults)
+    for entry in filter(None, (part.strip() for part in setting.split(','))):
+        name, _, value = entry.partition('=')
+        if name.strip() in values:
+            try:
+                values[name.strip()] = cast(value)
+            except ValueError:
+                pass
+    return values
+
+ADMISSION_CONTROL_ENABLED = os.environ.get('ADMISSION_CONTROL_ENABLED', '0') == '1'
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', '16'))
+ADMISSION_LIMITS = _parse_class_settings(os.environ.get('ADMISSION_LIMITS', ''),
+                                         {CHECKOUT: 16, INTERACTIVE: 10, REPORTS: 3}, int)
+ADMISSION_QUEUE_LENGTHS = _parse_class_settings(os.environ.get('ADMISSION_QUEUE_LENGTHS', ''),
+                                                {CHECKOUT: 64, INTERACTIVE: 20, REPORTS: 5}, int)
+ADMISSION_TIMEOUT_SECONDS = _parse_class_settings(os.environ.get('ADMISSION_TIMEOUT_SECONDS', ''),
+                                                  {CHECKOUT: 10.0, INTERACTIVE: 3.0, REPORTS: 5.0}, float)
+MAX_RETRY_AFTER_SECONDS = 30
+
+# Endpoints outside the interactive default. None means the class does not depend on the method.
+ROUTE_CLASSES = {
+    ('new_sale_route', 'POST'): CHECKOUT,
+    ('reserve_cart_item_route', None): CHECKOUT,
+    ('release_cart_item_route', None): CHECKOUT,
+    ('api_validate_cart', None): CHECKOUT,
+    ('api_catalog_product', None): CHECKOUT,
+    ('api_catalog_search', None): CHECKOUT,
+    ('api_customer_stats', None): CHECKOUT,
+    ('sales_history_route', None): REPORTS,
+    ('low_stock_report_route', None): REPORTS,
+    ('api_reorder_suggestions', None): REPORTS,
+    ('sales_analytics_route', None): REPORTS,
+    ('refresh_sales_analytics_route', None): REPORTS,
+    ('api_top_sellers', None): REPORTS,
+    ('api_bought_together', None): REPORTS,
+    ('api_top_pairs', None): REPORTS,
+    ('offline_sales_route', None): REPORTS,
+    ('store_report_route', None): REPORTS,
+}
+EXEMPT_ENDPOINT_PREFIXES = ('static', 'admin_')
+EXEMPT_ENDPOINT_SUFFIXES = ('_metrics_route',)
+
+def classify(endpoint, method):
+    """Returns the route class of a request, or None if it is never held back."""
+    if endpoint is None: # 404s and the like cost nothing
+        return None
+    if endpoint.startswith(EXEMPT_ENDPOINT_PREFIXES) or endpoint.endswith(EXEMPT_ENDPOINT_SUFFIXES):
+        return None
+    return ROUTE_CLASSES.get((endpoint, method), ROUTE_CLASSES.get((endpoint, None), INTERACTIVE))
+
+class Rejected(Exception):
+    """A request could not be admitted. retry_after is a suggested wait in seconds."""
+
+    def __init__(self, route_class, reason, retry_after):
+        super().__init__(f"{route_class} {reason}")
+        self.route_class = route_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Ticket:
+    """An admitted request's slot. release() may be called more than once."""
+
+    def __init__(self, controller, route_class):
+        self.controller = controller
+        self.route_class = route_class
+        self.admitted_at = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller.release(self)
+
+class AdmissionController:
+    """Per-class concurrency budgets under one overall limit, admitting waiting requests by priority."""
+
+    def __init__(self, limits=None, queue_lengths=None, timeouts=None, max_concurrent=ADMISSION_MAX_CONCURRENT):
+        self.limits = dict(limits or ADMISSION_LIMITS)
+        self.queue_lengths = dict(queue_lengths or ADMISSION_QUEUE_LENGTHS)
+        self.timeouts = dict(timeouts or ADMISSION_TIMEOUT_SECONDS)
+        self.max_concurrent = max_concurrent
+        self._condition = threading.Condition()
+        self._active = {name: 0 for name in PRIORITY_ORDER}
+        self._waiting = {name: 0 for name in PRIORITY_ORDER}
+        # Exponentially weighted average time a request holds its slot, for Retry-After
+        self._hold_seconds = {name: 0.1 for name in PRIORITY_ORDER}
+        self.stats = {name: {'admitted': 0, 'queued': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0,
+                             'max_queue_depth': 0, 'queue_wait_ms_total': 0.0}
+                      for name in PRIORITY_ORDER}
+
+    def _can_admit(self, route_class):
+        if self._active[route_class] >= self.limits[route_class]:
+            return False
+        if sum(self._active.values()) >= self.max_concurrent:
+            return False
+        # A free slot goes to a waiting request of a higher class first, if that class has room
+        for higher in PRIORITY_ORDER[:PRIORITY_ORDER.index(route_class)]:
+            if self._waiting[higher] and self._active[higher] < self.limits[higher]:
+                return False
+        return True
+
+    def retry_after(self, route_class):
+        """Rough seconds until a queued request of this class would be admitted."""
+        backlog = self._waiting[route_class] + 1
+        estimate = self._hold_seconds[route_class] * backlog / max(1, self.limits[route_class])
+        return min(MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(estimate)))
+
+    def acquire(self, route_class):
+        """Admits a request, waiting up to the class timeout. Returns a Ticket or raises Rejected."""
+        stats = self.stats[route_class]
+        with self._condition:
+            if not self._waiting[route_class] and self._can_admit(route_class):
+                return self._admit(route_class, 0.0)
+            if self._waiting[route_class] >= self.queue_lengths[route_class]:
+                stats['rejected_queue_full'] += 1
+                raise Rejected(route_class, 'queue full', self.retry_after(route_class))
+            self._waiting[route_class] += 1
+            stats['queued'] += 1
+            stats['max_queue_depth'] = max(stats['max_queue_depth'], self._waiting[route_class])
+            started = time.perf_counter()
+            deadline = started + self.timeouts[route_class]
+            try:
+                while not self._can_admit(route_class):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        stats['rejected_timeout'] += 1
+                        raise Rejected(route_class, 'queue timeout', self.retry_after(route_class))
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting[route_class] -= 1
+            return self._admit(route_class, time.perf_counter() - started)
+
+    def _admit(self, route_class, waited):
+        self._active[route_class] += 1
+        self.stats[route_class]['admitted'] += 1
+        self.stats[route_class]['queue_wait_ms_total'] += waited * 1000
+        return Ticket(self, route_class)
+
+    def release(self, ticket):
+        held = time.perf_counter() - ticket.admitted_at
+        with self._condition:
+            self._active[ticket.route_class] -= 1
+            self._hold_seconds[ticket.route_class] = 0.8 * self._hold_seconds[ticket.route_class] + 0.2 * held
+            self._condition.notify_all()
+
+    def metrics(self):
+        with self._condition:
+            classes = {}
+            for name in PRIORITY_ORDER:
+                stats = dict(self.stats[name])
+                queue_wait_ms_total = stats.pop('queue_wait_ms_total')
+                stats.update(active=self._active[name], queue_depth=self._waiting[name], limit=self.limits[name],
+                             queue_length=self.queue_lengths[name], timeout_seconds=self.timeouts[name],
+                             avg_hold_ms=round(self._hold_seconds[name] * 1000, 3),
+                             avg_queue_wait_ms=round(queue_wait_ms_total / stats['admitted'], 3) if stats['admitted'] else None)
+                classes[name] = stats
+            return {'enabled': ADMISSION_CONTROL_ENABLED, 'max_concurrent': self.max_concurrent,
+                    'active': sum(self._active.values()), 'classes': classes}
+
+controller = AdmissionController()
+
+# --- Flask integration ---
+def init_app(app):
+    """Admits each request before its view runs. The slot is held until the response has been sent,
+       including streamed pages, and answered with 503 when the request's class is saturated."""
+    if not ADMISSION_CONTROL_ENABLED:
+        return
+    from flask import g, request, jsonify, make_response
+
+    @app.before_request
+    def admit_request():
+        route_class = classify(request.endpoint, request.method)
+        if route_class is None:
+            return None
+        try:
+            g.admission_ticket = controller.acquire(route_class)
+        except Rejected as e:
+            logger.warning("Rejected %s %s: %s", request.method, request.path, e.reason,
+                           extra={'event': 'admission.rejected', 'fields': {'route_class': e.route_class}})
+            message = "The store system is busy. Please try again in a moment."
+            if request.path.startswith('/api/') or request.accept_mimetypes.best == 'application/json':
+                response = make_response(jsonify({'error': message}), 503)
+            else:
+                response = make_response(message, 503)
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        return None
+
+    @app.after_request
+    def hold_until_sent(response):
+        ticket = g.pop('admission_ticket', None)
+        if ticket is not None:
+            response.call_on_close(ticket.release)
+        return response
+
+    @app.teardown_request
+    def release_on_error(error):
+        ticket = g.pop('admission_ticket', None) # Only still set when after_request did not run
+        if ticket is not None:
+            ticket.release()
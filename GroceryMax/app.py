@@ -1,19 +1,44 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, g, flash
+from flask import Flask, render_template, stream_template, request, redirect, url_for, g, flash, get_flashed_messages, session, jsonify, make_response
+import app_logging
 import database_operations
+import change_feed
+import http_caching
+import fragment_cache
+import compression
+import offline_sales
+import sales_analytics
+import reorder_engine
+import catalog_snapshot
+import bulk_operations
+import archival
+import profiling
+import statement_cache
+import checkout_queue
+import admission_control
+import query_cache
 import datetime
 import json
 import math
 import os # Import os
+import time
+import uuid
 from dotenv import load_dotenv # If using .env file
 
 load_dotenv() # Load environment variables from .env
 
+logger = app_logging.get_logger(__name__)
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY')
+app_logging.init_app(app)
+admission_control.init_app(app)
+profiling.profiler.init_app(app)
+fragment_cache.init_app(app)
+compression.init_app(app)
 
 if not app.secret_key:
-    print("CRITICAL ERROR: FLASK_SECRET_KEY environment variable not set. Application will not run securely.")
+    logger.critical("FLASK_SECRET_KEY environment variable not set. Application will not run securely.")
     raise ValueError("No FLASK_SECRET_KEY set. Please set this environment variable.")
 
 # --- Database Connection Management ---
@@ -21,14 +46,74 @@ def get_db():
     if 'db' not in g or g.db is None or not g.db.is_connected():
         g.db = database_operations.create_connection()
     if g.db is None: # If connection still failed
-        print("CRITICAL: Failed to establish database connection in get_db.")
+        logger.critical("Failed to establish database connection.")
     return g.db
 
+# After a write, this session reads from the primary for long enough that any replica still in use has caught up
+READ_YOUR_WRITES_SECONDS = database_operations.REPLICA_MAX_LAG_SECONDS + database_operations.REPLICA_LAG_CHECK_SECONDS
+
+def get_read_db():
+    """Connection for read-only pages: a replica when configured, the primary right after this session wrote."""
+    if time.time() - session.get('last_write_at', 0) < READ_YOUR_WRITES_SECONDS:
+        return get_db()
+    if 'read_db' not in g or g.read_db is None or not g.read_db.is_connected():
+        g.read_db = database_operations.create_read_connection()
+    if g.read_db is None:
+        logger.critical("Failed to establish read database connection.")
+    return g.read_db
+
 @app.teardown_appcontext
 def close_db(error):
     db = g.pop('db', None)
     if db is not None and db.is_connected():
         db.close()
+    read_db = g.pop('read_db', None)
+    if read_db is not None and read_db.is_connected():
+        read_db.close() # Pooled replica connections go back to their pool
+
+@app.after_request
+def remember_write(response):
+    if request.method == 'POST' and response.status_code < 400:
+        session['last_write_at'] = time.time()
+    return response
+
+def init_extension_tables():
+    """Creates the supporting tables (stock reservations, product listing, etc.) once at startup."""
+    conn = database_operations.create_connection()
+    if conn is None:
+        logger.warning("Database unavailable at startup; extension tables were not verified.")
+        return
+    try:
+        if database_operations.ensure_extension_tables(conn):
+            database_operations.ensure_product_listing(conn)
+            database_operations.ensure_customer_stats(conn)
+        database_operations.purge_expired_reservations(conn)
+    finally:
+        if conn.is_connected(): conn.close()
+
+init_extension_tables()
+database_operations.check_replicas()
+change_feed.subscriber.start()
+offline_sales.sync_worker.start()
+sales_analytics.refresh_worker.start()
+reorder_engine.refresh_worker.start()
+catalog_snapshot.refresh_worker.start()
+archival.archive_worker.start()
+if checkout_queue.CHECKOUT_QUEUE_ENABLED:
+    checkout_queue.checkout_queue.start()
+
+@app.after_request
+def sync_change_feed(response):
+    # Writes made by this worker invalidate its own caches before the next request is served
+    if request.method == 'POST':
+        change_feed.subscriber.poll_now()
+    return response
+
+def get_cart_token():
+    """Returns the POS cart token for this session, creating one if needed."""
+    if 'cart_token' not in session:
+        session['cart_token'] = uuid.uuid4().hex
+    return session['cart_token']
 
 @app.context_processor
 def inject_current_year():
@@ -37,7 +122,7 @@ def inject_current_year():
 # --- Main Route ---
 @app.route('/')
 def index():
-    conn = get_db()
+    conn = get_read_db()
     stats = {
         'total_products': 'N/A',
         'total_categories': 'N/A',
@@ -56,7 +141,7 @@ def index():
 # --- Product Routes ---
 @app.route('/products')
 def show_products():
-    conn = get_db()
+    conn = get_read_db()
     search_query = request.args.get('search_query', '').strip()
     try:
         page = int(request.args.get('page', 1))
@@ -67,11 +152,17 @@ def show_products():
     ITEMS_PER_PAGE = 10
     products_list = []
     total_matching_products = 0
+    validators = None
 
     if not conn:
         flash("Database connection error. Could not fetch products.", "error")
     else:
-        result = database_operations.fetch_products_with_category_names(
+        validators = http_caching.resource_validators(
+            conn, f"products|{search_query}|{page}|{ITEMS_PER_PAGE}",
+            [database_operations.ENTITY_PRODUCT, database_operations.ENTITY_CATEGORY])
+        not_modified = http_caching.not_modified_response(validators)
+        if not_modified: return not_modified
+        result = query_cache.fetch_products_page(
             conn,
             search_term=search_query if search_query else None,
             page=page,
@@ -84,12 +175,18 @@ def show_products():
     if page > total_pages and total_pages > 0:
         page = total_pages # Adjust if current page is out of bounds
 
-    return render_template('products.html',
-                           title='Product Catalog',
-                           products=products_list,
-                           current_page=page,
-                           total_pages=total_pages,
-                           search_query=search_query)
+    catalog_version = None
+    if conn:
+        catalog_version = http_caching.data_version_token(
+            conn, [database_operations.ENTITY_PRODUCT, database_operations.ENTITY_CATEGORY])
+    response = make_response(render_template('products.html',
+                                             title='Product Catalog',
+                                             products=products_list,
+                                             current_page=page,
+                                             total_pages=total_pages,
+                                             search_query=search_query,
+                                             catalog_version=catalog_version))
+    return http_caching.apply_validators(response, validators)
 
 @app.route('/products/add', methods=['GET', 'POST'])
 def add_product_route():
@@ -209,16 +306,63 @@ def delete_product_route(product_id):
         flash(f"Failed to delete Product ID {product_id}. It may be referenced in sales or no longer exist.", "error")
     return redirect(url_for('show_products'))
 
+# Bulk updates run as background jobs; clients poll the job URL for progress
+@app.route('/api/products/bulk/prices', methods=['POST'])
+def api_bulk_prices():
+    payload = request.get_json(silent=True) or {}
+    mode = payload.get('mode', database_operations.PRICE_CHANGE_PERCENT)
+    if mode not in (database_operations.PRICE_CHANGE_PERCENT, database_operations.PRICE_CHANGE_ABSOLUTE):
+        return jsonify({'message': "mode must be 'percent' or 'absolute'."}), 400
+    try:
+        category_id = int(payload.get('category_id'))
+        amount = float(payload.get('amount'))
+    except (TypeError, ValueError):
+        return jsonify({'message': "category_id and amount are required numbers."}), 400
+    if not math.isfinite(amount) or amount == 0:
+        return jsonify({'message': "amount must be a non-zero number."}), 400
+    job = bulk_operations.start_price_change(category_id, mode, amount)
+    return jsonify(job.to_dict()), 202, {'Location': url_for('api_bulk_job', job_id=job.job_id)}
+
+@app.route('/api/products/bulk/stock', methods=['POST'])
+def api_bulk_stock():
+    upload = request.files.get('file')
+    text = upload.read().decode('utf-8-sig', errors='replace') if upload else request.get_data(as_text=True)
+    counts, errors = bulk_operations.parse_stock_csv(text)
+    if errors or not counts:
+        return jsonify({'message': "No stock counts imported.", 'errors': errors or ["The CSV has no rows."]}), 400
+    mode = request.values.get('mode', database_operations.STOCK_COUNT_SET)
+    if mode not in (database_operations.STOCK_COUNT_SET, database_operations.STOCK_COUNT_ADJUST):
+        return jsonify({'message': "mode must be 'set' or 'adjust'."}), 400
+    notes = (request.values.get('notes') or "Stock count").strip()[:255]
+    job = bulk_operations.start_stock_count(counts, mode, notes)
+    return jsonify(job.to_dict()), 202, {'Location': url_for('api_bulk_job', job_id=job.job_id)}
+
+@app.route('/api/products/bulk/jobs')
+def api_bulk_jobs():
+    return jsonify({'jobs': bulk_operations.list_jobs()})
+
+@app.route('/api/products/bulk/jobs/<job_id>')
+def api_bulk_job(job_id):
+    job = bulk_operations.get_job(job_id)
+    if job is None:
+        return jsonify({'message': f"Job {job_id} not found."}), 404
+    return jsonify(job)
+
 # --- Category Routes ---
 @app.route('/categories')
 def show_categories():
-    conn = get_db()
+    conn = get_read_db()
     category_list = []
+    validators = None
     if conn:
+        validators = http_caching.resource_validators(conn, 'categories', [database_operations.ENTITY_CATEGORY])
+        not_modified = http_caching.not_modified_response(validators)
+        if not_modified: return not_modified
         category_list = database_operations.fetch_categories(conn)
     else:
         flash("Database connection error. Could not fetch categories.", "error")
-    return render_template('categories.html', title='Manage Categories', categories=category_list)
+    response = make_response(render_template('categories.html', title='Manage Categories', categories=category_list))
+    return http_caching.apply_validators(response, validators)
 
 @app.route('/categories/add', methods=['GET', 'POST'])
 def add_category_route():
@@ -292,13 +436,16 @@ def delete_category_route(category_id):
 # --- Customer Routes ---
 @app.route('/customers')
 def show_customers():
-    conn = get_db()
+    conn = get_read_db()
     customer_list = []
+    customer_version = None
     if conn:
         customer_list = database_operations.fetch_customers(conn)
+        customer_version = http_caching.data_version_token(conn, [database_operations.ENTITY_CUSTOMER])
     else:
         flash("Database connection error. Could not fetch customers.", "error")
-    return render_template('customers.html', title='Manage Customers', customers=customer_list)
+    return render_template('customers.html', title='Manage Customers', customers=customer_list,
+                           customer_version=customer_version)
 
 @app.route('/customers/add', methods=['GET', 'POST'])
 def add_customer_route():
@@ -325,6 +472,41 @@ def add_customer_route():
             return render_template('add_customer.html', title='Add New Customer', form_data=request.form)
     return render_template('add_customer.html', title='Add New Customer')
 
+@app.route('/customers/<int:customer_id>')
+def customer_details_route(customer_id):
+    conn = get_read_db()
+    if not conn:
+        flash("Database connection failed.", "error")
+        return redirect(url_for('show_customers'))
+    customer = database_operations.get_customer_by_id(conn, customer_id)
+    if not customer:
+        flash(f"Customer ID {customer_id} not found.", "error")
+        return redirect(url_for('show_customers'))
+    before = None
+    before_date, before_id = request.args.get('before_date'), request.args.get('before_id', type=int)
+    if before_date and before_id:
+        try:
+            before = (datetime.datetime.fromisoformat(before_date), before_id)
+        except ValueError:
+            flash("Invalid page position; showing the latest purchases.", "warning")
+    stats = database_operations.get_customer_stats(conn, customer_id)
+    purchases, next_before = database_operations.fetch_customer_purchase_history(conn, customer_id, before=before)
+    return render_template('customer_details.html',
+                           title=f"{customer['FirstName']} {customer['LastName'] or ''}".strip(),
+                           customer=customer, stats=stats, purchases=purchases,
+                           next_before=next_before, is_first_page=before is None)
+
+@app.route('/api/customers/<int:customer_id>/stats')
+def api_customer_stats(customer_id):
+    """Loyalty lookup for the till: lifetime spend, visits, last purchase and top categories."""
+    conn = get_read_db()
+    if not conn:
+        return jsonify({'message': "Database connection failed."}), 503
+    stats = database_operations.get_customer_stats(conn, customer_id)
+    if stats is None:
+        return jsonify({'message': "Could not load customer stats."}), 500
+    return jsonify(stats)
+
 @app.route('/customers/edit/<int:customer_id>', methods=['GET', 'POST'])
 def edit_customer_route(customer_id):
     conn = get_db()
@@ -376,13 +558,11 @@ def delete_customer_route(customer_id):
     return redirect(url_for('show_customers'))
 
 # --- Sales Routes ---
+# Bump when sale_details.html changes, so cached sale pages are revalidated into the new layout
+SALE_DETAILS_TEMPLATE_VERSION = 1
+
 @app.route('/sales/new', methods=['GET', 'POST'])
 def new_sale_route():
-    conn = get_db()
-    if not conn:
-        flash("Database connection failed. Please try again later.", "error")
-        return redirect(url_for('index'))
-
     if request.method == 'POST':
         cart_data_json = request.form.get('cart_data')
         customer_id_str = request.form.get('customer_id')
@@ -400,46 +580,169 @@ def new_sale_route():
             flash("Cart is empty. Nothing to process.", "info")
             return redirect(url_for('new_sale_route'))
 
+        catalog = catalog_snapshot.catalog
+        if catalog.loaded:
+            # Rejects unknown products early; checkout charges the locked product's price (or the reserved price), never the browser's
+            items_sold, problems = catalog.snapshot.validate_cart(items_sold)
+            if problems:
+                for problem in problems:
+                    flash(problem, "error")
+                return redirect(url_for('new_sale_route'))
+
         customer_id = None
         if customer_id_str and customer_id_str.isdigit():
             customer_id = int(customer_id_str)
         elif customer_id_str: # Non-empty but not digit
              flash("Invalid customer ID format. Processing as guest sale.", "warning")
 
-        sale_id = database_operations.process_new_sale(
-            conn, items_sold=items_sold, customer_id=customer_id, payment_method=payment_method
-        )
+        # Idempotency key of this checkout: if the commit goes through but its acknowledgement is lost,
+        # the offline replay below finds the recorded sale instead of recording it again
+        client_token = uuid.uuid4().hex
+        errors = []
+        if checkout_queue.CHECKOUT_QUEUE_ENABLED:
+            # Committed together with other tills' sales arriving within a few milliseconds, on the
+            # dispatcher's connection; this request does not hold one of its own while it waits
+            sale_id = checkout_queue.checkout_queue.process_sale(
+                items_sold, customer_id=customer_id, payment_method=payment_method,
+                cart_token=session.get('cart_token'), errors=errors, client_token=client_token)
+        else:
+            conn = get_db()
+            if not conn:
+                return queue_offline_sale(items_sold, customer_id, payment_method, client_token)
+            sale_id = database_operations.process_new_sale(
+                conn, items_sold=items_sold, customer_id=customer_id, payment_method=payment_method,
+                cart_token=session.get('cart_token'), errors=errors, client_token=client_token
+            )
         if sale_id:
+            session.pop('cart_token', None) # Next sale starts with a fresh cart
             flash(f"Sale successfully processed! Sale ID: {sale_id}", "success")
             return redirect(url_for('sales_history_route'))
+        elif errors and database_operations.is_connection_error(errors[-1]):
+            # Database unreachable or lost mid-sale; the commit may or may not have been applied
+            return queue_offline_sale(items_sold, customer_id, payment_method, client_token)
         else:
             flash("Failed to process the sale. Stock might be insufficient, or a database error occurred. Please review cart and try again.", "error")
             return redirect(url_for('new_sale_route'))
 
     # GET request
-    products_for_dropdown = []
-    all_products_data = database_operations.fetch_products_with_category_names(conn, page=1, items_per_page=99999)
-    if all_products_data and 'products' in all_products_data:
-        products_for_dropdown = all_products_data['products']
+    conn = get_db()
+    if not conn:
+        snapshot = offline_sales.load_pos_snapshot()
+        if not snapshot['products']:
+            flash("Database connection failed and no offline product list is available. Please try again later.", "error")
+            return redirect(url_for('index'))
+        flash(f"Database unavailable. Working offline from the product list saved at {snapshot['saved_at']}; sales will be synced automatically.", "warning")
+        return render_template('new_sale.html',
+                               title='New Sale / Point of Sale (Offline)',
+                               products=snapshot['products'],
+                               customers=snapshot['customers'],
+                               catalog_version=None,
+                               customer_version=None,
+                               offline_mode=True,
+                               flashed_messages=get_flashed_messages(with_categories=True))
     customers = database_operations.fetch_customers(conn)
-    return render_template('new_sale.html',
+    # A reloaded POS page starts with an empty cart, so drop anything it was still holding
+    database_operations.release_reservations(conn, get_cart_token())
+    customer_version = http_caching.data_version_token(conn, [database_operations.ENTITY_CUSTOMER])
+    catalog = catalog_snapshot.catalog
+    if catalog.loaded:
+        snapshot = catalog.snapshot
+        catalog_version = f"snapshot:{snapshot.generation}"
+        products_for_dropdown = snapshot.rows()
+    else:
+        catalog_version = http_caching.data_version_token(
+            conn, [database_operations.ENTITY_PRODUCT, database_operations.ENTITY_CATEGORY])
+        # Products are streamed from a server-side cursor while the page is written out
+        products_for_dropdown = database_operations.iter_products_for_sale(conn)
+    # Flashes are taken before streaming: the session cookie is written before the template runs
+    return stream_template('new_sale.html',
                            title='New Sale / Point of Sale',
                            products=products_for_dropdown,
-                           customers=customers)
+                           customers=customers,
+                           catalog_version=catalog_version,
+                           customer_version=customer_version,
+                           flashed_messages=get_flashed_messages(with_categories=True))
+
+@app.route('/sales/cart/reserve', methods=['POST'])
+def reserve_cart_item_route():
+    conn = get_db()
+    if not conn:
+        return jsonify({'success': False, 'message': "Database connection failed."}), 503
+    payload = request.get_json(silent=True) or {}
+    try:
+        product_id = int(payload.get('product_id'))
+        quantity = int(payload.get('quantity'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': "Invalid product or quantity."}), 400
+
+    result = database_operations.reserve_stock(conn, get_cart_token(), product_id, quantity)
+    result['unit_price'] = float(result['unit_price']) if result['unit_price'] is not None else None
+    return jsonify(result), (200 if result['success'] else 409)
+
+@app.route('/api/catalog/products/<int:product_id>')
+def api_catalog_product(product_id):
+    catalog = catalog_snapshot.catalog
+    if not catalog.loaded:
+        return jsonify({'message': "Catalog not loaded yet."}), 503
+    product = catalog.snapshot.lookup(product_id)
+    if product is None:
+        return jsonify({'message': f"Product ID {product_id} not found."}), 404
+    return jsonify(product)
+
+@app.route('/api/catalog/search')
+def api_catalog_search():
+    catalog = catalog_snapshot.catalog
+    if not catalog.loaded:
+        return jsonify({'message': "Catalog not loaded yet."}), 503
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return jsonify({'results': catalog.snapshot.search(request.args.get('q', ''), limit)})
+
+@app.route('/api/catalog/validate_cart', methods=['POST'])
+def api_validate_cart():
+    catalog = catalog_snapshot.catalog
+    if not catalog.loaded:
+        return jsonify({'message': "Catalog not loaded yet."}), 503
+    payload = request.get_json(silent=True) or {}
+    items, problems = catalog.snapshot.validate_cart(payload.get('items') or [])
+    return jsonify({'valid': not problems, 'items': items, 'problems': problems})
+
+@app.route('/sales/cart/release', methods=['POST'])
+def release_cart_item_route():
+    conn = get_db()
+    if not conn:
+        return jsonify({'success': False, 'message': "Database connection failed."}), 503
+    payload = request.get_json(silent=True) or {}
+    product_id = payload.get('product_id')
+    try:
+        product_id = int(product_id) if product_id is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': "Invalid product ID."}), 400
+    success = database_operations.release_reservations(conn, get_cart_token(), product_id)
+    return jsonify({'success': success}), (200 if success else 500)
 
 @app.route('/sales/history')
 def sales_history_route():
-    conn = get_db()
+    conn = get_read_db()
     sales_records = []
+    validators = None
     if conn:
-        sales_records = database_operations.fetch_sales_history(conn)
+        # Customer edits change the names shown next to each sale
+        validators = http_caching.resource_validators(
+            conn, 'sales_history', [database_operations.ENTITY_SALE, database_operations.ENTITY_CUSTOMER])
+        not_modified = http_caching.not_modified_response(validators)
+        if not_modified: return not_modified
+        # Rows are fetched in batches as the table is written out, keeping memory per request bounded
+        sales_records = database_operations.iter_sales_history(conn)
     else:
         flash("Database connection error. Could not fetch sales history.", "error")
-    return render_template('sales_history.html', title='Sales History', sales_records=sales_records)
+    # Flashes are taken before streaming: the session cookie is written before the template runs
+    response = make_response(stream_template('sales_history.html', title='Sales History', sales_records=sales_records,
+                                             flashed_messages=get_flashed_messages(with_categories=True)))
+    return http_caching.apply_validators(response, validators)
 
 @app.route('/sales/details/<int:sale_id>')
 def sale_details_route(sale_id):
-    conn = get_db()
+    conn = get_read_db()
     if not conn:
         flash("Database connection failed.", "error")
         return redirect(url_for('sales_history_route'))
@@ -450,25 +753,257 @@ def sale_details_route(sale_id):
     if not sale_main_info:
         flash(f"Sale with ID {sale_id} not found.", "error")
         return redirect(url_for('sales_history_route'))
-    return render_template('sale_details.html',
-                           title=f"Details for Sale ID: {sale_id}",
-                           sale=sale_main_info,
-                           items=sale_items)
+
+    # Keyed on this sale's own rows, so other sales don't change it. Not immutable: the page shows
+    # customer and product names, which can still be edited after the sale
+    validators = http_caching.content_validators(
+        f"sale|{sale_id}|v{SALE_DETAILS_TEMPLATE_VERSION}", (sale_main_info, sale_items))
+    not_modified = http_caching.not_modified_response(validators)
+    if not_modified: return not_modified
+    response = make_response(render_template('sale_details.html',
+                                             title=f"Details for Sale ID: {sale_id}",
+                                             sale=sale_main_info,
+                                             items=sale_items))
+    return http_caching.apply_validators(response, validators)
+
+def queue_offline_sale(items_sold, customer_id, payment_method, client_token):
+    queue_id = offline_sales.enqueue_sale(items_sold, customer_id=customer_id, payment_method=payment_method,
+                                          client_token=client_token)
+    if queue_id:
+        session.pop('cart_token', None)
+        flash(f"Database unavailable. Sale recorded offline (queue #{queue_id}) and will be synced automatically.", "warning")
+    else:
+        flash("Database unavailable and the sale could not be saved offline. Please record it manually.", "error")
+    return redirect(url_for('new_sale_route'))
+
+@app.route('/sales/offline')
+def offline_sales_route():
+    return render_template('offline_sales.html',
+                           title='Offline Sales Queue',
+                           entries=offline_sales.fetch_queue(),
+                           counts=offline_sales.queue_counts())
+
+@app.route('/sales/offline/sync', methods=['POST'])
+def sync_offline_sales_route():
+    offline_sales.sync_worker.sync_soon()
+    flash("Offline sales sync started. Refresh this page to see the results.", "info")
+    return redirect(url_for('offline_sales_route'))
+
+@app.route('/sales/offline/dismiss/<int:queue_id>', methods=['POST'])
+def dismiss_offline_sale_route(queue_id):
+    if offline_sales.dismiss_conflict(queue_id):
+        flash(f"Offline sale #{queue_id} dismissed.", "success")
+    else:
+        flash(f"Failed to dismiss offline sale #{queue_id}.", "error")
+    return redirect(url_for('offline_sales_route'))
 
 # --- Inventory Report Route ---
+REORDER_REPORT_LIMIT = 50
+
 @app.route('/inventory/low_stock')
 def low_stock_report_route():
-    conn = get_db()
+    conn = get_read_db()
     low_stock_items = []
     stock_threshold = 10 # Default threshold
+    validators = None
+    # Precomputed by the background job; reading it costs nothing here
+    reorder_status = reorder_engine.engine.status()
+    reorder_items = reorder_engine.engine.suggestions(limit=REORDER_REPORT_LIMIT)
     if conn:
+        validators = http_caching.resource_validators(
+            conn, f"low_stock|{stock_threshold}|reorder:{reorder_status['computed_at']}",
+            [database_operations.ENTITY_PRODUCT, database_operations.ENTITY_CATEGORY])
+        not_modified = http_caching.not_modified_response(validators)
+        if not_modified: return not_modified
         low_stock_items = database_operations.fetch_low_stock_products(conn, stock_threshold)
     else:
         flash("Database connection error. Could not fetch low stock report.", "error")
-    return render_template('low_stock_report.html',
-                           title=f"Low Stock Report (Below {stock_threshold} Units)",
-                           items=low_stock_items,
-                           threshold=stock_threshold)
+    response = make_response(render_template('low_stock_report.html',
+                                             title=f"Low Stock Report (Below {stock_threshold} Units)",
+                                             items=low_stock_items,
+                                             threshold=stock_threshold,
+                                             reorder_items=reorder_items,
+                                             reorder_status=reorder_status))
+    return http_caching.apply_validators(response, validators)
+
+@app.route('/api/inventory/reorder')
+def api_reorder_suggestions():
+    priority = request.args.get('priority')
+    limit = request.args.get('limit', type=int)
+    return jsonify({'results': reorder_engine.engine.suggestions(limit=limit, priority=priority),
+                    'status': reorder_engine.engine.status()})
+
+# --- Sales Analytics Routes ---
+ANALYTICS_PERIODS = {'day': 7, 'week': 8} # Default number of periods shown per granularity
+ANALYTICS_MAX_PERIODS = 90
+ANALYTICS_MAX_LIMIT = 100
+
+def analytics_query_args():
+    period = request.args.get('period', 'day')
+    if period not in ANALYTICS_PERIODS:
+        period = 'day'
+    periods = min(max(request.args.get('periods', ANALYTICS_PERIODS[period], type=int), 1), ANALYTICS_MAX_PERIODS)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), ANALYTICS_MAX_LIMIT)
+    return period, periods, limit
+
+@app.route('/reports/stores')
+def store_report_route():
+    """Totals, best sellers and low stock for every store, queried in parallel."""
+    days = min(max(request.args.get('days', 30, type=int), 1), 3650)
+    since_date = datetime.date.today() - datetime.timedelta(days=days)
+    summaries = database_operations.fetch_store_summaries(since_date)
+    top_products, top_unavailable = database_operations.fetch_top_products_all_stores(since_date, limit=10)
+    low_stock, low_stock_unavailable = database_operations.fetch_low_stock_all_stores()
+    unavailable = sorted({s['StoreID'] for s in summaries if not s['Available']} | set(top_unavailable) | set(low_stock_unavailable))
+    if unavailable:
+        flash(f"Could not reach store(s) {', '.join(map(str, unavailable))}; their figures are missing.", "warning")
+    return render_template('store_report.html',
+                           title='Store Comparison',
+                           days=days,
+                           current_store_id=database_operations.STORE_ID,
+                           summaries=summaries,
+                           top_products=top_products,
+                           low_stock=low_stock)
+
+@app.route('/reports/analytics')
+def sales_analytics_route():
+    period, periods, limit = analytics_query_args()
+    product_id = request.args.get('product_id', type=int)
+    engine = sales_analytics.analytics
+    top_sellers = engine.top_sellers(period, periods, limit)
+    pairs = engine.top_pairs(20)
+    together = engine.bought_together(product_id, limit) if product_id is not None else []
+
+    # One name lookup for every product on the page; the aggregates themselves only hold IDs
+    product_ids = {p['ProductID'] for row in top_sellers for p in row['Products']}
+    product_ids.update(p['ProductID'] for p in together)
+    product_ids.update(pid for pair in pairs for pid in (pair['ProductA'], pair['ProductB']))
+    if product_id is not None:
+        product_ids.add(product_id)
+    conn = get_read_db()
+    product_names = database_operations.fetch_product_names(conn, sorted(product_ids)) if conn else {}
+    return render_template('sales_analytics.html',
+                           title='Sales Analytics',
+                           period=period,
+                           periods=periods,
+                           limit=limit,
+                           top_sellers=top_sellers,
+                           pairs=pairs,
+                           product_id=product_id,
+                           together=together,
+                           product_names=product_names,
+                           status=engine.status())
+
+@app.route('/reports/analytics/refresh', methods=['POST'])
+def refresh_sales_analytics_route():
+    sales_analytics.refresh_worker.refresh_soon()
+    flash("Analytics refresh started. New sales will appear in a few seconds.", "info")
+    return redirect(url_for('sales_analytics_route'))
+
+@app.route('/api/analytics/top_sellers')
+def api_top_sellers():
+    period, periods, limit = analytics_query_args()
+    results = sales_analytics.analytics.top_sellers(period, periods, limit)
+    return jsonify({
+        'period': period,
+        'results': [dict(row, PeriodStart=row['PeriodStart'].isoformat(), PeriodEnd=row['PeriodEnd'].isoformat())
+                    for row in results],
+        'status': sales_analytics.analytics.status(),
+    })
+
+@app.route('/api/analytics/bought_together/<int:product_id>')
+def api_bought_together(product_id):
+    _, _, limit = analytics_query_args()
+    return jsonify({'product_id': product_id,
+                    'results': sales_analytics.analytics.bought_together(product_id, limit),
+                    'status': sales_analytics.analytics.status()})
+
+@app.route('/api/analytics/pairs')
+def api_top_pairs():
+    _, _, limit = analytics_query_args()
+    return jsonify({'results': sales_analytics.analytics.top_pairs(limit),
+                    'status': sales_analytics.analytics.status()})
+
+# --- Admin Routes ---
+def check_profiling_access():
+    """Returns an error response unless profiling is enabled and the request carries the profiling token."""
+    if not profiling.profiler.enabled:
+        return jsonify({'message': "Profiling is disabled (set PROFILE_TOKEN)."}), 404
+    if not profiling.profiler.token_matches(request.headers.get(profiling.PROFILE_HEADER, '')):
+        return jsonify({'message': "Invalid profiling token."}), 403
+    return None
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling_route():
+    denied = check_profiling_access()
+    if denied: return denied
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        rules = []
+        for rule in payload.get('rules') or []:
+            try:
+                rules.append({'endpoint': str(rule['endpoint']), 'method': str(rule.get('method', 'GET')).upper(),
+                              'every': max(int(rule.get('every', 1)), 1),
+                              'remaining': int(rule['remaining']) if rule.get('remaining') is not None else None})
+            except (KeyError, TypeError, ValueError):
+                return jsonify({'message': "Each rule needs an endpoint, and numeric every/remaining."}), 400
+        unknown = sorted({rule['endpoint'] for rule in rules} - set(app.view_functions))
+        if unknown:
+            return jsonify({'message': f"Unknown endpoint(s): {', '.join(unknown)}."}), 400
+        if not profiling.profiler.set_rules(rules):
+            return jsonify({'message': "Could not save profiling rules."}), 500
+    return jsonify(profiling.profiler.status())
+
+@app.route('/admin/profiling/summary')
+def admin_profiling_summary_route():
+    denied = check_profiling_access()
+    if denied: return denied
+    limit = min(max(request.args.get('limit', 50, type=int), 1), profiling.PROFILE_MAX_FILES)
+    stacks, files = profiling.load_folded(profiling.profiler.captured_files(limit))
+    return jsonify(dict(profiling.summarize(stacks), files=len(files)))
+
+# --- Metrics Routes ---
+@app.route('/metrics/rendering')
+def rendering_metrics_route():
+    return jsonify({
+        'fragment_cache': app.jinja_env.fragment_cache.metrics(),
+        'templates': fragment_cache.render_metrics.snapshot(),
+    })
+
+@app.route('/metrics/queries')
+def query_cache_metrics_route():
+    return jsonify(query_cache.product_queries.metrics())
+
+@app.route('/metrics/catalog')
+def catalog_metrics_route():
+    return jsonify(catalog_snapshot.catalog.status())
+
+@app.route('/metrics/archive')
+def archive_metrics_route():
+    conn = get_read_db()
+    return jsonify({'archival': archival.archive_worker.status(),
+                    'tables': database_operations.get_archive_table_sizes(conn) if conn else {}})
+
+@app.route('/metrics/logging')
+def logging_metrics_route():
+    return jsonify(app_logging.metrics())
+
+@app.route('/metrics/admission')
+def admission_metrics_route():
+    return jsonify(admission_control.controller.metrics())
+
+@app.route('/metrics/checkout')
+def checkout_metrics_route():
+    return jsonify(checkout_queue.checkout_queue.metrics())
+
+@app.route('/metrics/statements')
+def statement_metrics_route():
+    return jsonify(statement_cache.metrics())
+
+@app.route('/metrics/replicas')
+def replica_metrics_route():
+    return jsonify({'replicas': database_operations.replica_status(),
+                    'max_lag_seconds': database_operations.REPLICA_MAX_LAG_SECONDS})
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,250 @@
+# app_logging.py
+"""Structured, non-blocking logging.
+
+Log calls only put a record on an in-memory queue; a background listener thread formats it and
+writes it to stdout, so logging never waits on I/O in a request. Each entry carries the request
+ID, the function that logged it, the time spent so far in the enclosing instrumented function
+(or request), and the class of the exception when one is attached with exc_info. Output is one
+JSON object per line (LOG_FORMAT=json, default) or plain text (LOG_FORMAT=text).
+
+High-volume events are sampled: log them with extra={'event': name} and set a rate for that name
+in LOG_SAMPLE_RATES (e.g. "http.request=0.1,sale.processed=0.25"). Warnings and errors are never sampled.
+"""
+import atexit
+import contextvars
+import copy
+import datetime
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_TRACEBACKS = os.environ.get('LOG_TRACEBACKS', '0') == '1'
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+def _parse_sample_rates(setting):
+    rates = {}
+    for entry in filter(None, (part.strip() for part in setting.split(','))):
+        event, _, rate = entry.partition('=')
+        try:
+            rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            pass
+    return rates
+
+LOG_SAMPLE_RATES = _parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', ''))
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+# perf_counter() at the start of the innermost instrumented function or request
+_scope_started_var = contextvars.ContextVar('scope_started', default=None)
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the request ID and elapsed time, and drops sampled-out events.
+       Runs in the thread that logs, before the record is queued."""
+
+    def __init__(self, sample_rates=None):
+        super().__init__()
+        self.sample_rates = LOG_SAMPLE_RATES if sample_rates is None else sample_rates
+        self.sampled_out = 0
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event is not None and record.levelno < logging.WARNING:
+            rate = self.sample_rates.get(event, 1.0)
+            if rate < 1.0:
+                if random.random() >= rate:
+                    self.sampled_out += 1
+                    return False
+                record.sample_rate = rate
+        record.request_id = request_id_var.get()
+        started = _scope_started_var.get()
+        record.duration_ms = round((time.perf_counter() - started) * 1000, 3) if started is not None else None
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records (and counts them) instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Only the cheap parts happen here; the listener thread does the formatting
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            error = record.exc_info[1]
+            record.error_class = type(error).__name__
+            record.error = str(error)
+            record.exc_text = logging.Formatter().formatException(record.exc_info) if LOG_TRACEBACKS else None
+            record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    FIELDS = ('request_id', 'duration_ms', 'event', 'error_class', 'error', 'sample_rate')
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'function': record.funcName,
+            'message': record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry['traceback'] = record.exc_text
+        if record.threadName != 'MainThread' and not entry.get('request_id'):
+            entry['thread'] = record.threadName
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development."""
+
+    def format(self, record):
+        parts = [datetime.datetime.fromtimestamp(record.created).strftime('%H:%M:%S.%f')[:-3],
+                 record.levelname, f"{record.name}.{record.funcName}"]
+        request_id = getattr(record, 'request_id', None)
+        if request_id: parts.append(f"[{request_id}]")
+        line = ' '.join(parts) + f": {record.getMessage()}"
+        if getattr(record, 'error_class', None):
+            line += f" ({record.error_class}: {record.error})"
+        if getattr(record, 'duration_ms', None) is not None:
+            line += f" [{record.duration_ms} ms]"
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+_queue_handler = None
+_context_filter = None
+_listener = None
+_configure_lock = threading.Lock()
+
+def _start_listener():
+    global _listener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop() # Flushes everything still queued
+
+def configure_logging():
+    """Routes all logging through the queue handler. Safe to call more than once."""
+    global _queue_handler, _context_filter
+    with _configure_lock:
+        if _queue_handler is not None:
+            return
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _context_filter = ContextFilter()
+        _queue_handler.addFilter(_context_filter)
+        root = logging.getLogger()
+        root.addHandler(_queue_handler)
+        root.setLevel(LOG_LEVEL)
+        _start_listener()
+        atexit.register(_stop_listener)
+        # The listener thread does not survive fork (e.g. gunicorn --preload); children start their own
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_start_listener)
+
+def get_logger(name):
+    """Returns the logger for a module, configuring logging on first use."""
+    configure_logging()
+    return logging.getLogger(name)
+
+def instrument_functions(namespace, module_name):
+    """Wraps the public functions defined in a module so log entries inside them report their duration."""
+    for name, value in list(namespace.items()):
+        if name.startswith('_') or not callable(value) or isinstance(value, type):
+            continue
+        if getattr(value, '__module__', None) != module_name or hasattr(value, '__wrapped__'):
+            continue
+        namespace[name] = _timed(value)
+
+def _timed(function):
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        token = _scope_started_var.set(time.perf_counter())
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _scope_started_var.reset(token)
+    return timed
+
+def metrics():
+    return {
+        'queued': _queue_handler.queue.qsize() if _queue_handler else 0,
+        'dropped': _queue_handler.dropped if _queue_handler else 0,
+        'sampled_out': _context_filter.sampled_out if _context_filter else 0,
+        'sample_rates': LOG_SAMPLE_RATES,
+    }
+
+# --- Flask integration ---
+def init_app(app):
+    """Assigns each request an ID (from the X-Request-ID header when present), echoes it in the
+       response, and logs one 'http.request' entry per request."""
+    from flask import g, request
+    request_logger = get_logger('http')
+
+    @app.before_request
+    def start_request_context():
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = incoming[:64] if incoming else uuid.uuid4().hex[:16]
+        g.request_id_token = request_id_var.set(g.request_id)
+        g.request_started_token = _scope_started_var.set(time.perf_counter())
+
+    @app.after_request
+    def log_request(response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+            request_logger.info("%s %s %s", request.method, request.path, response.status_code,
+                                extra={'event': 'http.request',
+                                       'fields': {'method': request.method, 'path': request.path,
+                                                  'status': response.status_code}})
+        return response
+
+    @app.teardown_request
+    def end_request_context(error):
+        if error is not None:
+            request_logger.error("Unhandled error in %s %s", request.method, request.path, exc_info=error)
+        for var, token_name in ((request_id_var, 'request_id_token'), (_scope_started_var, 'request_started_token')):
+            token = g.pop(token_name, None)
+            if token is not None:
+                try:
+                    var.reset(token)
+                except ValueError:
+                    var.set(None) # Streamed responses finish in a different context
@@ -0,0 +1,149 @@
+# archival.py
+"""Moves closed periods of Sales/SaleDetails and InventoryLogs into the archive tables.
+
+Rows dated before the start of the month ARCHIVE_AFTER_MONTHS months ago are moved in small
+transactions of ARCHIVE_BATCH_SIZE rows with a pause between batches, so archiving never holds
+locks for long or competes with checkout. Reporting reads both tiers (see database_operations),
+so the hot tables stay at a bounded size without changing what any page shows.
+
+Run once from the command line with: python archival.py
+"""
+import datetime
+import os
+import threading
+import time
+
+import app_logging
+import database_operations
+
+logger = app_logging.get_logger(__name__)
+
+# 0 disables archiving
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('ARCHIVE_AFTER_MONTHS', '12'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.environ.get('ARCHIVE_BATCH_PAUSE_SECONDS', '0.5'))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+
+def archive_cutoff(today=None, months=None):
+    """First day of the month `months` months before today's month. Everything dated earlier belongs to a closed period."""
+    today = today or datetime.date.today()
+    months = ARCHIVE_AFTER_MONTHS if months is None else months
+    month_index = today.year * 12 + today.month - 1 - months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+class ArchiveWorker:
+    """Background thread that archives closed periods every ARCHIVE_INTERVAL_SECONDS."""
+
+    def __init__(self, interval=ARCHIVE_INTERVAL_SECONDS, batch_size=ARCHIVE_BATCH_SIZE,
+                 pause=ARCHIVE_BATCH_PAUSE_SECONDS, connection_factory=None):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.connection_factory = connection_factory or database_operations.create_connection
+        self.totals = {'sales': 0, 'sale_lines': 0, 'inventory_logs': 0}
+        self.last_run_at = None
+        self.last_run = None
+        self.running = False
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if ARCHIVE_AFTER_MONTHS <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='archival', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.pause + 5)
+
+    def run_soon(self):
+        self._wake_event.set()
+
+    def _move_all(self, conn, archive_batch, cutoff, width):
+        """Calls archive_batch until a batch comes back short, pausing in between.
+           Returns the summed counts as a tuple of `width` ints, or None on error.
+        """
+        moved = (0,) * width
+        while not self._stop_event.is_set():
+            result = archive_batch(conn, cutoff, self.batch_size)
+            if result is None:
+                return None
+            counts = result if isinstance(result, tuple) else (result,)
+            moved = tuple(total + count for total, count in zip(moved, counts))
+            if counts[0] < self.batch_size:
+                break
+            self._stop_event.wait(self.pause)
+        return moved
+
+    def run_once(self, progress=None):
+        """Archives everything before the current cutoff. Returns a summary dict, or None if the database is unavailable."""
+        conn = self.connection_factory()
+        if conn is None:
+            return None
+        self.running = True
+        started = time.perf_counter()
+        cutoff = archive_cutoff()
+        summary = {'cutoff': cutoff.isoformat(), 'sales': 0, 'sale_lines': 0, 'inventory_logs': 0, 'errors': []}
+        try:
+            sales = self._move_all(conn, database_operations.archive_sales_batch, cutoff, 2)
+            if sales is None:
+                summary['errors'].append("Archiving sales failed; completed batches were kept.")
+            else:
+                summary['sales'], summary['sale_lines'] = sales
+            if progress: progress(summary)
+            logs = self._move_all(conn, database_operations.archive_inventory_logs_batch, cutoff, 1)
+            if logs is None:
+                summary['errors'].append("Archiving inventory logs failed; completed batches were kept.")
+            else:
+                summary['inventory_logs'] = logs[0]
+            if progress: progress(summary)
+        finally:
+            self.running = False
+            if conn.is_connected(): conn.close()
+        for key in self.totals:
+            self.totals[key] += summary[key]
+        summary['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self.last_run_at = datetime.datetime.now()
+        self.last_run = summary
+        return summary
+
+    def status(self):
+        return {
+            'enabled': ARCHIVE_AFTER_MONTHS > 0,
+            'archive_after_months': ARCHIVE_AFTER_MONTHS,
+            'cutoff': archive_cutoff().isoformat() if ARCHIVE_AFTER_MONTHS > 0 else None,
+            'running': self.running,
+            'last_run_at': self.last_run_at.isoformat(timespec='seconds') if self.last_run_at else None,
+            'last_run': self.last_run,
+            'moved_since_start': dict(self.totals),
+        }
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error in archival worker", exc_info=e)
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+archive_worker = ArchiveWorker()
+
+if __name__ == '__main__':
+    if ARCHIVE_AFTER_MONTHS <= 0:
+        print("Archiving is disabled (ARCHIVE_AFTER_MONTHS=0).")
+    else:
+        print(f"Archiving sales and inventory logs dated before {archive_cutoff()}...")
+        result = archive_worker.run_once(progress=lambda summary: print(
+            f"  sales: {summary['sales']}, sale lines: {summary['sale_lines']}, inventory logs: {summary['inventory_logs']}"))
+        if result is None:
+            print("Failed to connect to the database.")
+        else:
+            for error in result['errors']:
+                print(error)
+            print(f"Done in {result['duration_ms']} ms.")
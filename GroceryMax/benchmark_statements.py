@@ -0,0 +1,87 @@
+# benchmark_statements.py
+"""Compares the hot lookups with and without server-side prepared statements.
+
+Runs get_product_by_id and get_sale_by_id against the configured database, first over the text
+protocol (STATEMENT_CACHE_SIZE treated as 0) and then with prepared statements on a pooled
+connection, and prints per-call latency plus the server's statement counters for each run:
+    python benchmark_statements.py [--iterations 2000]
+Only reads data. Needs DB_POOL_SIZE > 0 (the default), since only pooled connections prepare statements.
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import database_operations
+import statement_cache
+
+SERVER_COUNTERS = ('Questions', 'Com_select', 'Com_stmt_prepare', 'Com_stmt_execute', 'Com_stmt_reset')
+
+def server_counters(conn):
+    cursor = conn.cursor(buffered=True)
+    try:
+        cursor.execute("SHOW SESSION STATUS WHERE Variable_name IN (%s)" % ', '.join(['%s'] * len(SERVER_COUNTERS)),
+                       SERVER_COUNTERS)
+        return {name: int(value) for name, value in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def sample_ids(conn, sql, limit):
+    cursor = conn.cursor(buffered=True)
+    try:
+        cursor.execute(sql, (limit,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def run(conn, label, lookups, iterations):
+    before = server_counters(conn)
+    timings = []
+    for i in range(iterations):
+        function, ids = lookups[i % len(lookups)]
+        started = time.perf_counter()
+        function(conn, ids[i % len(ids)])
+        timings.append((time.perf_counter() - started) * 1000)
+    after = server_counters(conn)
+    timings.sort()
+    # The SHOW STATUS call itself adds one to Questions and Com_select (not to Com_stmt_*)
+    deltas = {name: after[name] - before[name] - (1 if name in ('Questions', 'Com_select') else 0) for name in SERVER_COUNTERS}
+    print(f"{label:<10} mean {statistics.mean(timings):7.3f} ms  p50 {timings[len(timings) // 2]:7.3f} ms  "
+          f"p95 {timings[int(len(timings) * 0.95)]:7.3f} ms")
+    print(' ' * 11 + '  '.join(f"{name}={value}" for name, value in deltas.items()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark text-protocol versus prepared hot lookups.")
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    conn = database_operations.create_connection()
+    if conn is None:
+        print("Failed to connect to the database.")
+        return 1
+    try:
+        if statement_cache.statements_for(conn) is None:
+            print("Prepared statements are off for this connection (set DB_POOL_SIZE and STATEMENT_CACHE_SIZE above 0).")
+            return 1
+        product_ids = sample_ids(conn, "SELECT ProductID FROM Products ORDER BY ProductID LIMIT %s", 500)
+        sale_ids = sample_ids(conn, "SELECT SaleID FROM Sales ORDER BY SaleID DESC LIMIT %s", 500)
+        lookups = [(database_operations.get_product_by_id, product_ids)]
+        if sale_ids:
+            lookups.append((database_operations.get_sale_by_id, sale_ids))
+        if not product_ids:
+            print("No products to look up; run seed_db.py first.")
+            return 1
+
+        cache_size = statement_cache.STATEMENT_CACHE_SIZE
+        statement_cache.STATEMENT_CACHE_SIZE = 0
+        try:
+            run(conn, 'text', lookups, args.iterations)
+        finally:
+            statement_cache.STATEMENT_CACHE_SIZE = cache_size
+        run(conn, 'prepared', lookups, args.iterations)
+        return 0
+    finally:
+        if conn.is_connected(): conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+# bulk_operations.py
+"""Bulk product administration: category price changes and stock counts from CSV.
+
+Used by the /api/products/bulk/* routes (as background jobs) and from the command line:
+    python bulk_operations.py prices --category Fruits --percent 5
+    python bulk_operations.py prices --category 3 --amount -0.25
+    python bulk_operations.py stock counts.csv [--adjust] [--notes "Q3 stock take"]
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import app_logging
+import database_operations
+
+logger = app_logging.get_logger(__name__)
+
+# Jobs listed by /api/products/bulk/jobs (and kept in memory by the worker that started them)
+MAX_TRACKED_JOBS = 50
+# Progress is written to BulkJobs at most this often while a job runs
+PROGRESS_SAVE_SECONDS = 1.0
+# Accepted CSV headers (case-insensitive) for the product and quantity columns
+CSV_PRODUCT_COLUMNS = ('product_id', 'productid', 'id')
+CSV_QUANTITY_COLUMNS = ('quantity', 'stockquantity', 'count', 'counted')
+
+def parse_stock_csv(text):
+    """Parses stock-count CSV text with a header row. Returns (counts, errors): counts is a list of
+       (ProductID, quantity) pairs; errors lists rows that could not be read, by line number.
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    headers = {name.strip().lower(): name for name in (reader.fieldnames or [])}
+    product_column = next((headers[name] for name in CSV_PRODUCT_COLUMNS if name in headers), None)
+    quantity_column = next((headers[name] for name in CSV_QUANTITY_COLUMNS if name in headers), None)
+    if not product_column or not quantity_column:
+        return [], ["CSV needs a header row with product_id and quantity columns."]
+    counts, errors = [], []
+    for row in reader:
+        try:
+            counts.append((int(row[product_column]), int(row[quantity_column])))
+        except (TypeError, ValueError):
+            errors.append(f"Line {reader.line_num}: expected whole numbers, got "
+                          f"{row.get(product_column)!r}, {row.get(quantity_column)!r}.")
+    return counts, errors
+
+class BulkJob:
+    """Progress and outcome of one bulk operation running in a background thread.
+       The state is saved to the BulkJobs table, so a job started by one web worker can be polled through any other.
+    """
+
+    def __init__(self, kind, description, connection_factory=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.connection_factory = connection_factory or database_operations.create_connection
+        self.kind = kind
+        self.description = description
+        self.status = 'running'
+        self.processed = 0
+        self.total = None
+        self.summary = None
+        self.error = None
+        self.started_at = datetime.datetime.now()
+        self.finished_at = None
+        self._saved_at = 0.0
+
+    def report_progress(self, processed, total):
+        self.processed, self.total = processed, total
+        if time.monotonic() - self._saved_at >= PROGRESS_SAVE_SECONDS:
+            self.save()
+
+    def save(self):
+        """Writes the job's state to BulkJobs. Returns True on success; failures only affect other workers' view."""
+        self._saved_at = time.monotonic()
+        conn = self.connection_factory()
+        if conn is None:
+            return False
+        try:
+            return database_operations.save_bulk_job(conn, {
+                'JobID': self.job_id, 'Kind': self.kind, 'Description': self.description[:255],
+                'Status': self.status, 'Processed': self.processed, 'Total': self.total,
+                'Summary': json.dumps(self.summary, default=str) if self.summary is not None else None,
+                'Error': self.error, 'StartedAt': self.started_at, 'FinishedAt': self.finished_at})
+        finally:
+            if conn.is_connected(): conn.close()
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'description': self.description,
+            'status': self.status,
+            'processed': self.processed,
+            'total': self.total,
+            'summary': self.summary,
+            'error': self.error,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'finished_at': self.finished_at.isoformat(timespec='seconds') if self.finished_at else None,
+        }
+
+def _job_from_row(row):
+    """Converts a BulkJobs row to the dict returned by BulkJob.to_dict."""
+    return {
+        'job_id': row['JobID'],
+        'kind': row['Kind'],
+        'description': row['Description'],
+        'status': row['Status'],
+        'processed': row['Processed'],
+        'total': row['Total'],
+        'summary': json.loads(row['Summary']) if row['Summary'] else None,
+        'error': row['Error'],
+        'started_at': row['StartedAt'].isoformat(timespec='seconds'),
+        'finished_at': row['FinishedAt'].isoformat(timespec='seconds') if row['FinishedAt'] else None,
+    }
+
+# Jobs started by this worker; their live state is fresher than the saved one
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+def get_job(job_id, connection_factory=None):
+    """Returns a job's state as a dict (see BulkJob.to_dict), or None if it is unknown."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    conn = (connection_factory or database_operations.create_connection)()
+    if conn is None:
+        return None
+    try:
+        row = database_operations.get_bulk_job(conn, job_id)
+        return _job_from_row(row) if row else None
+    finally:
+        if conn.is_connected(): conn.close()
+
+def list_jobs(connection_factory=None):
+    """Returns the most recent jobs of all workers as dicts, newest first
+       (only this worker's jobs if the database is unavailable).
+    """
+    with _jobs_lock:
+        local = {job.job_id: job.to_dict() for job in _jobs.values()}
+    conn = (connection_factory or database_operations.create_connection)()
+    rows = None
+    if conn is not None:
+        try:
+            rows = database_operations.fetch_bulk_jobs(conn, MAX_TRACKED_JOBS)
+        finally:
+            if conn.is_connected(): conn.close()
+    if rows is None:
+        return sorted(local.values(), key=lambda job: job['started_at'], reverse=True)
+    return [local.get(row['JobID']) or _job_from_row(row) for row in rows]
+
+def _run_job(job, operation, connection_factory):
+    conn = connection_factory()
+    try:
+        if conn is None:
+            job.error = "Database connection failed."
+            return
+        job.summary = operation(conn, job.report_progress)
+        if job.summary is None:
+            job.error = "A database error occurred; chunks completed before it were kept."
+    except Exception as e:
+        job.error = str(e)
+    finally:
+        job.status = 'failed' if job.error else 'done'
+        job.finished_at = datetime.datetime.now()
+        if conn is not None and conn.is_connected(): conn.close()
+        if not job.save():
+            logger.error("Bulk job %s finished (%s) but its state could not be saved.", job.job_id, job.status)
+
+def start_job(kind, description, operation, connection_factory=None):
+    """Runs operation(conn, progress) in a background thread with its own connection. Returns the BulkJob."""
+    connection_factory = connection_factory or database_operations.create_connection
+    job = BulkJob(kind, description, connection_factory)
+    job.save() # Before the 202 response, so the first poll finds it on any worker
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+        while len(_jobs) > MAX_TRACKED_JOBS:
+            _jobs.popitem(last=False)
+    thread = threading.Thread(target=_run_job, name=f'bulk-{kind}-{job.job_id}',
+                              args=(job, operation, connection_factory),
+                              daemon=True)
+    thread.start()
+    return job
+
+def start_price_change(category_id, mode, amount):
+    description = f"Category {category_id}: {'+' if amount >= 0 else ''}{amount}{'%' if mode == database_operations.PRICE_CHANGE_PERCENT else ''}"
+    return start_job('prices', description, lambda conn, progress: database_operations.bulk_adjust_prices(
+        conn, category_id, mode, amount, progress=progress))
+
+def start_stock_count(counts, mode, notes):
+    description = f"{len(counts)} stock {'adjustments' if mode == database_operations.STOCK_COUNT_ADJUST else 'counts'}"
+    return start_job('stock', description, lambda conn, progress: database_operations.bulk_set_stock(
+        conn, counts, mode=mode, notes=notes, progress=progress))
+
+# --- Command line ---
+def _print_progress(processed, total):
+    print(f"\rProcessed {processed}/{total}", end='', flush=True)
+
+def _resolve_category(conn, value):
+    if value.isdigit():
+        return int(value)
+    category = database_operations.get_category_by_name(conn, value)
+    return category['CategoryID'] if category else None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk product price and stock updates.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    prices = commands.add_parser('prices', help="Change prices for every product in a category.")
+    prices.add_argument('--category', required=True, help="Category ID or name.")
+    change = prices.add_mutually_exclusive_group(required=True)
+    change.add_argument('--percent', type=float, help="Percentage change, e.g. 5 or -10.")
+    change.add_argument('--amount', type=float, help="Absolute change per item, e.g. 0.25 or -0.5.")
+    stock = commands.add_parser('stock', help="Apply stock counts from a CSV file (product_id,quantity).")
+    stock.add_argument('csv_file')
+    stock.add_argument('--adjust', action='store_true', help="Quantities are changes, not counted levels.")
+    stock.add_argument('--notes', default="Stock count", help="Note stored with each InventoryLogs adjustment.")
+    args = parser.parse_args(argv)
+
+    conn = database_operations.create_connection()
+    if conn is None:
+        print("Failed to connect to the database.")
+        return 1
+    try:
+        if args.command == 'prices':
+            category_id = _resolve_category(conn, args.category)
+            if category_id is None:
+                print(f"Category '{args.category}' not found.")
+                return 1
+            mode = database_operations.PRICE_CHANGE_PERCENT if args.percent is not None else database_operations.PRICE_CHANGE_ABSOLUTE
+            amount = args.percent if args.percent is not None else args.amount
+            summary = database_operations.bulk_adjust_prices(conn, category_id, mode, amount, progress=_print_progress)
+        else:
+            with open(args.csv_file, newline='', encoding='utf-8-sig') as f:
+                counts, errors = parse_stock_csv(f.read())
+            for error in errors:
+                print(error)
+            if errors:
+                return 1
+            mode = database_operations.STOCK_COUNT_ADJUST if args.adjust else database_operations.STOCK_COUNT_SET
+            summary = database_operations.bulk_set_stock(conn, counts, mode=mode, notes=args.notes, progress=_print_progress)
+        print()
+        if summary is None:
+            print("Bulk update failed; chunks completed before the error were kept.")
+            return 1
+        print(f"Done: {summary}")
+        return 0
+    finally:
+        if conn.is_connected(): conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+# catalog_snapshot.py
+import bisect
+import datetime
+import decimal
+import os
+import threading
+import time
+
+import numpy as np
+
+import app_logging
+import change_feed
+import database_operations
+
+logger = app_logging.get_logger(__name__)
+
+CATALOG_REFRESH_SECONDS = float(os.environ.get('CATALOG_REFRESH_SECONDS', '5'))
+# Deltas re-read this much history, so rows from transactions that committed late, or that reached
+# the replica being read up to REPLICA_MAX_LAG_SECONDS late, are not skipped
+CATALOG_DELTA_OVERLAP_SECONDS = database_operations.REPLICA_MAX_LAG_SECONDS + 5.0
+# A periodic full reload bounds the effect of anything the deltas missed
+CATALOG_FULL_RELOAD_SECONDS = 900.0
+
+class CatalogSnapshot:
+    """Immutable, array-backed view of ProductListing for POS lookups.
+
+    Products are stored column-wise in ProductID order: ids, prices in cents, stock and a category
+    code per product, with names in a parallel list and a sorted (lower-cased name, ProductID)
+    index for prefix search. Updates build a new snapshot; readers never see a partial one.
+    """
+
+    def __init__(self, ids, price_cents, stock, category_codes, categories, names, name_index=None,
+                 watermark=None, generation=0):
+        self.ids = ids
+        self.price_cents = price_cents
+        self.stock = stock
+        self.category_codes = category_codes
+        self.categories = categories
+        self.names = names
+        self.name_index = name_index if name_index is not None else sorted(
+            (name.lower(), int(product_id)) for name, product_id in zip(names, ids.tolist()))
+        self.watermark = watermark
+        self.generation = generation
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                   np.zeros(0, dtype=np.int32), [None], [], name_index=[])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _position(self, product_id):
+        position = int(np.searchsorted(self.ids, product_id))
+        if position < len(self.ids) and self.ids[position] == product_id:
+            return position
+        return None
+
+    def _row(self, position):
+        return {
+            'ProductID': int(self.ids[position]),
+            'ProductName': self.names[position],
+            'CategoryName': self.categories[self.category_codes[position]],
+            'Price': decimal.Decimal(int(self.price_cents[position])).scaleb(-2),
+            'StockQuantity': int(self.stock[position]),
+        }
+
+    def lookup(self, product_id):
+        """Returns the product as a dict (ProductID, ProductName, CategoryName, Price, StockQuantity) or None."""
+        position = self._position(product_id)
+        return self._row(position) if position is not None else None
+
+    def search(self, text, limit=20):
+        """Products whose name starts with text (case-insensitive), or the product with that ID. Returns a list of dicts."""
+        text = (text or '').strip()
+        if not text:
+            return []
+        if text.isdigit():
+            product = self.lookup(int(text))
+            if product:
+                return [product]
+        prefix = text.lower()
+        results = []
+        for name, product_id in self.name_index[bisect.bisect_left(self.name_index, (prefix, -1)):]:
+            if not name.startswith(prefix) or len(results) >= limit:
+                break
+            results.append(self.lookup(product_id))
+        return results
+
+    def rows(self):
+        """All products in name order, as dicts."""
+        for _, product_id in self.name_index:
+            yield self.lookup(product_id)
+
+    def validate_cart(self, items):
+        """Checks POS cart items against the catalog.
+
+        Returns (items, problems): items carry 'unit_price' from the catalog as a quote for display;
+        problems is a list of messages for unknown products and invalid quantities. The catalog may be a
+        few seconds old, so checkout charges the price of the locked product row and checks stock itself.
+        """
+        validated, problems = [], []
+        for item in items:
+            try:
+                product_id, quantity = int(item['product_id']), int(item['quantity'])
+            except (KeyError, TypeError, ValueError):
+                problems.append("A cart line is missing its product or quantity.")
+                continue
+            position = self._position(product_id)
+            if position is None:
+                problems.append(f"Product ID {product_id} is no longer in the catalog.")
+                continue
+            if quantity <= 0:
+                problems.append(f"Invalid quantity ({quantity}) for '{self.names[position]}'.")
+                continue
+            validated.append({'product_id': product_id, 'quantity': quantity,
+                              'unit_price': decimal.Decimal(int(self.price_cents[position])).scaleb(-2)})
+        return validated, problems
+
+    def with_changes(self, rows, deleted_ids=(), watermark=None):
+        """Returns a new snapshot with rows (ProductID, ProductName, CategoryName, Price, StockQuantity, ...) applied."""
+        ids, price_cents, stock = self.ids.copy(), self.price_cents.copy(), self.stock.copy()
+        category_codes, categories, names = self.category_codes.copy(), list(self.categories), list(self.names)
+        category_lookup = {name: code for code, name in enumerate(categories)}
+        names_changed = False
+
+        if rows:
+            row_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            positions = np.searchsorted(ids, row_ids)
+            known = np.zeros(len(rows), dtype=bool)
+            if len(ids):
+                known = (positions < len(ids)) & (ids[np.minimum(positions, len(ids) - 1)] == row_ids)
+            new_rows = []
+            for row, position, is_known in zip(rows, positions.tolist(), known.tolist()):
+                category = row[2]
+                if category not in category_lookup:
+                    category_lookup[category] = len(categories)
+                    categories.append(category)
+                values = (int(round((row[3] or 0) * 100)), row[4] or 0, category_lookup[category])
+                if is_known:
+                    price_cents[position], stock[position], category_codes[position] = values
+                    if names[position] != row[1]:
+                        names[position] = row[1]
+                        names_changed = True
+                else:
+                    new_rows.append((row[0], row[1]) + values)
+            if new_rows:
+                # Later rows for the same product are newer
+                latest = {row[0]: row for row in new_rows}
+                added = list(latest.values())
+                ids = np.concatenate([ids, np.fromiter((r[0] for r in added), dtype=np.int64, count=len(added))])
+                price_cents = np.concatenate([price_cents, np.fromiter((r[2] for r in added), dtype=np.int64, count=len(added))])
+                stock = np.concatenate([stock, np.fromiter((r[3] for r in added), dtype=np.int64, count=len(added))])
+                category_codes = np.concatenate([category_codes, np.fromiter((r[4] for r in added), dtype=np.int32, count=len(added))])
+                names.extend(r[1] for r in added)
+                names_changed = True
+
+        if deleted_ids:
+            keep = ~np.isin(ids, np.fromiter(deleted_ids, dtype=np.int64, count=len(deleted_ids)))
+            if not keep.all():
+                names = [name for name, kept in zip(names, keep.tolist()) if kept]
+                ids, price_cents, stock, category_codes = ids[keep], price_cents[keep], stock[keep], category_codes[keep]
+                names_changed = True
+
+        if names_changed:
+            order = np.argsort(ids, kind='stable')
+            if (order != np.arange(len(order))).any():
+                ids, price_cents, stock, category_codes = ids[order], price_cents[order], stock[order], category_codes[order]
+                names = [names[i] for i in order.tolist()]
+        return CatalogSnapshot(ids, price_cents, stock, category_codes, categories, names,
+                               name_index=None if names_changed else self.name_index,
+                               watermark=watermark or self.watermark, generation=self.generation + 1)
+
+class ProductCatalog:
+    """Per-worker product catalog: loaded once from ProductListing, then kept current with deltas
+       (rows whose UpdatedAt passed the watermark) and change feed delete events."""
+
+    def __init__(self):
+        self.snapshot = CatalogSnapshot.empty()
+        self.loaded = False
+        self._pending_deletes = set()
+        self._pending_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_full_load = 0.0
+        self.last_refresh_at = None
+        self.last_refresh_ms = None
+
+    def on_product_change(self, entity_type, entity_id, change_type):
+        if change_type == 'delete':
+            with self._pending_lock:
+                self._pending_deletes.add(entity_id)
+        refresh_worker.refresh_soon()
+
+    def on_resync(self, *args):
+        self._last_full_load = 0.0
+        refresh_worker.refresh_soon()
+
+    def refresh(self, conn):
+        """Applies changes since the last refresh (a full load the first time). Returns the number of rows read, or None on error."""
+        with self._refresh_lock:
+            started = time.perf_counter()
+            conn.commit() # Start a fresh snapshot so recently committed rows are visible
+            full = not self.loaded or time.monotonic() - self._last_full_load > CATALOG_FULL_RELOAD_SECONDS
+            since = None
+            if not full and self.snapshot.watermark is not None:
+                since = self.snapshot.watermark - datetime.timedelta(seconds=CATALOG_DELTA_OVERLAP_SECONDS)
+            with self._pending_lock:
+                deleted, self._pending_deletes = self._pending_deletes, set()
+            rows = database_operations.fetch_listing_changes(conn, since)
+            if rows is None:
+                with self._pending_lock:
+                    self._pending_deletes |= deleted
+                return None
+
+            watermark = max((row[5] for row in rows), default=None)
+            if self.snapshot.watermark is not None and watermark is not None:
+                watermark = max(watermark, self.snapshot.watermark)
+            if full:
+                generation = self.snapshot.generation
+                self.snapshot = CatalogSnapshot.empty().with_changes(rows, watermark=watermark)
+                self.snapshot.generation = generation + 1
+                self._last_full_load = time.monotonic()
+                self.loaded = True
+            elif rows or deleted:
+                self.snapshot = self.snapshot.with_changes(rows, deleted, watermark=watermark)
+            self.last_refresh_at = datetime.datetime.now()
+            self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 3)
+            return len(rows)
+
+    def status(self):
+        snapshot = self.snapshot
+        return {
+            'loaded': self.loaded,
+            'products': len(snapshot),
+            'generation': snapshot.generation,
+            'watermark': snapshot.watermark.isoformat() if snapshot.watermark else None,
+            'refreshed_at': self.last_refresh_at.isoformat(timespec='seconds') if self.last_refresh_at else None,
+            'refresh_ms': self.last_refresh_ms,
+        }
+
+class CatalogRefreshWorker:
+    """Background thread that applies catalog deltas periodically and whenever products change."""
+
+    def __init__(self, catalog, interval=CATALOG_REFRESH_SECONDS, connection_factory=None):
+        self.catalog = catalog
+        self.interval = interval
+        self.connection_factory = connection_factory or database_operations.create_read_connection
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='catalog-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+
+    def refresh_soon(self):
+        self._wake_event.set()
+
+    def run_once(self):
+        conn = self.connection_factory()
+        if conn is None:
+            return None
+        try:
+            return self.catalog.refresh(conn)
+        finally:
+            if conn.is_connected(): conn.close()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error in refresh worker", exc_info=e)
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+catalog = ProductCatalog()
+refresh_worker = CatalogRefreshWorker(catalog)
+
+change_feed.subscriber.subscribe(database_operations.ENTITY_PRODUCT, catalog.on_product_change)
+# Category renames reach the catalog through ProductListing.UpdatedAt; the event just makes it prompt
+change_feed.subscriber.subscribe(database_operations.ENTITY_CATEGORY, lambda *event: refresh_worker.refresh_soon())
+change_feed.subscriber.on_resync(catalog.on_resync)
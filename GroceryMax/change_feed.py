@@ -0,0 +1,182 @@
+# change_feed.py
+import os
+import threading
+import time
+
+import app_logging
+import database_operations
+
+logger = app_logging.get_logger(__name__)
+
+CHANGE_FEED_POLL_SECONDS = float(os.environ.get('CHANGE_FEED_POLL_SECONDS', '1.0'))
+CHANGE_FEED_RETENTION_SECONDS = int(os.environ.get('CHANGE_FEED_RETENTION_SECONDS', '86400'))
+# How long a skipped ChangeID is re-checked before it is treated as a rolled-back insert
+GAP_RECHECK_SECONDS = 10.0
+PRUNE_INTERVAL_SECONDS = 600.0
+RECONNECT_BACKOFF_MAX_SECONDS = 30.0
+FETCH_BATCH_SIZE = 1000
+
+class ChangeFeedSubscriber:
+    """Polls the ChangeFeed table with a ChangeID watermark and dispatches entity-level events.
+
+    Each worker runs one subscriber. Caches register callbacks per entity type and invalidate
+    only the affected entries: callback(entity_type, entity_id, change_type). Callbacks registered
+    with on_resync() are called when events may have been missed (first connect after an outage
+    longer than the retention window, or feed pruned past the watermark) and must drop everything.
+    """
+
+    def __init__(self, poll_interval=CHANGE_FEED_POLL_SECONDS, connection_factory=None):
+        self.poll_interval = poll_interval
+        self.connection_factory = connection_factory or database_operations.create_connection
+        self.watermark = None
+        self._callbacks = {}
+        self._resync_callbacks = []
+        self._gaps = {} # ChangeID -> time first noticed missing
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._conn = None
+        self._last_prune = 0.0
+        self._reconnect_backoff = 0.0
+        self._next_connect_attempt = 0.0
+
+    def subscribe(self, entity_type, callback):
+        """Registers callback for events of entity_type ('*' for every type)."""
+        with self._lock:
+            self._callbacks.setdefault(entity_type, []).append(callback)
+
+    def on_resync(self, callback):
+        """Registers a no-argument callback for when precise invalidation is not possible."""
+        with self._lock:
+            self._resync_callbacks.append(callback)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='change-feed-subscriber', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval * 2)
+        self._close_connection()
+
+    def poll_now(self):
+        """Polls synchronously, e.g. right after this worker wrote, so its own caches are fresh."""
+        try:
+            self.poll_once()
+        except Exception as e:
+            logger.error("Error during synchronous poll", exc_info=e)
+
+    def poll_once(self):
+        """Fetches and dispatches all new events. Returns the number of events dispatched."""
+        with self._lock:
+            conn = self._get_connection()
+            if conn is None:
+                return 0
+            # Each poll must see rows committed since the previous one
+            conn.commit()
+
+            oldest, newest = database_operations.get_change_feed_bounds(conn)
+            if self.watermark is None:
+                self.watermark = newest
+                return 0
+            if oldest and self.watermark < oldest - 1:
+                logger.warning("Watermark %s fell behind retained feed (oldest %s); resyncing.", self.watermark, oldest)
+                self._gaps.clear()
+                self.watermark = newest
+                self._dispatch_resync()
+                return 0
+
+            events = self._recheck_gaps(conn)
+            while True:
+                batch = database_operations.fetch_changes_since(conn, self.watermark, FETCH_BATCH_SIZE)
+                if not batch:
+                    break
+                now = time.monotonic()
+                expected_id = self.watermark + 1
+                for event in batch:
+                    # IDs skipped here belong to transactions that may still commit
+                    for missing_id in range(expected_id, event['ChangeID']):
+                        self._gaps.setdefault(missing_id, now)
+                    expected_id = event['ChangeID'] + 1
+                events.extend(batch)
+                self.watermark = batch[-1]['ChangeID']
+                if len(batch) < FETCH_BATCH_SIZE:
+                    break
+
+            for event in events:
+                self._dispatch(event)
+            self._maybe_prune(conn)
+            return len(events)
+
+    def _recheck_gaps(self, conn):
+        if not self._gaps:
+            return []
+        found = database_operations.fetch_changes_by_ids(conn, list(self._gaps))
+        for event in found:
+            self._gaps.pop(event['ChangeID'], None)
+        deadline = time.monotonic() - GAP_RECHECK_SECONDS
+        for change_id in [cid for cid, seen in self._gaps.items() if seen < deadline]:
+            del self._gaps[change_id]
+        return found
+
+    def _dispatch(self, event):
+        callbacks = self._callbacks.get(event['EntityType'], []) + self._callbacks.get('*', [])
+        for callback in callbacks:
+            try:
+                callback(event['EntityType'], event['EntityID'], event['ChangeType'])
+            except Exception as e:
+                logger.error("Error in subscriber callback for %s", event['EntityType'], exc_info=e)
+
+    def _dispatch_resync(self):
+        for callback in self._resync_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Error in resync callback", exc_info=e)
+
+    def _maybe_prune(self, conn):
+        now = time.monotonic()
+        if now - self._last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        database_operations.prune_change_feed(conn, CHANGE_FEED_RETENTION_SECONDS)
+
+    def _get_connection(self):
+        if self._conn is not None and self._conn.is_connected():
+            return self._conn
+        self._close_connection()
+        now = time.monotonic()
+        if now < self._next_connect_attempt:
+            return None
+        self._conn = self.connection_factory()
+        if self._conn is None:
+            self._reconnect_backoff = min(max(self._reconnect_backoff * 2, self.poll_interval), RECONNECT_BACKOFF_MAX_SECONDS)
+            self._next_connect_attempt = now + self._reconnect_backoff
+        else:
+            self._reconnect_backoff = 0.0
+        return self._conn
+
+    def _close_connection(self):
+        if self._conn is not None:
+            try:
+                if self._conn.is_connected(): self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error("Error polling change feed", exc_info=e)
+                with self._lock:
+                    self._close_connection()
+            self._stop_event.wait(self.poll_interval)
+
+# Shared per-worker subscriber; caches register with it at import time
+subscriber = ChangeFeedSubscriber()
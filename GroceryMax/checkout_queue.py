@@ -0,0 +1,210 @@
+# checkout_queue.py
+"""Group commit for checkout: concurrent sales share one transaction and one commit.
+
+Each sale normally commits on its own, and every commit waits for the redo log to be flushed.
+At peak many tills check out at once, so with CHECKOUT_QUEUE_ENABLED=1 submitted sales are put on
+a queue instead. A dispatcher thread takes the first waiting sale, collects whatever else arrives
+within CHECKOUT_MAX_WAIT_MS (up to CHECKOUT_BATCH_SIZE sales), and records them all with
+database_operations.process_sale_batch. Every submitter still gets its own SaleID or its own error.
+If the batch transaction fails as a whole (e.g. a deadlock), its sales are retried one by one. Every
+sale carries an idempotency key (client_token), so a retry after a commit that was applied but not
+acknowledged returns the recorded SaleID instead of recording the sale again.
+
+Throughput and latency under load can be measured with stress_checkout.py.
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+
+from mysql.connector import Error, InterfaceError
+
+import app_logging
+import database_operations
+
+logger = app_logging.get_logger(__name__)
+
+CHECKOUT_QUEUE_ENABLED = os.environ.get('CHECKOUT_QUEUE_ENABLED', '0') == '1'
+CHECKOUT_BATCH_SIZE = int(os.environ.get('CHECKOUT_BATCH_SIZE', '20'))
+# How long the dispatcher waits for more sales after the first one arrives
+CHECKOUT_MAX_WAIT_MS = float(os.environ.get('CHECKOUT_MAX_WAIT_MS', '5'))
+# A submitter gives up on a dispatcher that has not answered after this long (e.g. stuck in a hung database call)
+CHECKOUT_TIMEOUT_SECONDS = float(os.environ.get('CHECKOUT_TIMEOUT_SECONDS', '30'))
+# Batch sizes are counted in these buckets for /metrics/checkout
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+class PendingSale:
+    """A submitted sale waiting for the dispatcher."""
+
+    def __init__(self, items_sold, customer_id, payment_method, cart_token, client_token=None):
+        self.sale = {'items_sold': items_sold, 'customer_id': customer_id,
+                     'payment_method': payment_method, 'cart_token': cart_token,
+                     'client_token': client_token or uuid.uuid4().hex}
+        self.submitted_at = time.perf_counter()
+        self.sale_id = None
+        self.error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def resolve(self, sale_id, error):
+        """Records the outcome; only the first call counts (the dispatcher may answer after a timeout)."""
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self.sale_id, self.error = sale_id, error
+            self._done.set()
+            return True
+
+    @property
+    def resolved(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=CHECKOUT_TIMEOUT_SECONDS):
+        if not self._done.wait(timeout):
+            # The sale may still be committed later; reporting it like a lost connection sends it to the
+            # offline queue under the same client_token, whose replay then finds the recorded sale
+            if self.resolve(None, InterfaceError(f"Checkout timed out after {timeout:g}s waiting for the database.")):
+                logger.error("Checkout timed out after %ss waiting for the dispatcher.", timeout)
+        return self.sale_id
+
+class CheckoutQueue:
+    """Collects concurrently submitted sales and commits them in batches from one dispatcher thread."""
+
+    def __init__(self, batch_size=CHECKOUT_BATCH_SIZE, max_wait_ms=CHECKOUT_MAX_WAIT_MS, connection_factory=None):
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.connection_factory = connection_factory or database_operations.create_connection
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.stats = {'batches': 0, 'sales': 0, 'failed_sales': 0, 'batch_retries': 0,
+                      'batch_sizes': {size: 0 for size in BATCH_SIZE_BUCKETS}, 'wait_ms_total': 0.0, 'max_wait_ms': 0.0}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='checkout-queue', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def process_sale(self, items_sold, customer_id=None, payment_method="Unknown", cart_token=None, errors=None, client_token=None):
+        """Same contract as database_operations.process_new_sale, but the sale is committed together with
+           other sales submitted at about the same time. Blocks until the sale is committed or rejected.
+           Falls back to processing the sale directly when the dispatcher is not running.
+           A database that cannot be reached is reported in errors as a connection error
+           (see database_operations.is_connection_error).
+        """
+        if not self.running:
+            conn = self.connection_factory()
+            try:
+                return database_operations.process_new_sale(conn, items_sold, customer_id=customer_id,
+                                                            payment_method=payment_method, cart_token=cart_token, errors=errors,
+                                                            client_token=client_token)
+            finally:
+                if conn is not None and conn.is_connected(): conn.close()
+        pending = PendingSale(items_sold, customer_id, payment_method, cart_token, client_token)
+        self._queue.put(pending)
+        sale_id = pending.wait()
+        if pending.error is not None and errors is not None:
+            errors.append(pending.error)
+        return sale_id
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _process_individually(self, conn, batch):
+        for pending in batch:
+            errors = []
+            sale_id = database_operations.process_new_sale(conn, **pending.sale, errors=errors)
+            pending.resolve(sale_id, errors[-1] if errors else None)
+
+    def process_batch(self, batch):
+        """Commits a batch of PendingSale objects and resolves each of them."""
+        conn = self.connection_factory()
+        try:
+            if conn is None:
+                for pending in batch:
+                    pending.resolve(None, InterfaceError("Connection not active."))
+                return
+            if len(batch) == 1:
+                self._process_individually(conn, batch)
+                return
+            results = database_operations.process_sale_batch(conn, [pending.sale for pending in batch])
+            if results is None:
+                with self._stats_lock:
+                    self.stats['batch_retries'] += 1
+                if not conn.is_connected(): # e.g. lost while committing; retry on a fresh connection
+                    try:
+                        conn.close() # A pooled connection goes back to be reconnected
+                    except Error:
+                        pass
+                    conn = self.connection_factory()
+                    if conn is None:
+                        for pending in batch:
+                            pending.resolve(None, InterfaceError("Connection not active."))
+                        return
+                self._process_individually(conn, batch)
+                return
+            for pending, (sale_id, error) in zip(batch, results):
+                pending.resolve(sale_id, error)
+        finally:
+            if conn is not None and conn.is_connected(): conn.close()
+
+    def _record(self, batch, started):
+        waited = [(started - pending.submitted_at) * 1000 for pending in batch]
+        with self._stats_lock:
+            self.stats['batches'] += 1
+            self.stats['sales'] += len(batch)
+            self.stats['failed_sales'] += sum(1 for pending in batch if pending.sale_id is None)
+            bucket = next((size for size in BATCH_SIZE_BUCKETS if len(batch) <= size), BATCH_SIZE_BUCKETS[-1])
+            self.stats['batch_sizes'][bucket] += 1
+            self.stats['wait_ms_total'] += sum(waited)
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], max(waited))
+
+    def metrics(self):
+        with self._stats_lock:
+            stats = dict(self.stats, batch_sizes=dict(self.stats['batch_sizes']))
+        stats['avg_batch_size'] = round(stats['sales'] / stats['batches'], 2) if stats['batches'] else None
+        stats['avg_queue_wait_ms'] = round(stats.pop('wait_ms_total') / stats['sales'], 3) if stats['sales'] else None
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        stats.update(enabled=CHECKOUT_QUEUE_ENABLED, running=self.running, queued=self._queue.qsize(),
+                     batch_size_limit=self.batch_size, max_wait_setting_ms=self.max_wait * 1000)
+        return stats
+
+    def _run(self):
+        while not self._stop_event.is_set() or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = self._collect(first)
+            started = time.perf_counter()
+            try:
+                self.process_batch(batch)
+            except Exception as e:
+                logger.error("Error in checkout queue", exc_info=e)
+                for pending in batch:
+                    if not pending.resolved:
+                        pending.resolve(None, e)
+            self._record(batch, started)
+
+checkout_queue = CheckoutQueue()
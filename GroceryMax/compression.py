@@ -0,0 +1,96 @@
+# compression.py
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli # Optional: enables "br" when installed
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '500'))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', '6'))
+# Streamed output is buffered up to this size between flushes, so tiny template chunks still compress well
+STREAM_FLUSH_BYTES = 8 * 1024
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'text/csv', 'application/json', 'application/javascript'}
+
+class _GzipEncoder:
+    def __init__(self):
+        self._obj = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31) # 31: gzip container
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush()
+
+class _BrotliEncoder:
+    def __init__(self):
+        self._obj = brotli.Compressor(quality=min(COMPRESSION_LEVEL, 11))
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+ENCODERS = {'gzip': _GzipEncoder}
+if brotli is not None:
+    ENCODERS['br'] = _BrotliEncoder
+
+def negotiate_encoding():
+    """Picks the best encoding the client accepts, preferring brotli. Returns None for identity."""
+    preference = [name for name in ('br', 'gzip') if name in ENCODERS]
+    return request.accept_encodings.best_match(preference) if preference else None
+
+def _compress_stream(original, chunks, encoder):
+    # The first chunk goes out immediately for time-to-first-byte; later ones are batched
+    buffered, size, first = [], 0, True
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            buffered.append(chunk)
+            size += len(chunk)
+            if first or size >= STREAM_FLUSH_BYTES:
+                yield encoder.compress(b''.join(buffered)) + encoder.flush()
+                buffered, size, first = [], 0, False
+        yield encoder.compress(b''.join(buffered)) + encoder.finish()
+    finally:
+        if hasattr(original, 'close'):
+            original.close()
+
+def compress_response(response):
+    """after_request hook: compresses text responses, including streamed ones, per Accept-Encoding."""
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if not encoding:
+        return response
+
+    encoder = ENCODERS[encoding]()
+    if response.is_streamed:
+        original = response.response
+        response.response = _compress_stream(original, response.iter_encoded(), encoder)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESSION_MIN_BYTES:
+            return response
+        response.set_data(encoder.compress(body) + encoder.finish())
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -1,10 +1,20 @@
 # database_operations.py
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, InterfaceError
+from mysql.connector import pooling
 from dotenv import load_dotenv
+import multiprocessing
 import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import app_logging
+import statement_cache
 load_dotenv()
 
+logger = app_logging.get_logger(__name__)
+
 # Load from environment variables with defaults for local development (optional)
 DB_HOST = os.environ.get('DB_HOST', 'localhost')
 DB_NAME = os.environ.get('DB_NAME', 'grocery_store_db')
@@ -13,7 +23,7 @@ DB_PASSWORD = os.environ.get('DB_PASSWORD', None) # No default for password is s
 
 # Check if essential DB_PASSWORD is set
 if DB_PASSWORD is None:
-    print("CRITICAL ERROR: DB_PASSWORD environment variable is not set.")
+    logger.critical("DB_PASSWORD environment variable is not set.")
 
 DB_CONFIG = {
     'host': DB_HOST,
@@ -22,26 +32,727 @@ DB_CONFIG = {
     'password': DB_PASSWORD
 }
 
-def create_connection():
-    """Creates and returns a MySQL database connection object or None on failure."""
+# How long an open POS cart may hold stock before the reservation lapses
+STOCK_RESERVATION_TTL_SECONDS = int(os.environ.get('STOCK_RESERVATION_TTL_SECONDS', '900'))
+# Pooled primary connections (at most 32); 0 opens a new connection for every caller.
+# Pooled connections keep their session between users so their prepared statements survive (see statement_cache).
+# Every process opens all of its pools' connections up front, so size them for (web workers x pool size) server connections.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+# Pool size in multiprocessing worker processes, which use one or two connections each
+DB_CHILD_POOL_SIZE = int(os.environ.get('DB_CHILD_POOL_SIZE', '2'))
+# One-off connections a process may open while its pool is exhausted; beyond that callers wait for the pool
+DB_POOL_OVERFLOW = int(os.environ.get('DB_POOL_OVERFLOW', '5'))
+# How long a caller waits for a pooled connection once the overflow is used up
+DB_POOL_WAIT_SECONDS = float(os.environ.get('DB_POOL_WAIT_SECONDS', '5'))
+# Rows pulled per round trip when streaming large result sets
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', '500'))
+# When each InventoryLogs row was written; everything that reads log history by date depends on it
+INVENTORY_LOG_DATE_COLUMN = os.environ.get('INVENTORY_LOG_DATE_COLUMN', 'LogDate')
+
+# Stores: each store's products, stock, sales and logs live in their own database (same schema) on a
+# configurable server. DB_STORES lists "store_id=host[:port][/database]" entries sharing DB_USER/DB_PASSWORD;
+# without it there is one store (ID 1) at DB_CONFIG. STORE_ID is the store this process serves.
+DB_STORES = os.environ.get('DB_STORES', '')
+# Pooled connections to each store other than STORE_ID (used by cross-store reports)
+REMOTE_STORE_POOL_SIZE = int(os.environ.get('REMOTE_STORE_POOL_SIZE', '2'))
+# Threads used to query stores in parallel
+STORE_FANOUT_WORKERS = int(os.environ.get('STORE_FANOUT_WORKERS', '8'))
+
+def _parse_store_configs(stores_setting):
+    configs = {}
+    for entry in filter(None, (part.strip() for part in stores_setting.split(','))):
+        store_id, _, location = entry.partition('=')
+        address, _, database = location.strip().partition('/')
+        host, _, port = address.partition(':')
+        try:
+            config = dict(DB_CONFIG, host=host or DB_CONFIG['host'])
+            if port: config['port'] = int(port)
+            if database: config['database'] = database
+            configs[int(store_id)] = config
+        except ValueError:
+            logger.error("Ignoring malformed DB_STORES entry '%s' (expected store_id=host[:port][/database]).", entry)
+    return configs or {1: DB_CONFIG}
+
+STORE_CONFIGS = _parse_store_configs(DB_STORES)
+STORE_ID = int(os.environ.get('STORE_ID', min(STORE_CONFIGS)))
+if STORE_ID not in STORE_CONFIGS:
+    # Serving the wrong store's (or no) database must not start quietly
+    logger.critical("STORE_ID %s is not listed in DB_STORES.", STORE_ID)
+    raise ValueError(f"STORE_ID {STORE_ID} is not listed in DB_STORES. Please add it or set STORE_ID to a configured store.")
+
+# Read replicas: comma-separated "host[:port]" list sharing the primary's database and credentials
+DB_REPLICA_HOSTS = os.environ.get('DB_REPLICA_HOSTS', '')
+REPLICA_POOL_SIZE = int(os.environ.get('REPLICA_POOL_SIZE', '5'))
+# Replicas further behind than this are skipped in favour of the next replica or the primary
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', '2'))
+# A failed replica is not retried for this long
+REPLICA_RETRY_SECONDS = 30.0
+
+def _parse_replica_configs(hosts_setting):
+    # Replicas belong to the store this process serves
+    configs = []
+    for entry in filter(None, (part.strip() for part in hosts_setting.split(','))):
+        host, _, port = entry.partition(':')
+        config = dict(STORE_CONFIGS.get(STORE_ID, DB_CONFIG), host=host)
+        config.pop('port', None)
+        if port: config['port'] = int(port)
+        configs.append(config)
+    return configs
+
+REPLICA_CONFIGS = _parse_replica_configs(DB_REPLICA_HOSTS)
+
+_pool_lock = threading.Lock()
+_primary_pools = {} # store ID -> pool
+_primary_pools_pid = None
+_overflow_slots = threading.BoundedSemaphore(max(DB_POOL_OVERFLOW, 1))
+
+def _process_pool_size(pool_size):
+    """Caps a pool's size in worker processes (multiprocessing children), which need far fewer connections."""
+    if multiprocessing.parent_process() is not None:
+        return max(1, min(pool_size, DB_CHILD_POOL_SIZE))
+    return pool_size
+
+def _get_primary_pool(store_id):
+    global _primary_pools_pid, _overflow_slots
+    with _pool_lock:
+        # Pooled sockets must not be shared with a forked child; each process builds its own pools
+        if _primary_pools_pid != os.getpid():
+            _primary_pools.clear()
+            _overflow_slots = threading.BoundedSemaphore(max(DB_POOL_OVERFLOW, 1))
+            _primary_pools_pid = os.getpid()
+        pool = _primary_pools.get(store_id)
+        if pool is None:
+            pool_size = DB_POOL_SIZE if store_id == STORE_ID else min(DB_POOL_SIZE, REMOTE_STORE_POOL_SIZE)
+            pool = pooling.MySQLConnectionPool(pool_name=f"store_{store_id}_{os.getpid()}", pool_size=_process_pool_size(pool_size),
+                                               pool_reset_session=False, **STORE_CONFIGS[store_id])
+            _primary_pools[store_id] = pool
+        return pool
+
+def _checkout(pool):
+    """Gets a connection from a pool. Sessions are not reset on return (that would drop their prepared
+       statements), so any transaction, and with it any stale read snapshot, left by the previous user is rolled back."""
+    conn = pool.get_connection()
+    try:
+        conn.rollback()
+    except Error:
+        # Broken: disconnect it so the pool reconnects it before handing it out again
+        try:
+            conn._cnx.disconnect()
+        except Error:
+            pass
+        conn.close()
+        raise
+    return conn
+
+def _open_overflow_connection(config):
+    """Opens a one-off connection while the pool is exhausted, at most DB_POOL_OVERFLOW at a time per process.
+       Returns None when they are all in use."""
+    slots = _overflow_slots
+    if DB_POOL_OVERFLOW <= 0 or not slots.acquire(blocking=False):
+        return None
+    try:
+        conn = mysql.connector.connect(**config)
+    except Error:
+        slots.release()
+        raise
+    # Freed on the first close(), or when the connection is garbage collected if it is dropped without one
+    release = weakref.finalize(conn, slots.release)
+    close = conn.close
+    def close_and_release():
+        try:
+            close()
+        finally:
+            release()
+    conn.close = close_and_release
+    return conn
+
+def _checkout_primary(store_id):
+    pool = _get_primary_pool(store_id)
+    try:
+        return _checkout(pool)
+    except pooling.PoolError:
+        pass
+    conn = _open_overflow_connection(STORE_CONFIGS[store_id])
+    if conn is not None:
+        return conn
+    deadline = time.monotonic() + DB_POOL_WAIT_SECONDS
+    while True:
+        time.sleep(0.01)
+        try:
+            return _checkout(pool)
+        except pooling.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+
+# Client error codes for a server that cannot be reached or a connection lost mid-statement
+CONNECTION_LOST_ERRNOS = {2003, 2006, 2013, 2055}
+
+def is_connection_error(error):
+    """True if error means the database could not be reached or the connection dropped, as opposed
+       to a statement or business rule failure. InterfaceError covers "Connection not active." failures."""
+    return isinstance(error, InterfaceError) or (isinstance(error, Error) and error.errno in CONNECTION_LOST_ERRNOS)
+
+def create_connection(store_id=None):
+    """Creates and returns a MySQL database connection object or None on failure.
+       store_id selects the store's database (default: STORE_ID, the store this process serves).
+       With DB_POOL_SIZE > 0 the connection comes from a pool and close() returns it; when the pool is
+       exhausted, up to DB_POOL_OVERFLOW one-off connections are opened, after which callers wait
+       up to DB_POOL_WAIT_SECONDS for a pooled one (and get None if none is returned in time).
+    """
     conn = None
     if not DB_CONFIG['password']: # Check again if password is None
-        print("DB_Connection_Error: Password not configured. Set DB_PASSWORD environment variable.")
+        logger.error("Password not configured. Set DB_PASSWORD environment variable.")
+        return None
+    store_id = STORE_ID if store_id is None else store_id
+    config = STORE_CONFIGS.get(store_id)
+    if config is None:
+        logger.error("Unknown store ID %s.", store_id)
         return None
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        if DB_POOL_SIZE > 0:
+            return _checkout_primary(store_id)
+        conn = mysql.connector.connect(**config)
     except Error as e:
-        print(f"DB_Connection_Error: {e}")
+        logger.error("Connection to %s (store %s) failed", config['host'], store_id, exc_info=e)
         # More detailed error for missing password:
         if "Access denied" in str(e) and not DB_CONFIG['password']:
-             print("Hint: Ensure DB_PASSWORD environment variable is set correctly.")
+             logger.error("Hint: Ensure DB_PASSWORD environment variable is set correctly.")
     return conn
 
+# --- Read Replica Routing ---
+_replica_lock = threading.Lock()
+_replica_pools = {}
+_replica_state = {} # index -> {'lag': float|None, 'checked_at': float, 'down_until': float}
+_replica_pools_pid = None
+_replica_next = 0
+
+def _replica_entry(index):
+    """Gets a replica's health entry; call with _replica_lock held."""
+    global _replica_pools_pid
+    # A forked child (check_replicas runs at import) must not share the parent's sockets, so it builds its own pools
+    if _replica_pools_pid != os.getpid():
+        _replica_pools.clear()
+        _replica_state.clear()
+        _replica_pools_pid = os.getpid()
+    return _replica_state.setdefault(index, {'lag': None, 'checked_at': 0.0, 'down_until': 0.0})
+
+def _get_replica_pool(index):
+    with _replica_lock:
+        _replica_entry(index)
+        pool = _replica_pools.get(index)
+        if pool is None:
+            config = REPLICA_CONFIGS[index]
+            pool = pooling.MySQLConnectionPool(pool_name=f"replica_{index}_{os.getpid()}_{config['host']}"[:64],
+                                               pool_size=_process_pool_size(REPLICA_POOL_SIZE), pool_reset_session=False, **config)
+            _replica_pools[index] = pool
+        return pool
+
+def _show_replica_status(cursor):
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+    except Error as e:
+        if e.errno != 1064: raise # Only a syntax error means an older server; access denied is reported as is
+        cursor.execute("SHOW SLAVE STATUS") # MySQL < 8.0.22
+    return cursor.fetchone()
+
+def get_replica_lag(conn):
+    """Gets a replica's lag in seconds, or None if it is not replicating (treated as unusable).
+       Reading the lag needs the REPLICATION CLIENT privilege (see check_replicas).
+    """
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        status = _show_replica_status(cursor)
+        if not status:
+            return None
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        return float(lag) if lag is not None else None
+    except Error as e:
+        logger.error("Error checking replica lag", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def check_replicas():
+    """Checks once (at startup) that the lag of each replica can be read. A replica whose lag is unknown
+       is never used, so a missing REPLICATION CLIENT grant would silently send every read to the primary.
+       Returns the number of usable replicas.
+    """
+    usable = 0
+    for index, config in enumerate(REPLICA_CONFIGS):
+        conn = cursor = None
+        try:
+            conn = _checkout(_get_replica_pool(index))
+            cursor = conn.cursor(dictionary=True, buffered=True)
+            if _show_replica_status(cursor):
+                usable += 1
+            else:
+                logger.error("Replica %s is not replicating; reads will use the primary instead.", config['host'])
+        except Error as e:
+            if e.errno == 1227: # ER_SPECIFIC_ACCESS_DENIED_ERROR
+                logger.critical("%s lacks the REPLICATION CLIENT privilege on replica %s, so its lag cannot be read and "
+                                "reads will use the primary instead. Run: GRANT REPLICATION CLIENT ON *.* TO '%s'@'<host>';",
+                                config['user'], config['host'], config['user'])
+            else:
+                logger.error("Replica %s unavailable", config['host'], exc_info=e)
+        finally:
+            if cursor: cursor.close()
+            if conn is not None and conn.is_connected(): conn.close()
+    return usable
+
+def _replica_is_fresh(index, conn):
+    """Returns (fresh, lag), re-reading the lag at most every REPLICA_LAG_CHECK_SECONDS."""
+    now = time.monotonic()
+    with _replica_lock:
+        state = _replica_entry(index)
+        lag, checked_at = state['lag'], state['checked_at']
+    if now - checked_at >= REPLICA_LAG_CHECK_SECONDS:
+        lag = get_replica_lag(conn) # Outside the lock: it is a round trip to the replica
+        with _replica_lock:
+            state = _replica_entry(index)
+            state['lag'], state['checked_at'] = lag, now
+    return lag is not None and lag <= REPLICA_MAX_LAG_SECONDS, lag
+
+def create_read_connection(store_id=None):
+    """Returns a connection for read-only queries: a pooled connection to the first healthy replica
+       within REPLICA_MAX_LAG_SECONDS (round robin), falling back to the primary. None on failure.
+       Replicas serve STORE_ID only; other stores are read from their primary.
+    """
+    global _replica_next
+    if not REPLICA_CONFIGS or (store_id is not None and store_id != STORE_ID):
+        return create_connection(store_id)
+    with _replica_lock:
+        start = _replica_next
+        _replica_next = (_replica_next + 1) % len(REPLICA_CONFIGS)
+    for offset in range(len(REPLICA_CONFIGS)):
+        index = (start + offset) % len(REPLICA_CONFIGS)
+        with _replica_lock:
+            down = _replica_entry(index)['down_until'] > time.monotonic()
+        if down:
+            continue
+        conn = None
+        try:
+            conn = _checkout(_get_replica_pool(index))
+            fresh, lag = _replica_is_fresh(index, conn)
+            if fresh:
+                return conn
+            logger.warning("Replica %s lag is %ss; skipping.", REPLICA_CONFIGS[index]['host'], lag)
+            conn.close()
+        except pooling.PoolError:
+            # Busy, not broken: try the next replica without taking this one out of rotation
+            logger.warning("Replica %s pool exhausted; trying the next one.", REPLICA_CONFIGS[index]['host'])
+        except Error as e:
+            logger.error("Replica %s unavailable", REPLICA_CONFIGS[index]['host'], exc_info=e)
+            with _replica_lock:
+                _replica_entry(index)['down_until'] = time.monotonic() + REPLICA_RETRY_SECONDS
+            if conn is not None:
+                try: conn.close()
+                except Error: pass
+    return create_connection()
+
+def replica_status():
+    """Gets the last known state of each configured replica (for diagnostics)."""
+    now = time.monotonic()
+    with _replica_lock:
+        states = [dict(_replica_entry(index)) for index in range(len(REPLICA_CONFIGS))]
+    return [{'host': config['host'], 'port': config.get('port', 3306),
+             'lag_seconds': state['lag'], 'available': state['down_until'] <= now}
+            for config, state in zip(REPLICA_CONFIGS, states)]
+
+# --- Schema Extensions ---
+# Supporting tables created on startup (see ensure_extension_tables). The core tables
+# (Categories, Products, Customers, Sales, SaleDetails, InventoryLogs) are managed separately.
+EXTENSION_TABLES_DDL = [
+    """CREATE TABLE IF NOT EXISTS StockReservations (
+           ReservationID INT AUTO_INCREMENT PRIMARY KEY,
+           CartToken VARCHAR(64) NOT NULL,
+           ProductID INT NOT NULL,
+           Quantity INT NOT NULL,
+           UnitPrice DECIMAL(10, 2) NOT NULL,
+           ExpiresAt DATETIME NOT NULL,
+           CreatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           UNIQUE KEY uq_reservation_cart_product (CartToken, ProductID),
+           KEY idx_reservation_product_expiry (ProductID, ExpiresAt),
+           KEY idx_reservation_expiry (ExpiresAt),
+           CONSTRAINT fk_reservation_product FOREIGN KEY (ProductID)
+               REFERENCES Products (ProductID) ON DELETE CASCADE
+       )""",
+    """CREATE TABLE IF NOT EXISTS ChangeFeed (
+           ChangeID BIGINT AUTO_INCREMENT PRIMARY KEY,
+           EntityType VARCHAR(32) NOT NULL,
+           EntityID INT NULL,
+           ChangeType VARCHAR(16) NOT NULL,
+           ChangedAt TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+           KEY idx_changefeed_changed_at (ChangedAt)
+       )""",
+    """CREATE TABLE IF NOT EXISTS DataVersions (
+           EntityType VARCHAR(32) PRIMARY KEY,
+           Version BIGINT NOT NULL DEFAULT 0,
+           UpdatedAt TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+       )""",
+    # Denormalized read model of Products + CategoryName, maintained by the product/category/sale functions below
+    """CREATE TABLE IF NOT EXISTS ProductListing (
+           ProductID INT PRIMARY KEY,
+           ProductName VARCHAR(255) NOT NULL,
+           SortName VARCHAR(255) NOT NULL,
+           Description TEXT NULL,
+           CategoryID INT NULL,
+           CategoryName VARCHAR(255) NULL,
+           Price DECIMAL(10, 2) NOT NULL,
+           StockQuantity INT NOT NULL,
+           SupplierID INT NULL,
+           UpdatedAt TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+           KEY idx_listing_sort (SortName, ProductID),
+           KEY idx_listing_stock (StockQuantity, SortName),
+           KEY idx_listing_category (CategoryID),
+           KEY idx_listing_updated (UpdatedAt),
+           CONSTRAINT fk_listing_product FOREIGN KEY (ProductID)
+               REFERENCES Products (ProductID) ON DELETE CASCADE
+       )""",
+    # Closed periods moved out of the hot tables by archival.ArchiveWorker. LIKE copies columns and
+    # indexes but not foreign keys, so archived rows never block deletes on the hot tables.
+    "CREATE TABLE IF NOT EXISTS SalesArchive LIKE Sales",
+    "CREATE TABLE IF NOT EXISTS SaleDetailsArchive LIKE SaleDetails",
+    "CREATE TABLE IF NOT EXISTS InventoryLogsArchive LIKE InventoryLogs",
+    # Background bulk jobs (see bulk_operations), shared so any web worker can report a job's progress
+    """CREATE TABLE IF NOT EXISTS BulkJobs (
+           JobID VARCHAR(32) PRIMARY KEY,
+           Kind VARCHAR(16) NOT NULL,
+           Description VARCHAR(255) NOT NULL,
+           Status VARCHAR(16) NOT NULL,
+           Processed INT NOT NULL DEFAULT 0,
+           Total INT NULL,
+           Summary TEXT NULL,
+           Error TEXT NULL,
+           StartedAt DATETIME NOT NULL,
+           FinishedAt DATETIME NULL,
+           UpdatedAt TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+           KEY idx_bulkjobs_started (StartedAt)
+       )""",
+    # Per-customer purchase aggregates, maintained by the sale and customer functions below
+    """CREATE TABLE IF NOT EXISTS CustomerStats (
+           CustomerID INT PRIMARY KEY,
+           LifetimeSpend DECIMAL(14, 2) NOT NULL DEFAULT 0,
+           VisitCount INT NOT NULL DEFAULT 0,
+           FirstPurchaseAt DATETIME NULL,
+           LastPurchaseAt DATETIME NULL,
+           CONSTRAINT fk_customerstats_customer FOREIGN KEY (CustomerID)
+               REFERENCES Customers (CustomerID) ON DELETE CASCADE
+       )""",
+    """CREATE TABLE IF NOT EXISTS CustomerCategoryStats (
+           CustomerID INT NOT NULL,
+           CategoryID INT NOT NULL,
+           Quantity INT NOT NULL DEFAULT 0,
+           Spend DECIMAL(14, 2) NOT NULL DEFAULT 0,
+           PRIMARY KEY (CustomerID, CategoryID),
+           CONSTRAINT fk_customercategorystats_customer FOREIGN KEY (CustomerID)
+               REFERENCES Customers (CustomerID) ON DELETE CASCADE,
+           CONSTRAINT fk_customercategorystats_category FOREIGN KEY (CategoryID)
+               REFERENCES Categories (CategoryID) ON DELETE CASCADE
+       )""",
+]
+# Columns added to existing tables: (table, column, definition). Archive tables must keep the columns of
+# their hot table, in the same order, because rows are moved with INSERT ... SELECT *.
+EXTENSION_COLUMNS = [
+    # Idempotency key of a checkout attempt (see _execute_sale)
+    ('Sales', 'ClientToken', 'VARCHAR(64) NULL'),
+    ('SalesArchive', 'ClientToken', 'VARCHAR(64) NULL'),
+    # When the row was inserted; SaleDate is backdated for replayed offline sales (see get_reconciliation_bounds)
+    ('Sales', 'RecordedAt', 'TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP'),
+    ('SalesArchive', 'RecordedAt', 'TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP'),
+    # The sale a 'Sale' log belongs to (NULL for other change types)
+    ('InventoryLogs', 'SaleID', 'INT NULL'),
+    ('InventoryLogsArchive', 'SaleID', 'INT NULL'),
+]
+# Run once, right after the column is added, to fill it for existing rows. Sale logs used to name their
+# sale only in Notes, as 'Sale ID: <id>'
+EXTENSION_COLUMN_BACKFILLS = {
+    ('InventoryLogs', 'SaleID'): "UPDATE InventoryLogs SET SaleID = CAST(SUBSTRING(Notes, 10) AS UNSIGNED) WHERE ChangeType = 'Sale' AND Notes LIKE 'Sale ID: %'",
+    ('InventoryLogsArchive', 'SaleID'): "UPDATE InventoryLogsArchive SET SaleID = CAST(SUBSTRING(Notes, 10) AS UNSIGNED) WHERE ChangeType = 'Sale' AND Notes LIKE 'Sale ID: %'",
+}
+# Secondary indexes added to existing tables: (table, index name, index type, columns). MySQL has no CREATE INDEX IF NOT EXISTS.
+EXTENSION_INDEXES = [
+    ('Sales', 'idx_sales_customer_date', 'INDEX', 'CustomerID, SaleDate'),
+    ('SalesArchive', 'idx_sales_customer_date', 'INDEX', 'CustomerID, SaleDate'),
+    ('Sales', 'uq_sales_client_token', 'UNIQUE INDEX', 'ClientToken'),
+    ('SalesArchive', 'uq_sales_client_token', 'UNIQUE INDEX', 'ClientToken'),
+]
+
+def _ensure_columns(cursor):
+    for table, column, definition in EXTENSION_COLUMNS:
+        cursor.execute("""SELECT COUNT(*) FROM information_schema.COLUMNS
+                          WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s""", (table, column))
+        if not cursor.fetchone()[0]:
+            logger.info("Adding column %s to %s.", column, table)
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            backfill = EXTENSION_COLUMN_BACKFILLS.get((table, column))
+            if backfill:
+                cursor.execute(backfill)
+                logger.info("Filled %s.%s for %s existing rows.", table, column, cursor.rowcount)
+
+def _ensure_indexes(cursor):
+    for table, index_name, index_type, columns in EXTENSION_INDEXES:
+        cursor.execute("""SELECT COUNT(*) FROM information_schema.STATISTICS
+                          WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s""", (table, index_name))
+        if not cursor.fetchone()[0]:
+            logger.info("Adding index %s on %s (%s).", index_name, table, columns)
+            cursor.execute(f"ALTER TABLE {table} ADD {index_type} {index_name} ({columns})")
+
+def ensure_extension_tables(conn):
+    """Creates the supporting tables if they do not exist. Returns True on success, False otherwise."""
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return False
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        for ddl in EXTENSION_TABLES_DDL:
+            cursor.execute(ddl)
+        _ensure_columns(cursor)
+        _ensure_indexes(cursor)
+        conn.commit()
+        return True
+    except Error as e:
+        logger.error("Error creating extension tables", exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return False
+    finally:
+        if cursor: cursor.close()
+
+# --- Change Feed Functions ---
+# Entity types published to the ChangeFeed table (consumed by change_feed.ChangeFeedSubscriber)
+ENTITY_CATEGORY = 'category'
+ENTITY_PRODUCT = 'product'
+ENTITY_CUSTOMER = 'customer'
+ENTITY_SALE = 'sale'
+# ChangeType is 'insert', 'update' or 'delete'; 'stock' marks a product update that only changed StockQuantity
+
+def record_change(cursor, entity_type, entity_id, change_type):
+    """Appends a change event inside the caller's transaction, so it commits or rolls back with the write.
+       A missing ChangeFeed table never fails the write itself.
+    """
+    try:
+        cursor.execute("INSERT INTO ChangeFeed (EntityType, EntityID, ChangeType) VALUES (%s, %s, %s)",
+                       (entity_type, entity_id, change_type))
+    except Error as e:
+        logger.error("Error recording %s of %s %s in change feed", change_type, entity_type, entity_id, exc_info=e)
+
+def record_changes(cursor, entity_type, entity_ids, change_type):
+    """Appends one change event per entity with a single multi-row insert (see record_change)."""
+    if not entity_ids: return
+    try:
+        placeholders = ', '.join(['(%s, %s, %s)'] * len(entity_ids))
+        params = [value for entity_id in entity_ids for value in (entity_type, entity_id, change_type)]
+        cursor.execute(f"INSERT INTO ChangeFeed (EntityType, EntityID, ChangeType) VALUES {placeholders}", params)
+    except Error as e:
+        logger.error("Error recording %s %s events of %s in change feed", len(entity_ids), change_type, entity_type, exc_info=e)
+
+def fetch_changes_since(conn, watermark, limit=1000):
+    """Fetches change events with ChangeID above the watermark. Returns a list of dicts or an empty list."""
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return []
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        sql = """SELECT ChangeID, EntityType, EntityID, ChangeType
+                 FROM ChangeFeed WHERE ChangeID > %s ORDER BY ChangeID LIMIT %s"""
+        cursor.execute(sql, (watermark, limit))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching change feed", exc_info=e)
+        return []
+    finally:
+        if cursor: cursor.close()
+
+def fetch_changes_by_ids(conn, change_ids):
+    """Fetches specific change events (used to re-check IDs that were skipped while still uncommitted)."""
+    if not change_ids: return []
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return []
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        placeholders = ', '.join(['%s'] * len(change_ids))
+        sql = f"""SELECT ChangeID, EntityType, EntityID, ChangeType
+                  FROM ChangeFeed WHERE ChangeID IN ({placeholders}) ORDER BY ChangeID"""
+        cursor.execute(sql, tuple(change_ids))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching change feed entries by ID", exc_info=e)
+        return []
+    finally:
+        if cursor: cursor.close()
+
+def get_change_feed_bounds(conn):
+    """Gets (oldest ChangeID, newest ChangeID) in the feed. Returns (0, 0) when empty or on failure."""
+    if not conn or not conn.is_connected(): return (0, 0)
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MIN(ChangeID), 0), COALESCE(MAX(ChangeID), 0) FROM ChangeFeed")
+        bounds = cursor.fetchone()
+        return (bounds[0], bounds[1]) if bounds else (0, 0)
+    except Error as e:
+        logger.error("Error getting change feed bounds", exc_info=e)
+        return (0, 0)
+    finally:
+        if cursor: cursor.close()
+
+def prune_change_feed(conn, retention_seconds):
+    """Deletes change events older than the retention window. Returns the number of rows removed."""
+    if not conn or not conn.is_connected(): return 0
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM ChangeFeed WHERE ChangedAt < NOW(6) - INTERVAL %s SECOND", (retention_seconds,))
+        conn.commit()
+        return cursor.rowcount
+    except Error as e:
+        logger.error("Error pruning change feed", exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return 0
+    finally:
+        if cursor: cursor.close()
+
+def bump_data_versions(conn, *entity_types):
+    """Increments the table-level version of each entity type. Call only after the write has committed,
+       so a version is never visible before the data it describes.
+    """
+    if not entity_types or not conn or not conn.is_connected(): return
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        entity_types = sorted(set(entity_types)) # Fixed order avoids deadlocks between concurrent bumps
+        placeholders = ', '.join(['(%s, 1)'] * len(entity_types))
+        sql = f"""INSERT INTO DataVersions (EntityType, Version) VALUES {placeholders}
+                  ON DUPLICATE KEY UPDATE Version = Version + 1, UpdatedAt = NOW(6)"""
+        cursor.execute(sql, tuple(entity_types))
+        conn.commit()
+    except Error as e:
+        logger.error("Error bumping data versions %s", entity_types, exc_info=e)
+        if conn.is_connected(): conn.rollback()
+    finally:
+        if cursor: cursor.close()
+
+def get_data_versions(conn, entity_types):
+    """Gets {EntityType: {'Version': int, 'UpdatedAt': epoch seconds or None}} for the given types.
+       Types never written report version 0. Returns None on failure, since a stale version must not be trusted.
+    """
+    versions = {entity_type: {'Version': 0, 'UpdatedAt': None} for entity_type in entity_types}
+    if not conn or not conn.is_connected(): return None
+    if not entity_types: return versions
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        placeholders = ', '.join(['%s'] * len(entity_types))
+        sql = f"""SELECT EntityType, Version, UNIX_TIMESTAMP(UpdatedAt) AS UpdatedAt
+                  FROM DataVersions WHERE EntityType IN ({placeholders})"""
+        cursor.execute(sql, tuple(entity_types))
+        for row in cursor.fetchall():
+            versions[row['EntityType']] = {'Version': row['Version'], 'UpdatedAt': float(row['UpdatedAt'])}
+        return versions
+    except Error as e:
+        logger.error("Error fetching data versions", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+# --- Product Listing Projection ---
+# ProductListing rows are rewritten from Products/Categories inside the same transaction as each write,
+# so listing pages read one table with no joins. SortName is the case-folded name used for ordering.
+_LISTING_UPSERT_SQL = """INSERT INTO ProductListing
+                             (ProductID, ProductName, SortName, Description, CategoryID, CategoryName, Price, StockQuantity, SupplierID)
+                         SELECT p.ProductID, p.ProductName, LOWER(p.ProductName), p.Description, p.CategoryID, c.CategoryName,
+                                p.Price, p.StockQuantity, p.SupplierID
+                         FROM Products p
+                         LEFT JOIN Categories c ON p.CategoryID = c.CategoryID
+                         {where}
+                         ON DUPLICATE KEY UPDATE ProductName = VALUES(ProductName), SortName = VALUES(SortName),
+                             Description = VALUES(Description), CategoryID = VALUES(CategoryID),
+                             CategoryName = VALUES(CategoryName), Price = VALUES(Price),
+                             StockQuantity = VALUES(StockQuantity), SupplierID = VALUES(SupplierID)"""
+
+def refresh_product_listing(cursor, product_ids):
+    """Rewrites the ProductListing rows for product_ids inside the caller's transaction."""
+    if not product_ids: return
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    cursor.execute(_LISTING_UPSERT_SQL.format(where=f"WHERE p.ProductID IN ({placeholders})"), tuple(product_ids))
+
+def fetch_listing_changes(conn, since=None):
+    """Fetches ProductListing rows updated at or after `since` (all rows when None), oldest change first.
+       Returns a list of (ProductID, ProductName, CategoryName, Price, StockQuantity, UpdatedAt) tuples, or None on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        sql = "SELECT ProductID, ProductName, CategoryName, Price, StockQuantity, UpdatedAt FROM ProductListing"
+        params = ()
+        if since is not None:
+            sql += " WHERE UpdatedAt >= %s"
+            params = (since,)
+        cursor.execute(sql + " ORDER BY UpdatedAt", params)
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching product listing changes", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def rebuild_product_listing(conn):
+    """Rebuilds ProductListing from Products and Categories, e.g. after editing them with plain SQL.
+       Returns the number of products listed, or None on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""DELETE l FROM ProductListing l
+                          LEFT JOIN Products p ON p.ProductID = l.ProductID
+                          WHERE p.ProductID IS NULL""")
+        cursor.execute(_LISTING_UPSERT_SQL.format(where=""))
+        cursor.execute("SELECT COUNT(*) FROM ProductListing")
+        count = cursor.fetchone()[0]
+        conn.commit()
+        return count
+    except Error as e:
+        logger.error("Error rebuilding product listing", exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def ensure_product_listing(conn):
+    """Rebuilds ProductListing at startup if it is missing products (e.g. on first run). Returns True if it is in sync."""
+    if not conn or not conn.is_connected(): return False
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT (SELECT COUNT(*) FROM Products), (SELECT COUNT(*) FROM ProductListing)")
+        product_count, listing_count = cursor.fetchone()
+        conn.commit()
+    except Error as e:
+        logger.error("Error checking product listing", exc_info=e)
+        return False
+    finally:
+        if cursor: cursor.close()
+    if product_count == listing_count:
+        return True
+    logger.info("Rebuilding product listing (%s of %s products listed).", listing_count, product_count)
+    return rebuild_product_listing(conn) is not None
+
 # --- Category Functions ---
 def add_category(conn, category_name, description=""):
     """Adds a new category. Returns new CategoryID or None."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (add_category).")
+        logger.error("Connection not active.")
         return None
     cursor = None
     try:
@@ -49,16 +760,19 @@ def add_category(conn, category_name, description=""):
         sql = "INSERT INTO Categories (CategoryName, Description) VALUES (%s, %s)"
         val = (category_name, description)
         cursor.execute(sql, val)
+        category_id = cursor.lastrowid
+        record_change(cursor, ENTITY_CATEGORY, category_id, 'insert')
         conn.commit()
-        return cursor.lastrowid
+        bump_data_versions(conn, ENTITY_CATEGORY)
+        return category_id
     except Error as e:
         if e.errno == 1062: # Duplicate entry
-            print(f"DB_Error: Category name '{category_name}' already exists.")
+            logger.warning("Category name '%s' already exists.", category_name)
         else:
-            print(f"DB_Error adding category '{category_name}': {e}")
+            logger.error("Error adding category '%s'", category_name, exc_info=e)
         if conn.is_connected():
             try: conn.rollback()
-            except Error as rb_error: print(f"DB_Error during rollback (add_category): {rb_error}")
+            except Error as rb_error: logger.error("Error during rollback", exc_info=rb_error)
         return None
     finally:
         if cursor: cursor.close()
@@ -66,7 +780,7 @@ def add_category(conn, category_name, description=""):
 def fetch_categories(conn):
     """Fetches all categories, ordered by name. Returns a list of dicts or an empty list."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (fetch_categories).")
+        logger.error("Connection not active.")
         return []
     cursor = None
     try:
@@ -74,7 +788,7 @@ def fetch_categories(conn):
         cursor.execute("SELECT CategoryID, CategoryName, Description FROM Categories ORDER BY CategoryName")
         return cursor.fetchall()
     except Error as e:
-        print(f"DB_Error fetching categories: {e}")
+        logger.error("Error fetching categories", exc_info=e)
         return []
     finally:
         if cursor: cursor.close()
@@ -82,7 +796,7 @@ def fetch_categories(conn):
 def get_category_by_id(conn, category_id):
     """Fetches a category by its ID. Returns a dict or None."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (get_category_by_id).")
+        logger.error("Connection not active.")
         return None
     cursor = None
     try:
@@ -91,7 +805,7 @@ def get_category_by_id(conn, category_id):
         cursor.execute(sql, (category_id,))
         return cursor.fetchone()
     except Error as e:
-        print(f"DB_Error fetching category by ID '{category_id}': {e}")
+        logger.error("Error fetching category by ID '%s'", category_id, exc_info=e)
         return None
     finally:
         if cursor: cursor.close()
@@ -99,7 +813,7 @@ def get_category_by_id(conn, category_id):
 def get_category_by_name(conn, category_name):
     """Fetches a category by name. Returns a dict or None."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (get_category_by_name).")
+        logger.error("Connection not active.")
         return None
     cursor = None
     try:
@@ -108,7 +822,7 @@ def get_category_by_name(conn, category_name):
         cursor.execute(sql, (category_name,))
         return cursor.fetchone()
     except Error as e:
-        print(f"DB_Error fetching category by name '{category_name}': {e}")
+        logger.error("Error fetching category by name '%s'", category_name, exc_info=e)
         return None
     finally:
         if cursor: cursor.close()
@@ -123,20 +837,25 @@ def get_or_create_category(conn, category_name, description=""):
 def update_category(conn, category_id, new_name, new_description):
     """Updates an existing category. Returns True on success, False on failure."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (update_category).")
+        logger.error("Connection not active.")
         return False
     cursor = None
     try:
         cursor = conn.cursor()
         sql = "UPDATE Categories SET CategoryName = %s, Description = %s WHERE CategoryID = %s"
         cursor.execute(sql, (new_name, new_description, category_id))
+        updated = cursor.rowcount > 0
+        if updated:
+            cursor.execute("UPDATE ProductListing SET CategoryName = %s WHERE CategoryID = %s", (new_name, category_id))
+            record_change(cursor, ENTITY_CATEGORY, category_id, 'update')
         conn.commit()
-        return cursor.rowcount > 0
+        if updated: bump_data_versions(conn, ENTITY_CATEGORY)
+        return updated
     except Error as e:
         if e.errno == 1062:
-            print(f"DB_Error updating Category ID {category_id}: Name '{new_name}' already exists.")
+            logger.warning("Cannot update Category ID %s: Name '%s' already exists.", category_id, new_name)
         else:
-            print(f"DB_Error updating Category ID {category_id}: {e}")
+            logger.error("Error updating Category ID %s", category_id, exc_info=e)
         if conn.is_connected(): conn.rollback()
         return False
     finally:
@@ -145,20 +864,27 @@ def update_category(conn, category_id, new_name, new_description):
 def delete_category(conn, category_id):
     """Deletes a category. Returns True on success, False on failure."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (delete_category).")
+        logger.error("Connection not active.")
         return False
     cursor = None
     try:
         cursor = conn.cursor()
+        cursor.execute("SELECT ProductID FROM ProductListing WHERE CategoryID = %s", (category_id,))
+        listed_product_ids = [row[0] for row in cursor.fetchall()]
         sql = "DELETE FROM Categories WHERE CategoryID = %s"
         cursor.execute(sql, (category_id,))
+        deleted = cursor.rowcount > 0
+        if deleted:
+            refresh_product_listing(cursor, listed_product_ids) # Picks up whatever the FK did to these products
+            record_change(cursor, ENTITY_CATEGORY, category_id, 'delete')
         conn.commit()
-        return cursor.rowcount > 0
+        if deleted: bump_data_versions(conn, ENTITY_CATEGORY)
+        return deleted
     except Error as e:
         if e.errno == 1451: # Foreign key constraint violation
-            print(f"DB_Error: Cannot delete Category ID {category_id}, referenced by products.")
+            logger.warning("Cannot delete Category ID %s, referenced by products.", category_id)
         else:
-            print(f"DB_Error deleting Category ID {category_id}: {e}")
+            logger.error("Error deleting Category ID %s", category_id, exc_info=e)
         if conn.is_connected(): conn.rollback()
         return False
     finally:
@@ -168,27 +894,21 @@ def delete_category(conn, category_id):
 def get_product_by_id(conn, product_id):
     """Fetches a product by ID, including CategoryName. Returns a dict or None."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (get_product_by_id).")
+        logger.error("Connection not active.")
         return None
-    cursor = None
     try:
-        cursor = conn.cursor(dictionary=True, buffered=True)
-        sql = """SELECT p.*, c.CategoryName
-                 FROM Products p
-                 LEFT JOIN Categories c ON p.CategoryID = c.CategoryID
-                 WHERE p.ProductID = %s"""
-        cursor.execute(sql, (product_id,))
-        return cursor.fetchone()
+        sql = """SELECT ProductID, ProductName, Description, CategoryID, Price, StockQuantity, SupplierID, CategoryName
+                 FROM ProductListing
+                 WHERE ProductID = %s"""
+        return statement_cache.fetch_one(conn, sql, (product_id,), dictionary=True)
     except Error as e:
-        print(f"DB_Error fetching product by ID '{product_id}': {e}")
+        logger.error("Error fetching product by ID '%s'", product_id, exc_info=e)
         return None
-    finally:
-        if cursor: cursor.close()
 
 def get_product_by_name(conn, product_name):
     """Fetches a product by its name. Returns a dict or None."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (get_product_by_name).")
+        logger.error("Connection not active.")
         return None
     cursor = None
     try:
@@ -197,7 +917,7 @@ def get_product_by_name(conn, product_name):
         cursor.execute(sql, (product_name,))
         return cursor.fetchone()
     except Error as e:
-        print(f"DB_Error fetching product by name '{product_name}': {e}")
+        logger.error("Error fetching product by name '%s'", product_name, exc_info=e)
         return None
     finally:
         if cursor: cursor.close()
@@ -205,10 +925,10 @@ def get_product_by_name(conn, product_name):
 def actual_add_product(conn, product_name, description, category_id, price, stock_quantity, supplier_id=None):
     """Internal: Inserts a new product. Returns ProductID or None."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (actual_add_product).")
+        logger.error("Connection not active.")
         return None
     if category_id is None:
-        print(f"DB_Logic_Error: CategoryID missing for product '{product_name}'.")
+        logger.warning("CategoryID missing for product '%s'.", product_name)
         return None
     cursor = None
     try:
@@ -218,13 +938,17 @@ def actual_add_product(conn, product_name, description, category_id, price, stoc
                  VALUES (%s, %s, %s, %s, %s, %s)"""
         val = (product_name, description, category_id, price, stock_quantity, supplier_id)
         cursor.execute(sql, val)
+        product_id = cursor.lastrowid
+        refresh_product_listing(cursor, [product_id])
+        record_change(cursor, ENTITY_PRODUCT, product_id, 'insert')
         conn.commit()
-        return cursor.lastrowid
+        bump_data_versions(conn, ENTITY_PRODUCT)
+        return product_id
     except Error as e:
         if e.errno == 1062:
-            print(f"DB_Error: Product '{product_name}' already exists (Unique Constraint).")
+            logger.warning("Product '%s' already exists (Unique Constraint).", product_name)
         else:
-            print(f"DB_Error adding product '{product_name}': {e}")
+            logger.error("Error adding product '%s'", product_name, exc_info=e)
         if conn.is_connected(): conn.rollback()
         return None
     finally:
@@ -233,7 +957,7 @@ def actual_add_product(conn, product_name, description, category_id, price, stoc
 def update_product_details(conn, product_id, new_price=None, new_stock_quantity=None, new_description=None, new_category_id=None):
     """Updates product details. Returns True on success, False otherwise."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (update_product_details).")
+        logger.error("Connection not active.")
         return False
     if not any([new_price is not None, new_stock_quantity is not None, new_description is not None, new_category_id is not None]):
         return False # No actual updates provided
@@ -252,10 +976,15 @@ def update_product_details(conn, product_id, new_price=None, new_stock_quantity=
         cursor = conn.cursor()
         sql = f"UPDATE Products SET {', '.join(updates)} WHERE ProductID = %s"
         cursor.execute(sql, tuple(params))
+        updated = cursor.rowcount > 0
+        if updated:
+            refresh_product_listing(cursor, [product_id])
+            record_change(cursor, ENTITY_PRODUCT, product_id, 'update')
         conn.commit()
-        return cursor.rowcount > 0
+        if updated: bump_data_versions(conn, ENTITY_PRODUCT)
+        return updated
     except Error as e:
-        print(f"DB_Error updating Product ID {product_id}: {e}")
+        logger.error("Error updating Product ID %s", product_id, exc_info=e)
         if conn.is_connected(): conn.rollback()
         return False
     finally:
@@ -264,7 +993,7 @@ def update_product_details(conn, product_id, new_price=None, new_stock_quantity=
 def get_or_create_product(conn, product_name, description, category_id, price, stock_quantity, supplier_id=None, update_if_exists=False):
     """Gets product by name; creates if not found. Updates if found and update_if_exists is True. Returns ProductID or None."""
     if category_id is None:
-        print(f"DB_Logic_Error: CategoryID missing for product '{product_name}'.")
+        logger.warning("CategoryID missing for product '%s'.", product_name)
         return None
     existing_product = get_product_by_name(conn, product_name)
     if existing_product:
@@ -274,10 +1003,13 @@ def get_or_create_product(conn, product_name, description, category_id, price, s
         return product_id
     return actual_add_product(conn, product_name, description, category_id, price, stock_quantity, supplier_id)
 
-def fetch_products_with_category_names(conn, search_term=None, page=1, items_per_page=10):
-    """Fetches paginated/searched products. Returns {'products': list, 'total_count': int}."""
+def fetch_products_with_category_names(conn, search_term=None, page=1, items_per_page=10, errors=None):
+    """Fetches paginated/searched products. Returns {'products': list, 'total_count': int}.
+       errors: optional list; a database error that emptied the result is appended to it.
+    """
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (fetch_products_with_category_names).")
+        logger.error("Connection not active.")
+        if errors is not None: errors.append(Error("Connection not active."))
         return {'products': [], 'total_count': 0}
 
     offset = (page - 1) * items_per_page
@@ -286,62 +1018,290 @@ def fetch_products_with_category_names(conn, search_term=None, page=1, items_per
     cursor = None
     try:
         cursor = conn.cursor(dictionary=True, buffered=True)
-        base_sql_select = "SELECT p.ProductID, p.ProductName, p.Description, c.CategoryName, p.CategoryID, p.Price, p.StockQuantity "
-        base_sql_from_join = "FROM Products p LEFT JOIN Categories c ON p.CategoryID = c.CategoryID "
+        base_sql_select = "SELECT ProductID, ProductName, Description, CategoryName, CategoryID, Price, StockQuantity "
+        base_sql_from = "FROM ProductListing "
         
         where_clauses = []
         params = []
         if search_term:
-            where_clauses.append("p.ProductName LIKE %s")
+            where_clauses.append("ProductName LIKE %s")
             params.append(f"%{search_term}%")
         
         sql_where_clause = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
 
-        count_sql = f"SELECT COUNT(p.ProductID) as total FROM Products p {sql_where_clause}"
+        count_sql = f"SELECT COUNT(*) as total FROM ProductListing {sql_where_clause}"
         cursor.execute(count_sql, tuple(params))
         total_count_result = cursor.fetchone()
         if total_count_result: total_count = total_count_result['total']
 
         paginated_params = list(params)
         paginated_params.extend([offset, items_per_page])
-        products_sql = f"{base_sql_select} {base_sql_from_join} {sql_where_clause} ORDER BY p.ProductName LIMIT %s, %s"
+        products_sql = f"{base_sql_select} {base_sql_from} {sql_where_clause} ORDER BY SortName, ProductID LIMIT %s, %s"
         cursor.execute(products_sql, tuple(paginated_params))
         products_on_page = cursor.fetchall()
         
         return {'products': products_on_page, 'total_count': total_count}
     except Error as e:
-        print(f"DB_Error fetching paginated products: {e}")
+        logger.error("Error fetching paginated products", exc_info=e)
+        if errors is not None: errors.append(e)
         return {'products': [], 'total_count': 0}
     finally:
         if cursor: cursor.close()
 
+_PRODUCTS_FOR_SALE_SQL = """SELECT ProductID, ProductName, CategoryName, Price, StockQuantity
+                             FROM ProductListing
+                             ORDER BY SortName, ProductID"""
+
+def iter_products_for_sale(conn, batch_size=None):
+    """Streams all products (ProductID, ProductName, Price, StockQuantity, CategoryName) by name for the POS. Returns a StreamedRows."""
+    return StreamedRows(conn, _PRODUCTS_FOR_SALE_SQL, batch_size=batch_size, label='POS products')
+
+def fetch_products_for_sale(conn):
+    """Fetches the same rows as iter_products_for_sale as a list (e.g. for the offline POS snapshot). Returns None on error."""
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        cursor.execute(_PRODUCTS_FOR_SALE_SQL)
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching POS products", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
 def delete_product(conn, product_id):
     """Deletes a product. Returns True on success, False otherwise."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (delete_product).")
+        logger.error("Connection not active.")
         return False
     cursor = None
     try:
-        cursor = conn.cursor()
+        cursor = conn.cursor(buffered=True)
+        # Archived sale lines have no foreign key, so they are checked here like the hot ones are by the database.
+        # The product row is locked first: archive_sales_batch share-locks the products whose lines it moves,
+        # so lines cannot move from SaleDetails to the archive between this check and the DELETE.
+        cursor.execute("SELECT ProductID FROM Products WHERE ProductID = %s FOR UPDATE", (product_id,))
+        cursor.execute("SELECT 1 FROM SaleDetailsArchive WHERE ProductID = %s LIMIT 1 FOR SHARE", (product_id,))
+        if cursor.fetchone():
+            conn.rollback()
+            logger.warning("Cannot delete Product ID %s, referenced in archived sales records.", product_id)
+            return False
         sql = "DELETE FROM Products WHERE ProductID = %s"
         cursor.execute(sql, (product_id,))
+        deleted = cursor.rowcount > 0
+        if deleted: record_change(cursor, ENTITY_PRODUCT, product_id, 'delete')
         conn.commit()
-        return cursor.rowcount > 0
+        if deleted: bump_data_versions(conn, ENTITY_PRODUCT)
+        return deleted
     except Error as e:
         if e.errno == 1451:
-            print(f"DB_Error: Cannot delete Product ID {product_id}, referenced in sales records.")
+            logger.warning("Cannot delete Product ID %s, referenced in sales records.", product_id)
         else:
-            print(f"DB_Error deleting Product ID {product_id}: {e}")
+            logger.error("Error deleting Product ID %s", product_id, exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return False
+    finally:
+        if cursor: cursor.close()
+
+# --- Bulk Product Functions ---
+# Bulk changes run as set-based statements over chunks of BULK_CHUNK_SIZE products, one transaction per chunk,
+# so a large job never holds locks for long and a failure loses at most the chunk in progress.
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '500'))
+PRICE_CHANGE_PERCENT = 'percent'
+PRICE_CHANGE_ABSOLUTE = 'absolute'
+STOCK_COUNT_SET = 'set'       # Quantities are counted stock levels
+STOCK_COUNT_ADJUST = 'adjust' # Quantities are changes to the current level
+INVENTORY_ADJUSTMENT = 'Adjustment'
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def bulk_adjust_prices(conn, category_id, mode, amount, chunk_size=None, progress=None):
+    """Changes the price of every product in a category by a percentage or an absolute amount.
+       Prices that would drop to zero or below are left unchanged and counted as skipped.
+       progress: optional callback(processed, total) called after each committed chunk.
+       Returns {'matched', 'updated', 'skipped', 'chunks'}, or None on error (earlier chunks stay committed).
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    if mode == PRICE_CHANGE_PERCENT:
+        new_price = "ROUND(Price * (1 + %s / 100), 2)"
+    elif mode == PRICE_CHANGE_ABSOLUTE:
+        new_price = "ROUND(Price + %s, 2)"
+    else:
+        logger.warning("Unknown price change mode '%s'.", mode)
+        return None
+    summary = {'matched': 0, 'updated': 0, 'skipped': 0, 'chunks': 0}
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT ProductID FROM Products WHERE CategoryID = %s ORDER BY ProductID", (category_id,))
+        product_ids = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        for chunk in _chunks(product_ids, chunk_size or BULK_CHUNK_SIZE):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"""UPDATE Products SET Price = {new_price}
+                               WHERE CategoryID = %s AND ProductID IN ({placeholders}) AND {new_price} > 0""",
+                           (amount, category_id, *chunk, amount))
+            updated = cursor.rowcount
+            cursor.execute(f"SELECT COUNT(*) FROM Products WHERE CategoryID = %s AND ProductID IN ({placeholders})",
+                           (category_id, *chunk))
+            matched = cursor.fetchone()[0]
+            refresh_product_listing(cursor, chunk)
+            record_changes(cursor, ENTITY_PRODUCT, chunk, 'update')
+            conn.commit()
+            bump_data_versions(conn, ENTITY_PRODUCT)
+            summary['matched'] += matched
+            summary['updated'] += updated
+            summary['skipped'] += matched - updated
+            summary['chunks'] += 1
+            if progress: progress(summary['matched'], len(product_ids))
+        return summary
+    except Error as e:
+        logger.error("Error bulk-adjusting prices for Category ID %s", category_id, exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def bulk_set_stock(conn, counts, mode=STOCK_COUNT_SET, notes="Stock count", chunk_size=None, progress=None):
+    """Applies a stock take: counts is a list of (ProductID, quantity) pairs, counted levels or changes per mode.
+       Each changed product gets an 'Adjustment' InventoryLogs row with the difference.
+       progress: optional callback(processed, total) called after each committed chunk.
+       Returns {'processed', 'updated', 'unchanged', 'unknown_ids', 'negative_ids', 'chunks'},
+       or None on error (earlier chunks stay committed).
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    if mode not in (STOCK_COUNT_SET, STOCK_COUNT_ADJUST):
+        logger.warning("Unknown stock count mode '%s'.", mode)
+        return None
+    if mode == STOCK_COUNT_SET:
+        latest = dict(counts) # A product counted twice takes its last count
+    else:
+        latest = {}
+        for product_id, change in counts: # Repeated adjustments for a product add up
+            latest[product_id] = latest.get(product_id, 0) + change
+    product_ids = sorted(latest)
+    summary = {'processed': 0, 'updated': 0, 'unchanged': 0, 'unknown_ids': [], 'negative_ids': [], 'chunks': 0}
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        for chunk in _chunks(product_ids, chunk_size or BULK_CHUNK_SIZE):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"SELECT ProductID, StockQuantity FROM Products WHERE ProductID IN ({placeholders}) FOR UPDATE",
+                           tuple(chunk))
+            current = dict(cursor.fetchall())
+            changes = []
+            for product_id in chunk:
+                if product_id not in current:
+                    summary['unknown_ids'].append(product_id)
+                    continue
+                new_quantity = latest[product_id] if mode == STOCK_COUNT_SET else current[product_id] + latest[product_id]
+                if new_quantity < 0:
+                    summary['negative_ids'].append(product_id)
+                elif new_quantity != current[product_id]:
+                    changes.append((product_id, new_quantity, new_quantity - current[product_id]))
+                else:
+                    summary['unchanged'] += 1
+            if changes:
+                changed_ids = [change[0] for change in changes]
+                id_placeholders = ', '.join(['%s'] * len(changes))
+                case_sql = ' '.join(['WHEN %s THEN %s'] * len(changes))
+                case_params = [value for change in changes for value in change[:2]]
+                cursor.execute(f"UPDATE Products SET StockQuantity = CASE ProductID {case_sql} END WHERE ProductID IN ({id_placeholders})",
+                               (*case_params, *changed_ids))
+                cursor.execute(f"UPDATE ProductListing SET StockQuantity = CASE ProductID {case_sql} END WHERE ProductID IN ({id_placeholders})",
+                               (*case_params, *changed_ids))
+                log_placeholders = ', '.join(['(%s, %s, %s, %s)'] * len(changes))
+                log_params = [value for product_id, _, delta in changes
+                              for value in (product_id, INVENTORY_ADJUSTMENT, delta, notes)]
+                cursor.execute(f"INSERT INTO InventoryLogs (ProductID, ChangeType, QuantityChange, Notes) VALUES {log_placeholders}",
+                               log_params)
+                record_changes(cursor, ENTITY_PRODUCT, changed_ids, 'stock')
+            conn.commit()
+            if changes: bump_data_versions(conn, ENTITY_PRODUCT)
+            summary['processed'] += len(chunk)
+            summary['updated'] += len(changes)
+            summary['chunks'] += 1
+            if progress: progress(summary['processed'], len(product_ids))
+        return summary
+    except Error as e:
+        logger.error("Error applying bulk stock counts", exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return None
+    finally:
+        if cursor: cursor.close()
+
+_BULK_JOB_COLUMNS = "JobID, Kind, Description, Status, Processed, Total, Summary, Error, StartedAt, FinishedAt, UpdatedAt"
+
+def save_bulk_job(conn, job):
+    """Inserts or updates a bulk job's state. job: dict with JobID, Kind, Description, Status, Processed,
+       Total, Summary (JSON text), Error, StartedAt and FinishedAt. Returns True on success, False otherwise.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return False
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""INSERT INTO BulkJobs (JobID, Kind, Description, Status, Processed, Total, Summary, Error, StartedAt, FinishedAt)
+                          VALUES (%(JobID)s, %(Kind)s, %(Description)s, %(Status)s, %(Processed)s, %(Total)s,
+                                  %(Summary)s, %(Error)s, %(StartedAt)s, %(FinishedAt)s)
+                          ON DUPLICATE KEY UPDATE Status = VALUES(Status), Processed = VALUES(Processed), Total = VALUES(Total),
+                              Summary = VALUES(Summary), Error = VALUES(Error), FinishedAt = VALUES(FinishedAt)""", job)
+        conn.commit()
+        return True
+    except Error as e:
+        logger.error("Error saving bulk job %s", job.get('JobID'), exc_info=e)
         if conn.is_connected(): conn.rollback()
         return False
     finally:
         if cursor: cursor.close()
 
+def get_bulk_job(conn, job_id):
+    """Fetches a bulk job by ID. Returns a dict or None if not found or on error."""
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        cursor.execute(f"SELECT {_BULK_JOB_COLUMNS} FROM BulkJobs WHERE JobID = %s", (job_id,))
+        return cursor.fetchone()
+    except Error as e:
+        logger.error("Error fetching bulk job %s", job_id, exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def fetch_bulk_jobs(conn, limit):
+    """Fetches the most recent bulk jobs, newest first. Returns a list of dicts, or None on error."""
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"SELECT {_BULK_JOB_COLUMNS} FROM BulkJobs ORDER BY StartedAt DESC, JobID LIMIT %s", (limit,))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching bulk jobs", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
 # --- Customer Functions ---
 def add_customer(conn, first_name, last_name=None, email=None, phone_number=None, address=None):
     """Adds a new customer. Returns new CustomerID or None."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (add_customer).")
+        logger.error("Connection not active.")
         return None
     cursor = None
     try:
@@ -350,13 +1310,16 @@ def add_customer(conn, first_name, last_name=None, email=None, phone_number=None
                  VALUES (%s, %s, %s, %s, %s)"""
         val = (first_name, last_name, email, phone_number, address)
         cursor.execute(sql, val)
+        customer_id = cursor.lastrowid
+        record_change(cursor, ENTITY_CUSTOMER, customer_id, 'insert')
         conn.commit()
-        return cursor.lastrowid
+        bump_data_versions(conn, ENTITY_CUSTOMER)
+        return customer_id
     except Error as e:
         if e.errno == 1062 and email:
-            print(f"DB_Error: Customer with email '{email}' already exists.")
+            logger.warning("Customer with email '%s' already exists.", email)
         else:
-            print(f"DB_Error adding customer '{first_name} {last_name or ''}': {e}")
+            logger.error("Error adding customer '%s %s'", first_name, last_name or '', exc_info=e)
         if conn.is_connected(): conn.rollback()
         return None
     finally:
@@ -365,7 +1328,7 @@ def add_customer(conn, first_name, last_name=None, email=None, phone_number=None
 def fetch_customers(conn):
     """Fetches all customers, ordered by name. Returns a list of dicts or an empty list."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (fetch_customers).")
+        logger.error("Connection not active.")
         return []
     cursor = None
     try:
@@ -374,7 +1337,7 @@ def fetch_customers(conn):
         cursor.execute(sql)
         return cursor.fetchall()
     except Error as e:
-        print(f"DB_Error fetching customers: {e}")
+        logger.error("Error fetching customers", exc_info=e)
         return []
     finally:
         if cursor: cursor.close()
@@ -382,7 +1345,7 @@ def fetch_customers(conn):
 def get_customer_by_id(conn, customer_id):
     """Fetches a customer by ID. Returns a dict or None."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (get_customer_by_id).")
+        logger.error("Connection not active.")
         return None
     cursor = None
     try:
@@ -391,7 +1354,7 @@ def get_customer_by_id(conn, customer_id):
         cursor.execute(sql, (customer_id,))
         return cursor.fetchone()
     except Error as e:
-        print(f"DB_Error fetching customer by ID '{customer_id}': {e}")
+        logger.error("Error fetching customer by ID '%s'", customer_id, exc_info=e)
         return None
     finally:
         if cursor: cursor.close()
@@ -399,7 +1362,7 @@ def get_customer_by_id(conn, customer_id):
 def update_customer(conn, customer_id, first_name, last_name=None, email=None, phone_number=None, address=None):
     """Updates an existing customer. Returns True on success, False otherwise."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (update_customer).")
+        logger.error("Connection not active.")
         return False
     
     updates = []
@@ -415,7 +1378,7 @@ def update_customer(conn, customer_id, first_name, last_name=None, email=None, p
     # Current logic updates all provided fields, potentially to NULL if None is passed and DB allows.
 
     if not updates or first_name is None: # Assuming first_name is essential for an update to proceed
-        print(f"Insufficient details or missing FirstName for update, CustomerID: {customer_id}.")
+        logger.warning("Insufficient details or missing FirstName for update, CustomerID: %s.", customer_id)
         return False 
 
     params.append(customer_id)
@@ -424,13 +1387,16 @@ def update_customer(conn, customer_id, first_name, last_name=None, email=None, p
         cursor = conn.cursor()
         sql = f"UPDATE Customers SET {', '.join(updates)} WHERE CustomerID = %s"
         cursor.execute(sql, tuple(params))
+        updated = cursor.rowcount > 0
+        if updated: record_change(cursor, ENTITY_CUSTOMER, customer_id, 'update')
         conn.commit()
-        return cursor.rowcount > 0
+        if updated: bump_data_versions(conn, ENTITY_CUSTOMER)
+        return updated
     except Error as e:
         if e.errno == 1062 and email:
-            print(f"DB_Error updating Customer ID {customer_id}: Email '{email}' already exists.")
+            logger.warning("Cannot update Customer ID %s: Email '%s' already exists.", customer_id, email)
         else:
-            print(f"DB_Error updating Customer ID {customer_id}: {e}")
+            logger.error("Error updating Customer ID %s", customer_id, exc_info=e)
         if conn.is_connected(): conn.rollback()
         return False
     finally:
@@ -439,33 +1405,208 @@ def update_customer(conn, customer_id, first_name, last_name=None, email=None, p
 def delete_customer(conn, customer_id):
     """Deletes a customer. Returns True on success, False otherwise."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (delete_customer).")
+        logger.error("Connection not active.")
         return False
     cursor = None
     try:
         cursor = conn.cursor()
+        # Unlinked sales no longer belong to anyone, so the customer's aggregates go with them
+        cursor.execute("DELETE FROM CustomerCategoryStats WHERE CustomerID = %s", (customer_id,))
+        cursor.execute("DELETE FROM CustomerStats WHERE CustomerID = %s", (customer_id,))
         sql = "DELETE FROM Customers WHERE CustomerID = %s"
         cursor.execute(sql, (customer_id,))
+        deleted = cursor.rowcount > 0
+        if deleted: cursor.execute("UPDATE SalesArchive SET CustomerID = NULL WHERE CustomerID = %s", (customer_id,))
+        if deleted: record_change(cursor, ENTITY_CUSTOMER, customer_id, 'delete')
         conn.commit()
-        return cursor.rowcount > 0
+        if deleted: bump_data_versions(conn, ENTITY_CUSTOMER, ENTITY_SALE) # Sales are unlinked from the customer
+        return deleted
     except Error as e:
-        print(f"DB_Error deleting Customer ID {customer_id}: {e}")
+        logger.error("Error deleting Customer ID %s", customer_id, exc_info=e)
         if conn.is_connected(): conn.rollback()
         return False
     finally:
         if cursor: cursor.close()
 
-# --- Sales Processing Functions ---
-def process_new_sale(conn, items_sold, customer_id=None, payment_method="Unknown"):
-    """Processes a new sale. Returns SaleID on success, None otherwise.
-       items_sold: [{'product_id': int, 'quantity': int, 'unit_price': float}, ...]
-    """
-    if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (process_new_sale).")
-        return None
-    if not items_sold:
-        print("Sale_Logic_Error: No items provided for sale.")
-        return None
+# --- Customer Aggregates ---
+# CustomerStats/CustomerCategoryStats hold running totals per customer, updated in the same transaction
+# as each sale, so a loyalty lookup reads two small rows instead of scanning Sales.
+TOP_CATEGORY_COUNT = 3
+_CUSTOMER_STATS_ADD_SQL = """INSERT INTO CustomerStats (CustomerID, LifetimeSpend, VisitCount, FirstPurchaseAt, LastPurchaseAt)
+                             VALUES (%s, %s, 1, COALESCE(%s, NOW()), COALESCE(%s, NOW()))
+                             ON DUPLICATE KEY UPDATE LifetimeSpend = LifetimeSpend + VALUES(LifetimeSpend), VisitCount = VisitCount + 1,
+                                 FirstPurchaseAt = LEAST(COALESCE(FirstPurchaseAt, VALUES(FirstPurchaseAt)), VALUES(FirstPurchaseAt)),
+                                 LastPurchaseAt = GREATEST(COALESCE(LastPurchaseAt, VALUES(LastPurchaseAt)), VALUES(LastPurchaseAt))"""
+_CUSTOMER_STATS_SQL = """SELECT CustomerID, LifetimeSpend, VisitCount, FirstPurchaseAt, LastPurchaseAt
+                         FROM CustomerStats WHERE CustomerID = %s"""
+_CUSTOMER_TOP_CATEGORIES_SQL = """SELECT cs.CategoryID, c.CategoryName, cs.Quantity, cs.Spend
+                                  FROM CustomerCategoryStats cs
+                                  JOIN Categories c ON c.CategoryID = cs.CategoryID
+                                  WHERE cs.CustomerID = %s
+                                  ORDER BY cs.Spend DESC, cs.CategoryID
+                                  LIMIT %s"""
+
+def record_customer_purchase(cursor, customer_id, sale_total, line_items_details, sale_date=None):
+    """Adds a sale to its customer's aggregates inside the caller's transaction.
+       line_items_details: [{'product_id', 'quantity', 'total_price'}, ...] as built by process_new_sale.
+       sale_date: when the sale was made, if not now (e.g. a replayed offline sale).
+       Missing aggregate tables are logged and never fail the sale.
+    """
+    try:
+        cursor.execute(_CUSTOMER_STATS_ADD_SQL, (customer_id, sale_total, sale_date, sale_date))
+        if line_items_details:
+            _add_customer_category_totals(cursor, customer_id, line_items_details)
+    except Error as e:
+        if e.errno != 1146: raise # Other failures (e.g. a deadlock) must fail the sale itself
+        logger.error("Customer stats tables are missing; Customer ID %s was not updated", customer_id, exc_info=e)
+
+def _add_customer_category_totals(cursor, customer_id, line_items_details):
+    lines = ' UNION ALL '.join(['SELECT %s AS ProductID, %s AS Quantity, %s AS Spend'] * len(line_items_details))
+    params = [customer_id] + [value for detail in line_items_details
+                              for value in (detail['product_id'], detail['quantity'], detail['total_price'])]
+    # Grouped rows are wrapped in a derived table so ON DUPLICATE KEY UPDATE may use VALUES()
+    cursor.execute(f"""INSERT INTO CustomerCategoryStats (CustomerID, CategoryID, Quantity, Spend)
+                       SELECT * FROM (
+                           SELECT %s AS CustomerID, p.CategoryID, SUM(l.Quantity) AS LineQuantity, SUM(l.Spend) AS LineSpend
+                           FROM ({lines}) l
+                           JOIN Products p ON p.ProductID = l.ProductID
+                           WHERE p.CategoryID IS NOT NULL
+                           GROUP BY p.CategoryID) AS totals
+                       ON DUPLICATE KEY UPDATE Quantity = Quantity + VALUES(Quantity), Spend = Spend + VALUES(Spend)""",
+                   params)
+
+def get_customer_stats(conn, customer_id):
+    """Fetches a customer's purchase aggregates: LifetimeSpend, VisitCount, AverageBasket, FirstPurchaseAt,
+       LastPurchaseAt and TopCategories (a list of dicts). Customers with no purchases get zero totals.
+       Returns a dict or None on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    try:
+        stats = statement_cache.fetch_one(conn, _CUSTOMER_STATS_SQL, (customer_id,), dictionary=True)
+        if stats is None:
+            stats = {'CustomerID': customer_id, 'LifetimeSpend': 0, 'VisitCount': 0,
+                     'FirstPurchaseAt': None, 'LastPurchaseAt': None}
+        stats['AverageBasket'] = stats['LifetimeSpend'] / stats['VisitCount'] if stats['VisitCount'] else None
+        stats['TopCategories'] = (statement_cache.fetch_all(conn, _CUSTOMER_TOP_CATEGORIES_SQL,
+                                                            (customer_id, TOP_CATEGORY_COUNT), dictionary=True)
+                                  if stats['VisitCount'] else [])
+        return stats
+    except Error as e:
+        logger.error("Error fetching stats for Customer ID %s", customer_id, exc_info=e)
+        return None
+
+def fetch_customer_purchase_history(conn, customer_id, before=None, limit=20):
+    """Fetches a page of a customer's sales, archived or not, newest first, using the (CustomerID, SaleDate) index.
+       before: (SaleDate, SaleID) of the last sale on the previous page, or None for the first page.
+       Returns (rows, next_before): rows is a list of dicts, next_before is None on the last page.
+       Returns ([], None) on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return [], None
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        tier_params = [customer_id]
+        keyset = ""
+        if before is not None:
+            keyset = " AND (s.SaleDate < %s OR (s.SaleDate = %s AND s.SaleID < %s))"
+            tier_params += [before[0], before[0], before[1]]
+        tier_params.append(limit + 1)
+        # Each tier is limited on its own, so neither reads more than one page of its index
+        sql = _across_archive(f"""(SELECT s.SaleID, s.SaleDate, s.TotalAmount, s.PaymentMethod,
+                                          (SELECT COUNT(*) FROM {{SaleDetails}} sd WHERE sd.SaleID = s.SaleID) AS ItemCount
+                                   FROM {{Sales}} s
+                                   WHERE s.CustomerID = %s{keyset}
+                                   ORDER BY s.SaleDate DESC, s.SaleID DESC
+                                   LIMIT %s)""")
+        cursor.execute(sql + " ORDER BY SaleDate DESC, SaleID DESC LIMIT %s", tier_params * 2 + [limit + 1])
+        rows = cursor.fetchall()
+        next_before = (rows[limit - 1]['SaleDate'], rows[limit - 1]['SaleID']) if len(rows) > limit else None
+        return rows[:limit], next_before
+    except Error as e:
+        logger.error("Error fetching purchase history for Customer ID %s", customer_id, exc_info=e)
+        return [], None
+    finally:
+        if cursor: cursor.close()
+
+def rebuild_customer_stats(conn):
+    """Recomputes every customer's aggregates from Sales and SaleDetails (both tiers), e.g. after importing
+       sales with plain SQL. Categories are taken from the products' current category.
+       Returns the number of customers with purchases, or None on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        cursor.execute("DELETE FROM CustomerCategoryStats")
+        cursor.execute("DELETE FROM CustomerStats")
+        sales = _across_archive("SELECT CustomerID, TotalAmount, SaleDate FROM {Sales} WHERE CustomerID IS NOT NULL")
+        cursor.execute(f"""INSERT INTO CustomerStats (CustomerID, LifetimeSpend, VisitCount, FirstPurchaseAt, LastPurchaseAt)
+                           SELECT s.CustomerID, SUM(s.TotalAmount), COUNT(*), MIN(s.SaleDate), MAX(s.SaleDate)
+                           FROM ({sales}) s
+                           JOIN Customers c ON c.CustomerID = s.CustomerID
+                           GROUP BY s.CustomerID""")
+        customers = cursor.rowcount
+        lines = _across_archive("""SELECT s.CustomerID, sd.ProductID, sd.Quantity, sd.TotalPrice
+                                   FROM {Sales} s JOIN {SaleDetails} sd ON sd.SaleID = s.SaleID
+                                   WHERE s.CustomerID IS NOT NULL""")
+        cursor.execute(f"""INSERT INTO CustomerCategoryStats (CustomerID, CategoryID, Quantity, Spend)
+                           SELECT l.CustomerID, p.CategoryID, SUM(l.Quantity), SUM(l.TotalPrice)
+                           FROM ({lines}) l
+                           JOIN Customers c ON c.CustomerID = l.CustomerID
+                           JOIN Products p ON p.ProductID = l.ProductID
+                           WHERE p.CategoryID IS NOT NULL
+                           GROUP BY l.CustomerID, p.CategoryID""")
+        conn.commit()
+        return customers
+    except Error as e:
+        logger.error("Error rebuilding customer stats", exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def ensure_customer_stats(conn):
+    """Builds the customer aggregates at startup if they are empty while customers have purchases
+       (e.g. on first run after upgrading). Returns True if they are in place."""
+    if not conn or not conn.is_connected(): return False
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        cursor.execute("""SELECT EXISTS(SELECT 1 FROM CustomerStats),
+                                 EXISTS(SELECT 1 FROM Sales WHERE CustomerID IS NOT NULL)
+                                 OR EXISTS(SELECT 1 FROM SalesArchive WHERE CustomerID IS NOT NULL)""")
+        has_stats, has_customer_sales = cursor.fetchone()
+        conn.commit()
+    except Error as e:
+        logger.error("Error checking customer stats", exc_info=e)
+        return False
+    finally:
+        if cursor: cursor.close()
+    if has_stats or not has_customer_sales:
+        return True
+    logger.info("Building customer purchase aggregates.")
+    return rebuild_customer_stats(conn) is not None
+
+# --- Stock Reservation Functions ---
+def reserve_stock(conn, cart_token, product_id, quantity, ttl_seconds=None):
+    """Sets the quantity of a product held by an open cart (0 releases it).
+       Returns {'success': bool, 'reserved_quantity': int, 'available': int, 'unit_price': price, 'message': str}.
+    """
+    result = {'success': False, 'reserved_quantity': 0, 'available': 0, 'unit_price': None, 'message': ''}
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        result['message'] = "Database connection not active."
+        return result
+    if not cart_token or quantity < 0:
+        result['message'] = "Invalid reservation request."
+        return result
+    ttl_seconds = ttl_seconds or STOCK_RESERVATION_TTL_SECONDS
 
     cursor = None
     original_autocommit_status = None
@@ -474,53 +1615,375 @@ def process_new_sale(conn, items_sold, customer_id=None, payment_method="Unknown
         original_autocommit_status = conn.autocommit
         conn.autocommit = False # Start transaction
 
-        total_sale_amount = 0
-        line_items_details = []
+        # Locking the product row serializes reservations for this product only
+        cursor.execute("SELECT ProductName, Price, StockQuantity FROM Products WHERE ProductID = %s FOR UPDATE", (product_id,))
+        product = cursor.fetchone()
+        if not product:
+            conn.rollback()
+            result['message'] = f"Product ID {product_id} not found."
+            return result
 
-        for item in items_sold:
-            product_id = item['product_id']
-            quantity_sold = item['quantity']
-            if quantity_sold <= 0:
-                raise ValueError(f"Invalid quantity ({quantity_sold}) for Product ID {product_id}.")
+        cursor.execute("""SELECT COALESCE(SUM(Quantity), 0) AS reserved
+                          FROM StockReservations
+                          WHERE ProductID = %s AND CartToken <> %s AND ExpiresAt > NOW()""",
+                       (product_id, cart_token))
+        reserved_by_others = int(cursor.fetchone()['reserved'])
+        available = product['StockQuantity'] - reserved_by_others
+        result['available'] = available
+        result['unit_price'] = product['Price']
 
-            cursor.execute("SELECT ProductName, Price, StockQuantity FROM Products WHERE ProductID = %s FOR UPDATE", (product_id,))
-            product = cursor.fetchone()
+        if quantity > available:
+            conn.rollback()
+            result['message'] = f"Only {max(available, 0)} unit(s) of '{product['ProductName']}' available."
+            return result
+
+        if quantity == 0:
+            cursor.execute("DELETE FROM StockReservations WHERE CartToken = %s AND ProductID = %s", (cart_token, product_id))
+        else:
+            cursor.execute("""INSERT INTO StockReservations (CartToken, ProductID, Quantity, UnitPrice, ExpiresAt)
+                              VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)
+                              ON DUPLICATE KEY UPDATE Quantity = VALUES(Quantity), UnitPrice = VALUES(UnitPrice),
+                                                      ExpiresAt = VALUES(ExpiresAt)""",
+                           (cart_token, product_id, quantity, product['Price'], ttl_seconds))
+        # Any activity on the cart keeps the rest of its reservations alive
+        cursor.execute("UPDATE StockReservations SET ExpiresAt = NOW() + INTERVAL %s SECOND WHERE CartToken = %s",
+                       (ttl_seconds, cart_token))
+        conn.commit()
+        result['success'] = True
+        result['reserved_quantity'] = quantity
+        return result
+    except Error as e:
+        logger.error("Error reserving Product ID %s for cart", product_id, exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        result['message'] = "A database error occurred while reserving stock."
+        return result
+    finally:
+        if conn is not None and conn.is_connected() and original_autocommit_status is not None:
+            conn.autocommit = original_autocommit_status
+        if cursor: cursor.close()
+
+def release_reservations(conn, cart_token, product_id=None):
+    """Releases a cart's reservations (all, or one product). Returns True on success, False otherwise."""
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return False
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        if product_id is None:
+            cursor.execute("DELETE FROM StockReservations WHERE CartToken = %s", (cart_token,))
+        else:
+            cursor.execute("DELETE FROM StockReservations WHERE CartToken = %s AND ProductID = %s", (cart_token, product_id))
+        conn.commit()
+        return True
+    except Error as e:
+        logger.error("Error releasing reservations", exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return False
+    finally:
+        if cursor: cursor.close()
+
+def fetch_cart_reservations(conn, cart_token):
+    """Fetches the active reservations of a cart. Returns a list of dicts or an empty list."""
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return []
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        sql = """SELECT r.ProductID, p.ProductName, r.Quantity, r.UnitPrice, r.ExpiresAt
+                 FROM StockReservations r
+                 JOIN Products p ON r.ProductID = p.ProductID
+                 WHERE r.CartToken = %s AND r.ExpiresAt > NOW()
+                 ORDER BY p.ProductName"""
+        cursor.execute(sql, (cart_token,))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching cart reservations", exc_info=e)
+        return []
+    finally:
+        if cursor: cursor.close()
+
+def purge_expired_reservations(conn):
+    """Deletes lapsed reservations. Returns the number of rows removed."""
+    if not conn or not conn.is_connected(): return 0
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM StockReservations WHERE ExpiresAt <= NOW()")
+        conn.commit()
+        return cursor.rowcount
+    except Error as e:
+        logger.error("Error purging expired reservations", exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return 0
+    finally:
+        if cursor: cursor.close()
+
+# --- Sales Processing Functions ---
+# Statements run for every sale line. They use the text protocol: connector 8.3 resets a prepared statement
+# (one more round trip) before every execute, which would add to checkout latency instead of saving it.
+# Locks the product row and sums other carts' live reservations in one round trip (the subquery takes no locks).
+_SALE_LOCK_PRODUCT_SQL = """SELECT p.ProductName, p.Price, p.StockQuantity,
+                                   (SELECT COALESCE(SUM(r.Quantity), 0) FROM StockReservations r
+                                    WHERE r.ProductID = p.ProductID AND r.CartToken <> %s AND r.ExpiresAt > NOW()) AS Reserved
+                            FROM Products p WHERE p.ProductID = %s FOR UPDATE"""
+_SALE_INSERT_DETAIL_SQL = "INSERT INTO SaleDetails (SaleID, ProductID, Quantity, UnitPrice, TotalPrice) VALUES (%s, %s, %s, %s, %s)"
+_SALE_UPDATE_STOCK_SQL = "UPDATE Products SET StockQuantity = StockQuantity - %s WHERE ProductID = %s AND StockQuantity >= %s"
+_SALE_UPDATE_LISTING_STOCK_SQL = "UPDATE ProductListing SET StockQuantity = StockQuantity - %s WHERE ProductID = %s"
+_SALE_LOG_INVENTORY_SQL = "INSERT INTO InventoryLogs (ProductID, ChangeType, QuantityChange, Notes, SaleID) VALUES (%s, %s, %s, %s, %s)"
+SALE_LOG_NOTES_PREFIX = 'Sale ID: ' # For display; the log is tied to its sale by InventoryLogs.SaleID
+
+def _lock_sale_product(cursor, product_id, cart_token):
+    cursor.execute(_SALE_LOCK_PRODUCT_SQL, (cart_token or '', product_id))
+    rows = cursor.fetchall()
+    return rows[0] if rows else None
+
+def find_sale_by_client_token(cursor, client_token):
+    """Gets the SaleID already recorded for a checkout attempt, hot or archived, or None."""
+    cursor.execute(_across_archive("(SELECT SaleID FROM {Sales} WHERE ClientToken = %s)"), (client_token, client_token))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    return rows[0]['SaleID'] if isinstance(rows[0], dict) else rows[0][0]
+
+def normalize_sale_items(items_sold):
+    """Returns the cart lines with integer product_id and quantity (form data may carry them as strings).
+       Raises ValueError for a line without them.
+    """
+    lines = []
+    for item in items_sold or []:
+        try:
+            lines.append(dict(item, product_id=int(item['product_id']), quantity=int(item['quantity'])))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("A cart line is missing its product or quantity.") from None
+    return lines
+
+def _execute_sale(conn, cursor, items_sold, customer_id, payment_method, cart_token, lock_product,
+                  client_token=None, sale_date=None):
+    """Records one sale inside the caller's transaction. Returns (sale_id, line_items_details).
+       lock_product(product_id, cart_token) returns the locked product as a dict with ProductName, Price,
+       StockQuantity and Reserved (live reservations of other carts), or None if it does not exist.
+       client_token: idempotency key of the checkout attempt, stored with the sale. A commit whose
+       acknowledgement was lost may still have been applied, so a retry with the same key returns the
+       recorded SaleID (and no lines) instead of recording the sale twice.
+       sale_date: when the sale was made, if not now (e.g. a replayed offline sale).
+       Raises ValueError for business rule failures and Error for database failures.
+    """
+    if not items_sold:
+        raise ValueError("No items provided for sale.")
+    items_sold = normalize_sale_items(items_sold)
+    if client_token:
+        existing_sale_id = find_sale_by_client_token(cursor, client_token)
+        if existing_sale_id:
+            logger.info("Sale ID: %s was already recorded for this checkout.", existing_sale_id,
+                        extra={'event': 'sale.duplicate', 'fields': {'sale_id': existing_sale_id}})
+            return existing_sale_id, []
+    reservations = {}
+    if cart_token:
+        cursor.execute("""SELECT ProductID, Quantity, UnitPrice FROM StockReservations
+                          WHERE CartToken = %s AND ExpiresAt > NOW() FOR UPDATE""", (cart_token,))
+        reservations = {row['ProductID']: row for row in cursor.fetchall()}
+
+    total_sale_amount = 0
+    line_items_details = []
+
+    for item in items_sold:
+        product_id = item['product_id']
+        quantity_sold = item['quantity']
+        if quantity_sold <= 0:
+            raise ValueError(f"Invalid quantity ({quantity_sold}) for Product ID {product_id}.")
+
+        reservation = reservations.get(product_id)
+        if reservation and reservation['Quantity'] >= quantity_sold:
+            # Stock was already set aside when the item was added to the cart
+            unit_price_at_sale = reservation['UnitPrice']
+        else:
+            product = lock_product(product_id, cart_token)
 
             if not product:
                 raise ValueError(f"Product ID {product_id} not found.")
-            if product['StockQuantity'] < quantity_sold:
-                raise ValueError(f"Insufficient stock for Product '{product['ProductName']}' (ID {product_id}). Available: {product['StockQuantity']}, Requested: {quantity_sold}")
-
-            unit_price_at_sale = item.get('unit_price', product['Price'])
-            line_total = unit_price_at_sale * quantity_sold
-            total_sale_amount += line_total
-            
-            line_items_details.append({
-                'product_id': product_id, 'quantity': quantity_sold,
-                'unit_price': unit_price_at_sale, 'total_price': line_total
-            })
-
-        sql_insert_sale = "INSERT INTO Sales (CustomerID, SaleDate, TotalAmount, PaymentMethod) VALUES (%s, NOW(), %s, %s)"
-        cursor.execute(sql_insert_sale, (customer_id, total_sale_amount, payment_method))
-        sale_id = cursor.lastrowid
-        if not sale_id: raise Exception("Failed to create sale record in Sales table.")
-
-        sql_insert_saledetail = "INSERT INTO SaleDetails (SaleID, ProductID, Quantity, UnitPrice, TotalPrice) VALUES (%s, %s, %s, %s, %s)"
-        sql_update_stock = "UPDATE Products SET StockQuantity = StockQuantity - %s WHERE ProductID = %s"
-        sql_log_inventory = "INSERT INTO InventoryLogs (ProductID, ChangeType, QuantityChange, Notes) VALUES (%s, %s, %s, %s)"
-
-        for detail in line_items_details:
-            cursor.execute(sql_insert_saledetail, (sale_id, detail['product_id'], detail['quantity'], detail['unit_price'], detail['total_price']))
-            cursor.execute(sql_update_stock, (detail['quantity'], detail['product_id']))
-            log_notes = f"Sale ID: {sale_id}"
-            cursor.execute(sql_log_inventory, (detail['product_id'], 'Sale', -detail['quantity'], log_notes))
+            available = product['StockQuantity'] - int(product['Reserved'])
+            if available < quantity_sold:
+                raise ValueError(f"Insufficient stock for Product '{product['ProductName']}' (ID {product_id}). Available: {available}, Requested: {quantity_sold}")
+            unit_price_at_sale = product['Price'] # Any price sent with the item is only what the till displayed
 
+        line_total = unit_price_at_sale * quantity_sold
+        total_sale_amount += line_total
+        
+        line_items_details.append({
+            'product_id': product_id, 'quantity': quantity_sold,
+            'unit_price': unit_price_at_sale, 'total_price': line_total
+        })
+
+    sql_insert_sale = """INSERT INTO Sales (CustomerID, SaleDate, TotalAmount, PaymentMethod, ClientToken)
+                         VALUES (%s, COALESCE(%s, NOW()), %s, %s, %s)"""
+    cursor.execute(sql_insert_sale, (customer_id, sale_date, total_sale_amount, payment_method, client_token or None))
+    sale_id = cursor.lastrowid
+    if not sale_id: raise Exception("Failed to create sale record in Sales table.")
+
+    for detail in line_items_details:
+        cursor.execute(_SALE_INSERT_DETAIL_SQL, (sale_id, detail['product_id'], detail['quantity'], detail['unit_price'], detail['total_price']))
+        cursor.execute(_SALE_UPDATE_STOCK_SQL, (detail['quantity'], detail['product_id'], detail['quantity']))
+        if cursor.rowcount == 0:
+            raise ValueError(f"Insufficient stock for Product ID {detail['product_id']} at checkout.")
+        cursor.execute(_SALE_UPDATE_LISTING_STOCK_SQL, (detail['quantity'], detail['product_id']))
+        log_notes = f"{SALE_LOG_NOTES_PREFIX}{sale_id}"
+        cursor.execute(_SALE_LOG_INVENTORY_SQL, (detail['product_id'], 'Sale', -detail['quantity'], log_notes, sale_id))
+        record_change(cursor, ENTITY_PRODUCT, detail['product_id'], 'stock')
+    record_change(cursor, ENTITY_SALE, sale_id, 'insert')
+    if customer_id:
+        record_customer_purchase(cursor, customer_id, total_sale_amount, line_items_details, sale_date)
+
+    if cart_token:
+        cursor.execute("DELETE FROM StockReservations WHERE CartToken = %s", (cart_token,))
+    return sale_id, line_items_details
+
+def process_new_sale(conn, items_sold, customer_id=None, payment_method="Unknown", cart_token=None, errors=None,
+                     client_token=None, sale_date=None):
+    """Processes a new sale. Returns SaleID on success, None otherwise.
+       items_sold: [{'product_id': int, 'quantity': int}, ...]; lines are charged the product's current price
+       cart_token: when given, items covered by that cart's reservations are converted
+       directly into the sale (reserved price, no stock re-check) and the reservations are cleared.
+       client_token: idempotency key; retrying with it after an unacknowledged commit returns the
+       SaleID already recorded. sale_date: when the sale was made, if not now.
+       errors: optional list; the exception that caused a failure is appended to it
+       (ValueError for business rule failures such as insufficient stock, Error for database failures).
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        if errors is not None: errors.append(InterfaceError("Connection not active."))
+        return None
+    if not items_sold:
+        logger.warning("No items provided for sale.")
+        if errors is not None: errors.append(ValueError("No items provided for sale."))
+        return None
+
+    cursor = None
+    original_autocommit_status = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        original_autocommit_status = conn.autocommit
+        conn.autocommit = False # Start transaction
+
+        sale_id, line_items_details = _execute_sale(
+            conn, cursor, items_sold, customer_id, payment_method, cart_token,
+            lambda product_id, token: _lock_sale_product(cursor, product_id, token),
+            client_token=client_token, sale_date=sale_date)
 
         conn.commit()
-        print(f"Sale ID: {sale_id} processed successfully.")
+        logger.info("Sale ID: %s processed successfully.", sale_id,
+                    extra={'event': 'sale.processed', 'fields': {'sale_id': sale_id, 'lines': len(line_items_details)}})
+        bump_data_versions(conn, ENTITY_PRODUCT, ENTITY_SALE)
         return sale_id
     except (Error, ValueError, Exception) as e:
-        print(f"Error processing sale: {e}")
+        if isinstance(e, ValueError): # Business rule failures such as insufficient stock
+            logger.warning("Sale rejected", exc_info=e)
+        else:
+            logger.error("Error processing sale", exc_info=e)
+        if errors is not None: errors.append(e)
+        if conn.is_connected(): conn.rollback()
+        return None
+    finally:
+        if conn is not None and conn.is_connected() and original_autocommit_status is not None:
+            conn.autocommit = original_autocommit_status
+        if cursor: cursor.close()
+
+def _lock_batch_products(cursor, product_ids):
+    """Locks every product of a sale batch with one statement, in ProductID order so concurrent batches
+       cannot deadlock, and loads live reservations per cart. Returns {ProductID: product dict}.
+    """
+    if not product_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    cursor.execute(f"""SELECT ProductID, ProductName, Price, StockQuantity FROM Products
+                       WHERE ProductID IN ({placeholders}) ORDER BY ProductID FOR UPDATE""", product_ids)
+    products = {row['ProductID']: dict(row, Reservations={}) for row in cursor.fetchall()}
+    cursor.execute(f"""SELECT ProductID, CartToken, SUM(Quantity) AS Quantity FROM StockReservations
+                       WHERE ProductID IN ({placeholders}) AND ExpiresAt > NOW()
+                       GROUP BY ProductID, CartToken""", product_ids)
+    for row in cursor.fetchall():
+        if row['ProductID'] in products:
+            products[row['ProductID']]['Reservations'][row['CartToken']] = int(row['Quantity'])
+    return products
+
+def process_sale_batch(conn, sales):
+    """Processes several sales in one transaction with a single commit (group commit).
+       sales: [{'items_sold': [...], 'customer_id': ..., 'payment_method': ..., 'cart_token': ..., 'client_token': ...}, ...]
+       All products involved are locked up front in one pass and validated in memory; each sale runs
+       under its own savepoint, so one failing a business rule is rolled back without affecting the others.
+       Returns one (sale_id, error) pair per sale (sale_id is None when error is set), or None if the
+       transaction as a whole failed. If the commit itself failed it may still have been applied, so
+       sales should carry a client_token: retrying them one by one then returns the recorded SaleIDs.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    if not sales:
+        return []
+
+    cursor = None
+    original_autocommit_status = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        original_autocommit_status = conn.autocommit
+        conn.autocommit = False # Start transaction
+
+        product_ids = set()
+        for sale in sales:
+            try:
+                product_ids.update(item['product_id'] for item in normalize_sale_items(sale.get('items_sold')))
+            except ValueError:
+                pass # _execute_sale rejects that sale under its savepoint
+        product_ids = sorted(product_ids)
+        products = _lock_batch_products(cursor, product_ids)
+
+        def lock_product(product_id, cart_token):
+            product = products.get(product_id)
+            if product is None:
+                return None
+            reserved = sum(quantity for token, quantity in product['Reservations'].items() if token != (cart_token or ''))
+            return dict(product, Reserved=reserved)
+
+        results = []
+        for index, sale in enumerate(sales):
+            cart_token = sale.get('cart_token')
+            cursor.execute(f"SAVEPOINT sale_{index}")
+            try:
+                sale_id, line_items_details = _execute_sale(
+                    conn, cursor, sale.get('items_sold'), sale.get('customer_id'),
+                    sale.get('payment_method', "Unknown"), cart_token, lock_product,
+                    client_token=sale.get('client_token'), sale_date=sale.get('sale_date'))
+            except Error:
+                raise # Deadlocks and lost connections end the whole transaction, not just the savepoint
+            except Exception as e:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT sale_{index}")
+                results.append((None, e))
+                continue
+            cursor.execute(f"RELEASE SAVEPOINT sale_{index}")
+            # Later sales in the batch are validated against stock as it is after this one
+            for detail in line_items_details:
+                products[detail['product_id']]['StockQuantity'] -= detail['quantity']
+            if cart_token:
+                for product in products.values():
+                    product['Reservations'].pop(cart_token, None)
+            results.append((sale_id, None))
+
+        conn.commit()
+        for (sale_id, error), sale in zip(results, sales):
+            if error is None:
+                logger.info("Sale ID: %s processed successfully.", sale_id,
+                            extra={'event': 'sale.processed',
+                                   'fields': {'sale_id': sale_id, 'lines': len(sale['items_sold']), 'batch_size': len(sales)}})
+            elif isinstance(error, ValueError):
+                logger.warning("Sale rejected", exc_info=error)
+            else:
+                logger.error("Error processing sale", exc_info=error)
+        if any(sale_id for sale_id, _ in results):
+            bump_data_versions(conn, ENTITY_PRODUCT, ENTITY_SALE)
+        return results
+    except Exception as e:
+        logger.error("Error processing batch of %s sales", len(sales), exc_info=e)
         if conn.is_connected(): conn.rollback()
         return None
     finally:
@@ -528,88 +1991,468 @@ def process_new_sale(conn, items_sold, customer_id=None, payment_method="Unknown
             conn.autocommit = original_autocommit_status
         if cursor: cursor.close()
 
+# --- Streaming Query Helpers ---
+class StreamedRows:
+    """Iterates a query's rows from an unbuffered (server-side) cursor, one batch at a time.
+
+    The query runs on first use, so a consumer that never iterates (e.g. a fragment cache hit)
+    costs nothing. Truthiness peeks at the first row, which lets templates keep "{% if rows %}".
+    The connection must not run other statements until iteration finishes. extra_statements are
+    further (sql, params) pairs whose rows follow, each run once the previous one is exhausted.
+    """
+
+    def __init__(self, conn, sql, params=(), batch_size=None, label='query', extra_statements=()):
+        self.conn = conn
+        self.statements = [(sql, params)] + list(extra_statements)
+        self.batch_size = batch_size or STREAM_BATCH_SIZE
+        self.label = label
+        self._rows = None
+        self._peeked = []
+
+    def _generate(self):
+        if not self.conn or not self.conn.is_connected():
+            logger.error("Connection not active.")
+            return
+        cursor = None
+        exhausted = False
+        try:
+            for sql, params in self.statements:
+                if cursor: cursor.close()
+                exhausted = False
+                cursor = self.conn.cursor(dictionary=True)
+                cursor.execute(sql, params)
+                while True:
+                    batch = cursor.fetchmany(self.batch_size)
+                    if not batch:
+                        exhausted = True
+                        break
+                    yield from batch
+        except Error as e:
+            logger.error("Error streaming %s", self.label, exc_info=e)
+        finally:
+            if cursor:
+                try:
+                    if not exhausted and self.conn.is_connected():
+                        self.conn.consume_results() # Discard rows the consumer did not read
+                    cursor.close()
+                except Error as e:
+                    logger.error("Error closing streamed cursor (%s)", self.label, exc_info=e)
+
+    def _ensure_started(self):
+        if self._rows is None:
+            self._rows = self._generate()
+
+    def __bool__(self):
+        self._ensure_started()
+        if not self._peeked:
+            self._peeked = [row for row in [next(self._rows, None)] if row is not None]
+        return bool(self._peeked)
+
+    def __iter__(self):
+        self._ensure_started()
+        while self._peeked:
+            yield self._peeked.pop(0)
+        yield from self._rows
+
+    def close(self):
+        if self._rows is not None:
+            self._rows.close()
+
+# --- Archival Functions ---
+# Sales (with their SaleDetails) and InventoryLogs rows from closed periods live in *Archive tables of the
+# same shape. Reporting functions read both tiers; new rows are only ever written to the hot tables.
+# Archived SaleIDs must never be reissued, which relies on MySQL 8 persisting AUTO_INCREMENT counters.
+ARCHIVE_TABLES = {'Sales': 'SalesArchive', 'SaleDetails': 'SaleDetailsArchive', 'InventoryLogs': 'InventoryLogsArchive'}
+_primary_key_columns = {}
+
+def _across_archive(sql):
+    """Returns sql UNION ALL the same query on the archive tables. Table names in sql are written as
+       {Sales}, {SaleDetails} and {InventoryLogs}; query parameters must be passed twice.
+    """
+    hot = sql.format(**{table: table for table in ARCHIVE_TABLES})
+    return f"{hot}\nUNION ALL\n{sql.format(**ARCHIVE_TABLES)}"
+
+def get_primary_key_column(conn, table_name):
+    """Finds the (single-column) primary key of a table. Returns its name or None."""
+    if table_name in _primary_key_columns:
+        return _primary_key_columns[table_name]
+    if not conn or not conn.is_connected():
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        cursor.execute("""SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE
+                          WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY'
+                          ORDER BY ORDINAL_POSITION""", (table_name,))
+        rows = cursor.fetchall()
+        _primary_key_columns[table_name] = rows[0][0] if len(rows) == 1 else None
+        return _primary_key_columns[table_name]
+    except Error as e:
+        logger.error("Error inspecting the primary key of %s", table_name, exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def archive_sales_batch(conn, cutoff, batch_size):
+    """Moves up to batch_size of the oldest sales dated before cutoff, with their SaleDetails, into the
+       archive tables in one transaction. Rows locked by a concurrent archiver are skipped.
+       Returns (sales_moved, lines_moved), or None on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        # Sales are mostly inserted with NOW(), so if the oldest sale is inside the retention window nothing is due yet
+        cursor.execute("SELECT SaleDate < %s FROM Sales ORDER BY SaleID LIMIT 1", (cutoff,))
+        oldest = cursor.fetchone()
+        if not oldest or not oldest[0]:
+            conn.commit()
+            return (0, 0)
+        cursor.execute("""SELECT SaleID FROM Sales WHERE SaleDate < %s
+                          ORDER BY SaleID LIMIT %s FOR UPDATE SKIP LOCKED""", (cutoff, batch_size))
+        sale_ids = tuple(row[0] for row in cursor.fetchall())
+        if not sale_ids:
+            conn.commit()
+            return (0, 0)
+        placeholders = ', '.join(['%s'] * len(sale_ids))
+        # Keeps delete_product from removing a product while its lines are between SaleDetails and the archive
+        cursor.execute(f"""SELECT ProductID FROM Products WHERE ProductID IN (
+                               SELECT ProductID FROM SaleDetails WHERE SaleID IN ({placeholders}))
+                           ORDER BY ProductID FOR SHARE""", sale_ids)
+        cursor.execute(f"INSERT INTO SaleDetailsArchive SELECT * FROM SaleDetails WHERE SaleID IN ({placeholders})", sale_ids)
+        lines_moved = cursor.rowcount
+        cursor.execute(f"INSERT INTO SalesArchive SELECT * FROM Sales WHERE SaleID IN ({placeholders})", sale_ids)
+        cursor.execute(f"DELETE FROM SaleDetails WHERE SaleID IN ({placeholders})", sale_ids)
+        cursor.execute(f"DELETE FROM Sales WHERE SaleID IN ({placeholders})", sale_ids)
+        conn.commit()
+        return (len(sale_ids), lines_moved)
+    except Error as e:
+        logger.error("Error archiving sales before %s", cutoff, exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def archive_inventory_logs_batch(conn, cutoff, batch_size):
+    """Moves up to batch_size of the oldest InventoryLogs rows dated before cutoff into InventoryLogsArchive.
+       Returns the number of rows moved (0 if the table has no single-column key), or None on error
+       (including a missing INVENTORY_LOG_DATE_COLUMN).
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    date_column = get_inventory_log_date_column(conn)
+    if date_column is None:
+        return None
+    key_column = get_primary_key_column(conn, 'InventoryLogs')
+    if key_column is None:
+        return 0
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        cursor.execute(f"SELECT `{date_column}` < %s FROM InventoryLogs ORDER BY `{key_column}` LIMIT 1", (cutoff,))
+        oldest = cursor.fetchone()
+        if not oldest or not oldest[0]:
+            conn.commit()
+            return 0
+        cursor.execute(f"""SELECT `{key_column}` FROM InventoryLogs WHERE `{date_column}` < %s
+                           ORDER BY `{key_column}` LIMIT %s FOR UPDATE SKIP LOCKED""", (cutoff, batch_size))
+        log_ids = tuple(row[0] for row in cursor.fetchall())
+        if not log_ids:
+            conn.commit()
+            return 0
+        placeholders = ', '.join(['%s'] * len(log_ids))
+        cursor.execute(f"INSERT INTO InventoryLogsArchive SELECT * FROM InventoryLogs WHERE `{key_column}` IN ({placeholders})", log_ids)
+        cursor.execute(f"DELETE FROM InventoryLogs WHERE `{key_column}` IN ({placeholders})", log_ids)
+        conn.commit()
+        return len(log_ids)
+    except Error as e:
+        logger.error("Error archiving inventory logs before %s", cutoff, exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def get_archive_table_sizes(conn):
+    """Approximate rows and bytes (data + indexes) of the hot and archive tables, from information_schema.
+       Returns a dict {TableName: {'rows': int, 'bytes': int}} or an empty dict.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return {}
+    tables = list(ARCHIVE_TABLES) + list(ARCHIVE_TABLES.values())
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        placeholders = ', '.join(['%s'] * len(tables))
+        cursor.execute(f"""SELECT TABLE_NAME, TABLE_ROWS, DATA_LENGTH + INDEX_LENGTH
+                           FROM information_schema.TABLES
+                           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({placeholders})""", tuple(tables))
+        return {name: {'rows': int(rows or 0), 'bytes': int(size or 0)} for name, rows, size in cursor.fetchall()}
+    except Error as e:
+        logger.error("Error reading archive table sizes", exc_info=e)
+        return {}
+    finally:
+        if cursor: cursor.close()
+
 # --- Sales Reporting Functions ---
+# Sale headers with customer names; {Sales} is the hot or archive table (see _across_archive)
+_SALE_HEADER_SQL = """SELECT s.SaleID, s.SaleDate, s.TotalAmount, s.PaymentMethod, s.CustomerID,
+                             c.FirstName AS CustomerFirstName, c.LastName AS CustomerLastName, c.Email AS CustomerEmail
+                      FROM {Sales} s
+                      LEFT JOIN Customers c ON s.CustomerID = c.CustomerID"""
+
 def fetch_sales_history(conn):
-    """Fetches sales history. Returns a list of dicts or an empty list."""
+    """Fetches sales history, including archived sales. Returns a list of dicts or an empty list."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (fetch_sales_history).")
+        logger.error("Connection not active.")
         return []
     cursor = None
     try:
         cursor = conn.cursor(dictionary=True, buffered=True)
-        sql = """SELECT s.SaleID, s.SaleDate, s.TotalAmount, s.PaymentMethod, s.CustomerID,
-                        c.FirstName AS CustomerFirstName, c.LastName AS CustomerLastName, c.Email AS CustomerEmail
-                 FROM Sales s
-                 LEFT JOIN Customers c ON s.CustomerID = c.CustomerID
-                 ORDER BY s.SaleDate DESC"""
+        sql = _across_archive(_SALE_HEADER_SQL) + " ORDER BY SaleDate DESC"
         cursor.execute(sql)
         return cursor.fetchall()
     except Error as e:
-        print(f"DB_Error fetching sales history: {e}")
+        logger.error("Error fetching sales history", exc_info=e)
         return []
     finally:
         if cursor: cursor.close()
 
+def iter_sales_history(conn, batch_size=None):
+    """Streams sales history (same rows as fetch_sales_history) without materializing it. Returns a StreamedRows.
+       Archived sales are all older than the hot ones, so they are streamed after them and never read
+       unless the consumer gets that far.
+    """
+    sql = _SALE_HEADER_SQL + " ORDER BY s.SaleDate DESC"
+    return StreamedRows(conn, sql.format(Sales='Sales'), batch_size=batch_size, label='sales history',
+                        extra_statements=[(sql.format(Sales=ARCHIVE_TABLES['Sales']), ())])
+
 def fetch_sale_items(conn, sale_id):
-    """Fetches items for a specific sale. Returns a list of dicts or an empty list."""
+    """Fetches items for a specific sale, archived or not. Returns a list of dicts or an empty list."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (fetch_sale_items).")
+        logger.error("Connection not active.")
         return []
     cursor = None
     try:
         cursor = conn.cursor(dictionary=True, buffered=True)
-        sql = """SELECT sd.ProductID, p.ProductName, sd.Quantity, sd.UnitPrice, sd.TotalPrice
-                 FROM SaleDetails sd
-                 JOIN Products p ON sd.ProductID = p.ProductID
-                 WHERE sd.SaleID = %s
-                 ORDER BY p.ProductName"""
-        cursor.execute(sql, (sale_id,))
+        sql = _across_archive("""SELECT sd.ProductID, p.ProductName, sd.Quantity, sd.UnitPrice, sd.TotalPrice
+                                 FROM {SaleDetails} sd
+                                 JOIN Products p ON sd.ProductID = p.ProductID
+                                 WHERE sd.SaleID = %s""") + " ORDER BY ProductName"
+        cursor.execute(sql, (sale_id, sale_id))
         return cursor.fetchall()
     except Error as e:
-        print(f"DB_Error fetching sale items for SaleID {sale_id}: {e}")
+        logger.error("Error fetching sale items for SaleID %s", sale_id, exc_info=e)
         return []
     finally:
         if cursor: cursor.close()
 
+_SALE_BY_ID_SQL = _across_archive(_SALE_HEADER_SQL + " WHERE s.SaleID = %s") + " LIMIT 1"
+
 def get_sale_by_id(conn, sale_id):
-    """Fetches a single sale by ID, including customer name. Returns a dict or None."""
+    """Fetches a single sale by ID, archived or not, including customer name. Returns a dict or None."""
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    try:
+        return statement_cache.fetch_one(conn, _SALE_BY_ID_SQL, (sale_id, sale_id), dictionary=True)
+    except Error as e:
+        logger.error("Error fetching sale by ID %s", sale_id, exc_info=e)
+        return None
+
+# --- Sales Analytics Functions ---
+# Sale lines are plain tuples (SaleID, ProductID, Quantity, TotalPrice, SaleDay) for bulk loading into arrays;
+# SaleDay counts days since 1970-01-01 in the database's local date. Archived sales are included.
+_SALE_LINE_COLUMNS = """sd.SaleID, sd.ProductID, sd.Quantity, sd.TotalPrice,
+                        DATEDIFF(s.SaleDate, '1970-01-01') AS SaleDay"""
+
+def fetch_sale_ids_after(conn, after_sale_id, limit=5000):
+    """Fetches the next committed SaleIDs above after_sale_id in ascending order. Returns a list of ints, or None on error."""
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (get_sale_by_id).")
+        logger.error("Connection not active.")
         return None
     cursor = None
     try:
-        cursor = conn.cursor(dictionary=True, buffered=True)
-        sql = """SELECT s.SaleID, s.SaleDate, s.TotalAmount, s.PaymentMethod, s.CustomerID,
-                        c.FirstName AS CustomerFirstName, c.LastName AS CustomerLastName, c.Email AS CustomerEmail
-                 FROM Sales s
-                 LEFT JOIN Customers c ON s.CustomerID = c.CustomerID
-                 WHERE s.SaleID = %s"""
-        cursor.execute(sql, (sale_id,))
-        return cursor.fetchone()
+        cursor = conn.cursor(buffered=True)
+        # Each tier is limited on its own so neither materializes more than limit IDs
+        sql = _across_archive("(SELECT SaleID FROM {Sales} WHERE SaleID > %s ORDER BY SaleID LIMIT %s)")
+        cursor.execute(sql + " ORDER BY SaleID LIMIT %s", (after_sale_id, limit, after_sale_id, limit, limit))
+        return [row[0] for row in cursor.fetchall()]
+    except Error as e:
+        logger.error("Error fetching sale IDs after %s", after_sale_id, exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def fetch_sale_lines_in_range(conn, after_sale_id, through_sale_id):
+    """Fetches sale lines with after_sale_id < SaleID <= through_sale_id. Returns a list of tuples, or None on error."""
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        sql = _across_archive(f"""SELECT {_SALE_LINE_COLUMNS}
+                                  FROM {{SaleDetails}} sd
+                                  JOIN {{Sales}} s ON s.SaleID = sd.SaleID
+                                  WHERE sd.SaleID > %s AND sd.SaleID <= %s""")
+        cursor.execute(sql, (after_sale_id, through_sale_id) * 2)
+        return cursor.fetchall()
     except Error as e:
-        print(f"DB_Error fetching sale by ID {sale_id}: {e}")
+        logger.error("Error fetching sale lines for SaleIDs %s-%s", after_sale_id, through_sale_id, exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def fetch_sale_lines_for_sales(conn, sale_ids):
+    """Fetches sale lines for specific SaleIDs. Returns a list of tuples, or None on error."""
+    if not sale_ids:
+        return []
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        placeholders = ', '.join(['%s'] * len(sale_ids))
+        sql = _across_archive(f"""SELECT {_SALE_LINE_COLUMNS}
+                                  FROM {{SaleDetails}} sd
+                                  JOIN {{Sales}} s ON s.SaleID = sd.SaleID
+                                  WHERE sd.SaleID IN ({placeholders})""")
+        cursor.execute(sql, tuple(sale_ids) * 2)
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching sale lines for specific sales", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def fetch_product_names(conn, product_ids):
+    """Fetches names for the given ProductIDs. Returns a dict {ProductID: ProductName} (empty on error)."""
+    if not product_ids:
+        return {}
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return {}
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        cursor.execute(f"SELECT ProductID, ProductName FROM Products WHERE ProductID IN ({placeholders})",
+                       tuple(product_ids))
+        return dict(cursor.fetchall())
+    except Error as e:
+        logger.error("Error fetching product names", exc_info=e)
+        return {}
+    finally:
+        if cursor: cursor.close()
+
+# --- Reorder Planning Functions ---
+_inventory_log_date_column = None
+
+def get_inventory_log_date_column(conn):
+    """Checks that INVENTORY_LOG_DATE_COLUMN is a date/time column of InventoryLogs. Returns its name,
+       or None (with an error naming the setting) if it is missing or not a date.
+    """
+    global _inventory_log_date_column
+    if _inventory_log_date_column is not None:
+        return _inventory_log_date_column
+    if not conn or not conn.is_connected():
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        cursor.execute("""SELECT DATA_TYPE FROM information_schema.COLUMNS
+                          WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'InventoryLogs' AND COLUMN_NAME = %s""",
+                       (INVENTORY_LOG_DATE_COLUMN,))
+        row = cursor.fetchone()
+        if row is None or row[0] not in ('datetime', 'timestamp', 'date'):
+            logger.error("InventoryLogs has no date/time column '%s'. Set INVENTORY_LOG_DATE_COLUMN to the column "
+                         "holding when each log entry was written.", INVENTORY_LOG_DATE_COLUMN)
+            return None
+        _inventory_log_date_column = INVENTORY_LOG_DATE_COLUMN
+        return _inventory_log_date_column
+    except Error as e:
+        logger.error("Error inspecting InventoryLogs columns", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def fetch_inventory_outflows(conn, since_date):
+    """Fetches daily stock removed other than by sales (spoilage, adjustments) since since_date.
+       Returns a list of (ProductID, Day, Quantity) tuples, Day counted from 1970-01-01, or None on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    date_column = get_inventory_log_date_column(conn)
+    if date_column is None:
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        # Only the hot table: forecasting lookbacks are far shorter than the archival retention window
+        sql = f"""SELECT ProductID, DATEDIFF(`{date_column}`, '1970-01-01') AS Day, -SUM(QuantityChange)
+                  FROM InventoryLogs
+                  WHERE ChangeType <> 'Sale' AND QuantityChange < 0 AND `{date_column}` >= %s
+                  GROUP BY ProductID, Day"""
+        cursor.execute(sql, (since_date,))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching inventory outflows", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def fetch_stock_levels(conn, product_ids=None):
+    """Fetches stock and naming data for all products, or only product_ids.
+       Returns a list of (ProductID, ProductName, CategoryName, Price, StockQuantity) tuples, or None on error.
+    """
+    if product_ids is not None and not product_ids:
+        return []
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        sql = "SELECT ProductID, ProductName, CategoryName, Price, StockQuantity FROM ProductListing"
+        params = ()
+        if product_ids is not None:
+            sql += f" WHERE ProductID IN ({', '.join(['%s'] * len(product_ids))})"
+            params = tuple(product_ids)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching stock levels", exc_info=e)
         return None
     finally:
         if cursor: cursor.close()
 
 # --- Inventory/Dashboard Functions ---
-def fetch_low_stock_products(conn, threshold=10):
-    """Fetches products below a stock threshold. Returns a list of dicts or an empty list."""
+def fetch_low_stock_products(conn, threshold=10, errors=None):
+    """Fetches products below a stock threshold. Returns a list of dicts or an empty list.
+       errors: optional list; a database error that emptied the result is appended to it.
+    """
     if not conn or not conn.is_connected():
-        print("DB_Error: Connection not active (fetch_low_stock_products).")
+        logger.error("Connection not active.")
+        if errors is not None: errors.append(InterfaceError("Connection not active."))
         return []
     cursor = None
     try:
         cursor = conn.cursor(dictionary=True, buffered=True)
-        sql = """SELECT p.ProductID, p.ProductName, p.StockQuantity, p.Price, c.CategoryName
-                 FROM Products p
-                 LEFT JOIN Categories c ON p.CategoryID = c.CategoryID
-                 WHERE p.StockQuantity < %s
-                 ORDER BY p.StockQuantity ASC, p.ProductName ASC"""
+        sql = """SELECT ProductID, ProductName, StockQuantity, Price, CategoryName
+                 FROM ProductListing
+                 WHERE StockQuantity < %s
+                 ORDER BY StockQuantity ASC, SortName ASC"""
         cursor.execute(sql, (threshold,))
         return cursor.fetchall()
     except Error as e:
-        print(f"DB_Error fetching low stock products: {e}")
+        logger.error("Error fetching low stock products", exc_info=e)
+        if errors is not None: errors.append(e)
         return []
     finally:
         if cursor: cursor.close()
@@ -624,7 +2467,7 @@ def get_total_products_count(conn):
         count = cursor.fetchone()
         return count[0] if count else 0
     except Error as e:
-        print(f"DB_Error getting total products count: {e}")
+        logger.error("Error getting total products count", exc_info=e)
         return 0
     finally:
         if cursor: cursor.close()
@@ -639,7 +2482,7 @@ def get_total_categories_count(conn):
         count = cursor.fetchone()
         return count[0] if count else 0
     except Error as e:
-        print(f"DB_Error getting total categories count: {e}")
+        logger.error("Error getting total categories count", exc_info=e)
         return 0
     finally:
         if cursor: cursor.close()
@@ -654,7 +2497,7 @@ def get_total_customers_count(conn):
         count = cursor.fetchone()
         return count[0] if count else 0
     except Error as e:
-        print(f"DB_Error getting total customers count: {e}")
+        logger.error("Error getting total customers count", exc_info=e)
         return 0
     finally:
         if cursor: cursor.close()
@@ -670,11 +2513,287 @@ def get_low_stock_items_count(conn, threshold=10):
         count = cursor.fetchone()
         return count[0] if count else 0
     except Error as e:
-        print(f"DB_Error getting low stock items count: {e}")
+        logger.error("Error getting low stock items count", exc_info=e)
         return 0
     finally:
         if cursor: cursor.close()
 
+# --- Reconciliation Functions ---
+# Integrity checks over primary-key ranges of the sales and inventory log history, both tiers included.
+# Each range is read in one consistent-snapshot, read-only transaction, so a sale being archived or
+# written concurrently is seen either completely or not at all. Used by reconcile.py.
+RECONCILE_AMOUNT_TOLERANCE = 0.005
+
+def get_reconciliation_bounds(conn, settle_seconds):
+    """Gets the ID ranges to reconcile: every sale recorded more than settle_seconds ago and every inventory log
+       written so far. Sales recorded since may still have uncommitted lines or logs, so they are left for the next
+       run. Age is taken from RecordedAt, not SaleDate, which replayed offline sales backdate.
+       Returns {'min_sale_id', 'max_sale_id', 'min_log_id', 'max_log_id', 'log_key_column'} (IDs may be None
+       for empty tables), or None on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    log_key_column = get_primary_key_column(conn, 'InventoryLogs')
+    if log_key_column is None:
+        logger.error("InventoryLogs has no single-column primary key; cannot split it into ranges.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=True)
+        # The newest settled sale is found by walking the primary key back from the end, which only touches recent rows
+        cursor.execute("""SELECT SaleID FROM Sales WHERE RecordedAt < NOW() - INTERVAL %s SECOND
+                          ORDER BY SaleID DESC LIMIT 1""", (int(settle_seconds),))
+        row = cursor.fetchone()
+        hot_max = row[0] if row else None
+        cursor.execute("SELECT MIN(SaleID) FROM Sales")
+        hot_min = cursor.fetchone()[0]
+        cursor.execute("SELECT MIN(SaleID), MAX(SaleID) FROM SalesArchive")
+        archive_min, archive_max = cursor.fetchone()
+        cursor.execute(f"""SELECT MIN(`{log_key_column}`), MAX(`{log_key_column}`) FROM InventoryLogs
+                           UNION ALL SELECT MIN(`{log_key_column}`), MAX(`{log_key_column}`) FROM InventoryLogsArchive""")
+        log_ranges = cursor.fetchall()
+        conn.commit()
+
+        def bound(values, pick):
+            values = [value for value in values if value is not None]
+            return pick(values) if values else None
+        return {
+            'min_sale_id': bound([hot_min, archive_min], min),
+            'max_sale_id': bound([hot_max, archive_max], max),
+            'min_log_id': bound([low for low, _ in log_ranges], min),
+            'max_log_id': bound([high for _, high in log_ranges], max),
+            'log_key_column': log_key_column,
+        }
+    except Error as e:
+        logger.error("Error reading reconciliation bounds", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def reconcile_sales_range(conn, first_sale_id, last_sale_id, detail_limit=100):
+    """Checks sales with first_sale_id <= SaleID <= last_sale_id in one consistent snapshot.
+       Returns a dict, or None on error:
+         'sold': {ProductID: quantity sold in the range}
+         'total_mismatches': sales whose TotalAmount differs from the sum of their lines (or that have no lines)
+         'line_mismatches': lines whose TotalPrice differs from Quantity * UnitPrice
+         'orphan_lines': lines whose sale or product does not exist
+       Each list holds at most detail_limit rows; 'truncated' names the lists that were cut short.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    params = (first_sale_id, last_sale_id) * 2
+    cursor = None
+    try:
+        conn.rollback() # A snapshot can only start outside a transaction
+        conn.start_transaction(consistent_snapshot=True, readonly=True)
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        sales = _across_archive("SELECT SaleID, TotalAmount FROM {Sales} WHERE SaleID BETWEEN %s AND %s")
+        lines = _across_archive("""SELECT SaleID, ProductID, Quantity, UnitPrice, TotalPrice
+                                   FROM {SaleDetails} WHERE SaleID BETWEEN %s AND %s""")
+        result = {'sold': {}, 'truncated': []}
+
+        cursor.execute(f"""SELECT s.SaleID, s.TotalAmount, d.LinesTotal, COALESCE(d.LineCount, 0) AS LineCount
+                           FROM ({sales}) s
+                           LEFT JOIN (SELECT SaleID, SUM(TotalPrice) AS LinesTotal, COUNT(*) AS LineCount
+                                      FROM ({lines}) l GROUP BY SaleID) d ON d.SaleID = s.SaleID
+                           WHERE d.SaleID IS NULL OR ABS(s.TotalAmount - d.LinesTotal) > %s
+                           ORDER BY s.SaleID LIMIT %s""",
+                       (*params, *params, RECONCILE_AMOUNT_TOLERANCE, detail_limit))
+        result['total_mismatches'] = cursor.fetchall()
+
+        cursor.execute(f"""SELECT l.SaleID, l.ProductID, l.Quantity, l.UnitPrice, l.TotalPrice
+                           FROM ({lines}) l
+                           WHERE ABS(l.TotalPrice - l.Quantity * l.UnitPrice) > %s
+                           ORDER BY l.SaleID LIMIT %s""",
+                       (*params, RECONCILE_AMOUNT_TOLERANCE, detail_limit))
+        result['line_mismatches'] = cursor.fetchall()
+
+        cursor.execute(f"""SELECT l.SaleID, l.ProductID, s.SaleID IS NULL AS MissingSale, p.ProductID IS NULL AS MissingProduct
+                           FROM ({lines}) l
+                           LEFT JOIN ({sales}) s ON s.SaleID = l.SaleID
+                           LEFT JOIN Products p ON p.ProductID = l.ProductID
+                           WHERE s.SaleID IS NULL OR p.ProductID IS NULL
+                           ORDER BY l.SaleID LIMIT %s""",
+                       (*params, *params, detail_limit))
+        result['orphan_lines'] = [dict(row, MissingSale=bool(row['MissingSale']), MissingProduct=bool(row['MissingProduct']))
+                                  for row in cursor.fetchall()]
+
+        cursor.execute(f"SELECT ProductID, SUM(Quantity) AS Quantity FROM ({lines}) l GROUP BY ProductID", params)
+        for row in cursor.fetchall():
+            result['sold'][row['ProductID']] = int(row['Quantity'])
+        conn.rollback() # Read-only; ends the snapshot
+
+        result['truncated'] = [name for name in ('total_mismatches', 'line_mismatches', 'orphan_lines')
+                               if len(result[name]) >= detail_limit]
+        return result
+    except Error as e:
+        logger.error("Error reconciling sales %s-%s", first_sale_id, last_sale_id, exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def reconcile_inventory_logs_range(conn, first_log_id, last_log_id, max_sale_id, detail_limit=100):
+    """Checks inventory logs with IDs first_log_id..last_log_id in one consistent snapshot.
+       Returns a dict, or None on error:
+         'logged': {ProductID: quantity removed by 'Sale' logs of sales up to max_sale_id}
+         'orphan_logs': logs whose product does not exist (at most detail_limit rows)
+         'truncated': ['orphan_logs'] when that list was cut short
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    key_column = get_primary_key_column(conn, 'InventoryLogs')
+    if key_column is None:
+        logger.error("InventoryLogs has no single-column primary key.")
+        return None
+    params = (first_log_id, last_log_id) * 2
+    cursor = None
+    try:
+        conn.rollback() # A snapshot can only start outside a transaction
+        conn.start_transaction(consistent_snapshot=True, readonly=True)
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        logs = _across_archive(f"""SELECT `{key_column}` AS LogID, ProductID, ChangeType, QuantityChange, SaleID
+                                   FROM {{InventoryLogs}} WHERE `{key_column}` BETWEEN %s AND %s""")
+        result = {'logged': {}}
+
+        cursor.execute(f"""SELECT ProductID, -SUM(QuantityChange) AS Quantity FROM ({logs}) g
+                           WHERE ChangeType = 'Sale' AND SaleID <= %s
+                           GROUP BY ProductID""",
+                       (*params, max_sale_id))
+        for row in cursor.fetchall():
+            result['logged'][row['ProductID']] = int(row['Quantity'])
+
+        cursor.execute(f"""SELECT g.LogID, g.ProductID, g.ChangeType, g.QuantityChange FROM ({logs}) g
+                           LEFT JOIN Products p ON p.ProductID = g.ProductID
+                           WHERE p.ProductID IS NULL ORDER BY g.LogID LIMIT %s""", (*params, detail_limit))
+        result['orphan_logs'] = cursor.fetchall()
+        conn.rollback()
+
+        result['truncated'] = ['orphan_logs'] if len(result['orphan_logs']) >= detail_limit else []
+        return result
+    except Error as e:
+        logger.error("Error reconciling inventory logs %s-%s", first_log_id, last_log_id, exc_info=e)
+        if conn.is_connected(): conn.rollback()
+        return None
+    finally:
+        if cursor: cursor.close()
+
+# --- Multi-Store Reporting ---
+# Cross-store reports run the same single-store function against every store in parallel and merge the
+# results in Python. Entity IDs are per store, so merged rows carry a StoreID.
+def for_each_store(function, *args, store_ids=None):
+    """Calls function(conn, *args) for each store (all configured stores by default) in parallel threads,
+       each with its own read connection. Returns {store_id: result}; result is None for an unreachable store,
+       so function must return None (not an empty result) when its query fails.
+    """
+    store_ids = sorted(STORE_CONFIGS if store_ids is None else store_ids)
+
+    def run(store_id):
+        conn = create_read_connection(store_id)
+        if conn is None:
+            return None
+        try:
+            return function(conn, *args)
+        except Exception as e:
+            logger.error("Error querying store %s", store_id, exc_info=e)
+            return None
+        finally:
+            if conn.is_connected(): conn.close()
+
+    if len(store_ids) <= 1:
+        return {store_id: run(store_id) for store_id in store_ids}
+    with ThreadPoolExecutor(max_workers=min(STORE_FANOUT_WORKERS, len(store_ids)), thread_name_prefix='store-fanout') as pool:
+        return dict(zip(store_ids, pool.map(run, store_ids)))
+
+def get_store_summary(conn, since_date, threshold=10):
+    """Gets one store's totals: Products, Customers, LowStock, and SalesCount/Revenue since since_date
+       (archived sales included). Returns a dict or None on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        sales = _across_archive("SELECT TotalAmount FROM {Sales} WHERE SaleDate >= %s")
+        cursor.execute(f"""SELECT (SELECT COUNT(*) FROM Products) AS Products,
+                                  (SELECT COUNT(*) FROM Customers) AS Customers,
+                                  (SELECT COUNT(*) FROM Products WHERE StockQuantity < %s) AS LowStock,
+                                  COUNT(s.TotalAmount) AS SalesCount,
+                                  COALESCE(SUM(s.TotalAmount), 0) AS Revenue
+                           FROM ({sales}) s""", (threshold, since_date, since_date))
+        return cursor.fetchone()
+    except Error as e:
+        logger.error("Error fetching store summary", exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def fetch_product_sales_since(conn, since_date):
+    """Fetches quantity and revenue per product sold since since_date (archived sales included).
+       Returns a list of dicts (ProductID, ProductName, Quantity, Revenue), or None on error.
+    """
+    if not conn or not conn.is_connected():
+        logger.error("Connection not active.")
+        return None
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        lines = _across_archive("""SELECT sd.ProductID, sd.Quantity, sd.TotalPrice
+                                   FROM {SaleDetails} sd JOIN {Sales} s ON s.SaleID = sd.SaleID
+                                   WHERE s.SaleDate >= %s""")
+        cursor.execute(f"""SELECT l.ProductID, p.ProductName, SUM(l.Quantity) AS Quantity, SUM(l.TotalPrice) AS Revenue
+                           FROM ({lines}) l
+                           JOIN Products p ON p.ProductID = l.ProductID
+                           GROUP BY l.ProductID, p.ProductName""", (since_date, since_date))
+        return cursor.fetchall()
+    except Error as e:
+        logger.error("Error fetching product sales since %s", since_date, exc_info=e)
+        return None
+    finally:
+        if cursor: cursor.close()
+
+def fetch_store_summaries(since_date, threshold=10):
+    """Gets get_store_summary for every store in parallel. Returns a list of dicts with StoreID and
+       Available (False when the store's database could not be reached), ordered by StoreID.
+    """
+    results = for_each_store(get_store_summary, since_date, threshold)
+    return [dict(summary or {}, StoreID=store_id, Available=summary is not None) for store_id, summary in results.items()]
+
+def fetch_top_products_all_stores(since_date, limit=10):
+    """Best sellers across all stores since since_date. Stores keep their own product IDs, so products are
+       matched by name. Returns (rows, unavailable_store_ids); each row has ProductName, Quantity, Revenue
+       and Stores (the number of stores that sold it).
+    """
+    results = for_each_store(fetch_product_sales_since, since_date)
+    merged = {}
+    for store_id, rows in results.items():
+        for row in rows or []:
+            total = merged.setdefault(row['ProductName'].strip().lower(),
+                                      {'ProductName': row['ProductName'], 'Quantity': 0, 'Revenue': 0, 'Stores': 0})
+            total['Quantity'] += int(row['Quantity'])
+            total['Revenue'] += row['Revenue']
+            total['Stores'] += 1
+    top = sorted(merged.values(), key=lambda total: (-total['Revenue'], total['ProductName']))[:limit]
+    return top, [store_id for store_id, rows in results.items() if rows is None]
+
+def _fetch_low_stock_or_none(conn, threshold):
+    errors = []
+    rows = fetch_low_stock_products(conn, threshold, errors=errors)
+    return None if errors else rows
+
+def fetch_low_stock_all_stores(threshold=10):
+    """Low-stock products of every store, lowest stock first. Returns (rows with StoreID, unavailable_store_ids)."""
+    results = for_each_store(_fetch_low_stock_or_none, threshold)
+    rows = [dict(row, StoreID=store_id) for store_id, store_rows in results.items() for row in store_rows or []]
+    rows.sort(key=lambda row: (row['StockQuantity'], row['ProductName'], row['StoreID']))
+    return rows, [store_id for store_id, store_rows in results.items() if store_rows is None]
+
+# Log entries from these functions report how long the call had been running
+app_logging.instrument_functions(globals(), __name__)
 
 if __name__ == '__main__':
     print("Running database_operations.py directly (for testing or seeding)...")
@@ -0,0 +1,147 @@
+# fragment_cache.py
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import before_render_template, template_rendered, g
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+class FragmentCache:
+    """Size-bounded LRU store for rendered template fragments.
+
+    Keys always include a data version token, so entries never need explicit invalidation:
+    a write bumps the version and the old entries age out of the LRU.
+    """
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.render_seconds = 0.0 # Time spent rendering fragments on misses
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, render_seconds=0.0):
+        size = sys.getsizeof(value)
+        with self._lock:
+            self.render_seconds += render_seconds
+            if size > self.max_bytes:
+                return # Never worth evicting everything for one fragment
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'miss_render_ms_total': round(self.render_seconds * 1000, 3),
+            }
+
+class FragmentCacheExtension(Extension):
+    """Adds {% cache "name", key_part, ... %}...{% endcache %} to templates.
+
+    Include the data version (see http_caching.data_version_token) in the key parts;
+    a None key part bypasses the cache.
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', [nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        if any(part is None for part in key_parts):
+            return caller() # Unknown data version: render without caching
+        cache = self.environment.fragment_cache
+        key = tuple(str(part) for part in key_parts)
+        cached = cache.get(key)
+        if cached is not None:
+            return Markup(cached)
+        started = time.perf_counter()
+        rendered = caller()
+        cache.set(key, str(rendered), time.perf_counter() - started)
+        return rendered
+
+class RenderMetrics:
+    """Accumulates full-template render times per template name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, template_name, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(template_name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += seconds * 1000
+            stats['max_ms'] = max(stats['max_ms'], seconds * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {'count': s['count'], 'avg_ms': round(s['total_ms'] / s['count'], 3),
+                       'max_ms': round(s['max_ms'], 3), 'total_ms': round(s['total_ms'], 3)}
+                for name, s in self._stats.items()
+            }
+
+render_metrics = RenderMetrics()
+
+def init_app(app):
+    """Registers the {% cache %} tag and render timing on a Flask app."""
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+    def _render_started(sender, template, context, **extra):
+        g.setdefault('_render_started', []).append(time.perf_counter())
+
+    def _render_finished(sender, template, context, **extra):
+        starts = g.get('_render_started')
+        if starts:
+            render_metrics.record(template.name, time.perf_counter() - starts.pop())
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
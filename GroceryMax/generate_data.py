@@ -0,0 +1,423 @@
+# generate_data.py
+"""Synthetic data generator for profiling and benchmarking at realistic scale.
+
+Generates products, customers and a sales history with realistic skew: product and customer
+popularity follow Zipf distributions, and sales follow yearly and weekly seasonality, store hours
+and slow growth. Each sale line also gets its 'Sale' inventory log, as a live sale would.
+    python generate_data.py --yes --products 1000000 --customers 500000 --sale-lines 50000000 --years 3
+The same --seed, volumes and --end-date always produce the same data, whatever the number of workers.
+
+Rows are generated in numbered chunks by GENERATE_WORKERS processes and written with LOAD DATA LOCAL
+INFILE (--method load, needs local_infile enabled on the server; falls back to multi-row INSERTs) or
+with multi-row INSERTs (--method insert). Sales dated before the archive cutoff go straight into the
+archive tables. Products and customers are added after any that exist; sales need an empty sales history,
+since SaleIDs must follow SaleDate order. Run it against a test database, then restart the app.
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import mysql.connector
+import numpy as np
+from mysql.connector import Error
+
+import app_logging
+import archival
+import database_operations
+
+logger = app_logging.get_logger(__name__)
+
+GENERATE_WORKERS = int(os.environ.get('GENERATE_WORKERS', str(os.cpu_count() or 4)))
+PRODUCTS_PER_CHUNK = 100000
+CUSTOMERS_PER_CHUNK = 100000
+SALES_PER_CHUNK = 50000
+INSERT_BATCH_ROWS = 5000
+# Server or client refused LOAD DATA LOCAL INFILE
+LOCAL_INFILE_ERRNOS = (1148, 2068, 3948, 3950)
+METHOD_LOAD, METHOD_INSERT = 'load', 'insert'
+
+# Category name -> (description, typical price in dollars, product nouns)
+CATEGORIES = {
+    'Fruits': ("Fresh and juicy fruits", 3.0, ['Apples', 'Bananas', 'Blueberries', 'Grapes', 'Oranges', 'Pears', 'Strawberries', 'Mangoes']),
+    'Vegetables': ("Farm fresh vegetables", 2.5, ['Carrots', 'Broccoli', 'Spinach', 'Tomatoes', 'Potatoes', 'Onions', 'Peppers', 'Lettuce']),
+    'Dairy': ("Milk, cheese, yogurt, etc.", 4.0, ['Whole Milk', 'Cheddar', 'Greek Yogurt', 'Butter', 'Mozzarella', 'Cream', 'Skim Milk']),
+    'Bakery': ("Freshly baked goods", 3.5, ['Sourdough Bread', 'Bagels', 'Croissants', 'Muffins', 'Baguette', 'Rye Bread', 'Tortillas']),
+    'Beverages': ("Drinks and refreshments", 2.5, ['Orange Juice', 'Sparkling Water', 'Cola', 'Green Tea', 'Coffee Beans', 'Lemonade']),
+    'Snacks': ("Chips, nuts, and other munchies", 3.0, ['Potato Chips', 'Almonds', 'Pretzels', 'Popcorn', 'Granola Bars', 'Trail Mix']),
+    'Meat': ("Fresh cuts and poultry", 9.0, ['Chicken Breast', 'Ground Beef', 'Pork Chops', 'Bacon', 'Sausages', 'Turkey Slices']),
+    'Seafood': ("Fresh and frozen fish", 11.0, ['Salmon Fillet', 'Shrimp', 'Tuna Steak', 'Cod', 'Mussels']),
+    'Frozen': ("Frozen meals and desserts", 5.0, ['Pizza', 'Ice Cream', 'Peas', 'Fish Sticks', 'Waffles', 'Dumplings']),
+    'Pantry': ("Staples and dry goods", 3.0, ['Pasta', 'Rice', 'Olive Oil', 'Flour', 'Canned Beans', 'Peanut Butter', 'Cereal']),
+    'Household': ("Cleaning and household supplies", 6.0, ['Dish Soap', 'Paper Towels', 'Laundry Detergent', 'Trash Bags', 'Sponges']),
+    'Personal Care': ("Toiletries and health", 6.5, ['Shampoo', 'Toothpaste', 'Hand Soap', 'Deodorant', 'Lotion']),
+}
+BRANDS = ['Hillside', 'Green Valley', 'Sunrise', 'Golden Acre', 'Blue Harbor', 'Maple Lane', 'Old Mill', 'Riverbend', 'Northfield', 'Daily Market']
+VARIANTS = ['', 'Organic', 'Family Size', 'Classic', 'Low Fat', 'Premium', 'Value Pack', 'Fresh']
+SIZES = ['250g', '500g', '1kg', '1L', '2L', '6 pack', '12 oz', 'each']
+FIRST_NAMES = ['John', 'Jane', 'Maria', 'David', 'Aisha', 'Wei', 'Carlos', 'Priya', 'Liam', 'Emma', 'Noah', 'Olivia', 'Yusuf',
+               'Sofia', 'Kenji', 'Fatima', 'Lucas', 'Chloe', 'Mateo', 'Zara']
+LAST_NAMES = ['Doe', 'Smith', 'Garcia', 'Chen', 'Khan', 'Nguyen', 'Patel', 'Brown', 'Okafor', 'Silva', 'Kim', 'Martin', 'Rossi',
+              'Novak', 'Haddad', 'Jensen', 'Lopez', 'Walker', 'Ito', 'Murphy']
+STREETS = ['Oak', 'Maple', 'Main', 'Pine', 'Cedar', 'Elm', 'Lake', 'Hill', 'Park', 'River']
+STREET_SUFFIXES = ['St', 'Ave', 'Rd', 'Ln', 'Blvd']
+PAYMENT_METHODS = (['Cash', 'Card', 'Online', 'Other'], [0.3, 0.55, 0.1, 0.05])
+
+# Sales shape
+MEAN_LINES_PER_SALE = 3.5
+MAX_LINES_PER_SALE = 40
+CUSTOMER_SALE_SHARE = 0.65 # Sales made by a registered customer
+HOUR_WEIGHTS = np.array([0, 0, 0, 0, 0, 0, 0, 2, 4, 5, 5, 6, 8, 7, 5, 5, 6, 9, 10, 8, 5, 3, 1, 0], dtype=float)
+WEEKDAY_WEIGHTS = np.array([0.9, 0.85, 0.9, 1.0, 1.15, 1.35, 1.1]) # Monday first
+ANNUAL_GROWTH = 0.08
+
+def day_weights(start_date, days):
+    """Relative sales volume per day: a December peak, a smaller summer bump, busier weekends, slow growth."""
+    dates = np.arange(np.datetime64(start_date), np.datetime64(start_date) + days)
+    day_of_year = (dates - dates.astype('datetime64[Y]')).astype(int)
+    weekday = (dates.astype(int) + 3) % 7 # 1970-01-01 was a Thursday
+    seasonal = 1 + 0.3 * np.exp(-((day_of_year - 350) / 12.0) ** 2) + 0.1 * np.cos(2 * np.pi * (day_of_year - 196) / 365)
+    growth = (1 + ANNUAL_GROWTH) ** (np.arange(days) / 365)
+    return seasonal * WEEKDAY_WEIGHTS[weekday] * growth
+
+def zipf_cdf(count, exponent):
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+def chunk_rng(seed, stream, chunk_index):
+    """Independent, reproducible random stream per (table, chunk), so output does not depend on scheduling."""
+    return np.random.default_rng([seed, stream, chunk_index])
+
+# --- Worker side ---
+# Catalog-wide arrays every worker derives once from the plan instead of receiving them per task
+_plan = None
+_catalog = None
+
+def _init_worker(plan):
+    global _plan, _catalog
+    _plan = plan
+    rng = chunk_rng(plan['seed'], 0, 0)
+    n_products, n_customers = plan['n_products'], plan['n_customers']
+    category_index = rng.integers(0, len(plan['category_ids']), n_products)
+    base_prices = np.array([CATEGORIES[name][1] for name in plan['category_names']])
+    price_cents = np.maximum(29, np.round(base_prices[category_index] * rng.lognormal(0, 0.5, n_products) * 10).astype(np.int64) * 10 - 1)
+    _catalog = {
+        'category_index': category_index,
+        'price_cents': price_cents,
+        # Popularity ranks are shuffled so that bestsellers are spread over the catalog
+        'product_by_rank': rng.permutation(n_products),
+        'product_cdf': zipf_cdf(n_products, plan['product_zipf']) if n_products else None,
+        'customer_by_rank': rng.permutation(n_customers),
+        'customer_cdf': zipf_cdf(n_customers, plan['customer_zipf']) if n_customers else None,
+    }
+
+def _connect():
+    config = dict(database_operations.STORE_CONFIGS[_plan['store_id']])
+    conn = mysql.connector.connect(**config, allow_local_infile=_plan['method'] == METHOD_LOAD)
+    cursor = conn.cursor()
+    # Generated rows are consistent by construction; skipping the checks speeds up loading considerably
+    cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+    cursor.close()
+    return conn
+
+def _tsv_value(value):
+    return '\\N' if value is None else str(value)
+
+def _load_rows(conn, table, columns, rows):
+    """Writes rows into table with LOAD DATA LOCAL INFILE, or multi-row INSERTs, and commits."""
+    column_list = ', '.join(f"`{column}`" for column in columns)
+    cursor = conn.cursor()
+    try:
+        if _plan['method'] == METHOD_LOAD:
+            with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False, encoding='utf-8') as f:
+                f.writelines('\t'.join(map(_tsv_value, row)) + '\n' for row in rows)
+            try:
+                cursor.execute(f"""LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4
+                                   FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({column_list})""", (f.name,))
+                conn.commit()
+                return
+            except Error as e:
+                if e.errno not in LOCAL_INFILE_ERRNOS:
+                    raise
+                logger.warning("LOAD DATA LOCAL INFILE is not allowed (%s); using multi-row INSERTs.", e.msg)
+                _plan['method'] = METHOD_INSERT
+                conn.rollback()
+            finally:
+                os.remove(f.name)
+        sql = f"INSERT INTO {table} ({column_list}) VALUES ({', '.join(['%s'] * len(columns))})"
+        for start in range(0, len(rows), INSERT_BATCH_ROWS):
+            cursor.executemany(sql, rows[start:start + INSERT_BATCH_ROWS]) # Sent as one multi-row INSERT
+        conn.commit()
+    finally:
+        cursor.close()
+
+def _products_rows(chunk_index, first, count):
+    rng = chunk_rng(_plan['seed'], 1, chunk_index)
+    offsets = np.arange(first, first + count)
+    category_index = _catalog['category_index'][offsets]
+    brands = rng.integers(0, len(BRANDS), count)
+    variants = rng.integers(0, len(VARIANTS), count)
+    sizes = rng.integers(0, len(SIZES), count)
+    noun_picks = rng.random(count)
+    stock = np.where(rng.random(count) < 0.05, rng.integers(0, 10, count), rng.integers(10, 500, count))
+    rows = []
+    for i, offset in enumerate(offsets.tolist()):
+        category_name = _plan['category_names'][category_index[i]]
+        nouns = CATEGORIES[category_name][2]
+        noun = nouns[int(noun_picks[i] * len(nouns))]
+        product_id = _plan['first_product_id'] + offset
+        name = ' '.join(filter(None, [BRANDS[brands[i]], VARIANTS[variants[i]], noun, SIZES[sizes[i]]]))
+        rows.append((product_id, f"{name} #{product_id}", f"{noun} from {BRANDS[brands[i]]}, {SIZES[sizes[i]]}",
+                     _plan['category_ids'][category_index[i]], int(_catalog['price_cents'][offset]) / 100, int(stock[i])))
+    return rows
+
+def _customers_rows(chunk_index, first, count):
+    rng = chunk_rng(_plan['seed'], 2, chunk_index)
+    first_names = rng.integers(0, len(FIRST_NAMES), count)
+    last_names = rng.integers(0, len(LAST_NAMES), count)
+    phones = rng.integers(0, 10000000, count)
+    house_numbers = rng.integers(1, 2000, count)
+    streets = rng.integers(0, len(STREETS), count)
+    suffixes = rng.integers(0, len(STREET_SUFFIXES), count)
+    has_email = rng.random(count) < 0.8
+    rows = []
+    for i in range(count):
+        customer_id = _plan['first_customer_id'] + first + i
+        first_name, last_name = FIRST_NAMES[first_names[i]], LAST_NAMES[last_names[i]]
+        email = f"{first_name}.{last_name}.{customer_id}@example.com".lower() if has_email[i] else None
+        rows.append((customer_id, first_name, last_name, email, f"555-{phones[i]:07d}",
+                     f"{house_numbers[i]} {STREETS[streets[i]]} {STREET_SUFFIXES[suffixes[i]]}"))
+    return rows
+
+def _sales_rows(chunk_index, first_sale_id, first_day, day_counts):
+    """Generates one chunk of consecutive days. Returns (sales, lines, logs) row lists."""
+    rng = chunk_rng(_plan['seed'], 3, chunk_index)
+    day_counts = np.asarray(day_counts)
+    count = int(day_counts.sum())
+    day_starts = (np.datetime64(_plan['start_date']) + first_day + np.arange(len(day_counts))).astype('datetime64[s]')
+    hour_cdf = np.cumsum(HOUR_WEIGHTS) / HOUR_WEIGHTS.sum()
+    seconds = np.searchsorted(hour_cdf, rng.random(count), side='right') * 3600 + rng.integers(0, 3600, count)
+    sale_day = np.repeat(np.arange(len(day_counts)), day_counts)
+    # Sorted within each day so SaleIDs follow SaleDate
+    seconds = seconds[np.lexsort((seconds, sale_day))]
+    sale_times = day_starts[sale_day] + seconds.astype('timedelta64[s]')
+    sale_dates = [value.replace('T', ' ') for value in np.datetime_as_string(sale_times, unit='s').tolist()]
+
+    customers = [None] * count
+    if _plan['n_customers']:
+        registered = np.flatnonzero(rng.random(count) < _plan['customer_share'])
+        ranks = np.searchsorted(_catalog['customer_cdf'], rng.random(len(registered)))
+        customer_ids = _catalog['customer_by_rank'][ranks] + _plan['first_customer_id']
+        for position, customer_id in zip(registered.tolist(), customer_ids.tolist()):
+            customers[position] = customer_id
+    payments = rng.choice(len(PAYMENT_METHODS[0]), count, p=PAYMENT_METHODS[1])
+
+    line_counts = np.minimum(rng.geometric(1 / MEAN_LINES_PER_SALE, count), MAX_LINES_PER_SALE)
+    sale_index = np.repeat(np.arange(count), line_counts)
+    products = _catalog['product_by_rank'][np.searchsorted(_catalog['product_cdf'], rng.random(len(sale_index)))]
+    # A product appears at most once per sale
+    _, unique_positions = np.unique(sale_index.astype(np.int64) * _plan['n_products'] + products, return_index=True)
+    sale_index, products = sale_index[unique_positions], products[unique_positions]
+    quantities = np.minimum(rng.geometric(0.6, len(products)), 12)
+    unit_cents = _catalog['price_cents'][products]
+    line_cents = unit_cents * quantities
+    sale_cents = np.bincount(sale_index, weights=line_cents, minlength=count).round().astype(np.int64)
+
+    sale_ids = first_sale_id + np.arange(count)
+    sales = [(sale_id, customers[i], sale_dates[i], cents / 100, PAYMENT_METHODS[0][payment])
+             for i, (sale_id, cents, payment) in enumerate(zip(sale_ids.tolist(), sale_cents.tolist(), payments.tolist()))]
+    line_sale_ids = sale_ids[sale_index].tolist()
+    product_ids = (products + _plan['first_product_id']).tolist()
+    quantities = quantities.tolist()
+    lines = list(zip(line_sale_ids, product_ids, quantities, (unit_cents / 100).tolist(), (line_cents / 100).tolist()))
+    line_dates = [sale_dates[i] for i in sale_index.tolist()]
+    logs = [(product_id, 'Sale', -quantity, f"{database_operations.SALE_LOG_NOTES_PREFIX}{sale_id}", sale_id, sale_date)
+            for sale_id, product_id, quantity, sale_date in zip(line_sale_ids, product_ids, quantities, line_dates)]
+    return sales, lines, logs
+
+def run_task(task):
+    """Generates and loads one chunk in a worker process. Returns the number of rows written per table."""
+    kind, chunk_index, *args = task
+    conn = _connect()
+    try:
+        if kind == 'products':
+            rows = _products_rows(chunk_index, *args)
+            _load_rows(conn, 'Products', ['ProductID', 'ProductName', 'Description', 'CategoryID', 'Price', 'StockQuantity'], rows)
+            return {'Products': len(rows)}
+        if kind == 'customers':
+            rows = _customers_rows(chunk_index, *args)
+            _load_rows(conn, 'Customers', ['CustomerID', 'FirstName', 'LastName', 'Email', 'PhoneNumber', 'Address'], rows)
+            return {'Customers': len(rows)}
+        sales, lines, logs = _sales_rows(chunk_index, *args[:3])
+        archived = args[3]
+        tables = database_operations.ARCHIVE_TABLES if archived else {table: table for table in database_operations.ARCHIVE_TABLES}
+        _load_rows(conn, tables['Sales'], ['SaleID', 'CustomerID', 'SaleDate', 'TotalAmount', 'PaymentMethod'], sales)
+        _load_rows(conn, tables['SaleDetails'], ['SaleID', 'ProductID', 'Quantity', 'UnitPrice', 'TotalPrice'], lines)
+        _load_rows(conn, tables['InventoryLogs'], ['ProductID', 'ChangeType', 'QuantityChange', 'Notes', 'SaleID', _plan['log_date_column']], logs)
+        return {tables['Sales']: len(sales), tables['SaleDetails']: len(lines), tables['InventoryLogs']: len(logs)}
+    finally:
+        conn.close()
+
+# --- Planning (parent process) ---
+def plan_sales_chunks(plan, sale_lines, years, end_date, cutoff):
+    """Spreads the sales over the days before end_date and splits them into chunks of consecutive days.
+       Chunks never straddle the archive cutoff. Returns a list of ('sales', index, first_sale_id, first_day,
+       day_counts, archived) tasks.
+    """
+    days = int(round(years * 365))
+    start_date = end_date - datetime.timedelta(days=days)
+    plan['start_date'] = start_date.isoformat()
+    rng = chunk_rng(plan['seed'], 4, 0)
+    weights = day_weights(start_date, days)
+    sales_count = int(round(sale_lines / MEAN_LINES_PER_SALE))
+    day_counts = rng.multinomial(sales_count, weights / weights.sum()) if days and sales_count else np.zeros(days, dtype=np.int64)
+    cutoff_day = (cutoff - start_date).days if cutoff else 0
+    tasks, first_day, next_sale_id = [], 0, plan['first_sale_id']
+    while first_day < days:
+        last_day, in_chunk = first_day, 0
+        while last_day < days and (in_chunk == 0 or in_chunk + day_counts[last_day] <= SALES_PER_CHUNK) \
+                and not (first_day < cutoff_day <= last_day):
+            in_chunk += int(day_counts[last_day])
+            last_day += 1
+        if in_chunk:
+            tasks.append(('sales', len(tasks), next_sale_id, first_day, day_counts[first_day:last_day].tolist(), last_day <= cutoff_day))
+        next_sale_id += in_chunk
+        first_day = last_day
+    return tasks
+
+def _max_id(cursor, table, column):
+    cursor.execute(f"SELECT COALESCE(MAX(`{column}`), 0) FROM {table}")
+    return cursor.fetchone()[0]
+
+def _continue_auto_increment(cursor, conn, table):
+    """Moves the hot table's AUTO_INCREMENT past the archive's IDs, so rows archived later never collide with them."""
+    key_column = database_operations.get_primary_key_column(conn, table)
+    if key_column is None:
+        return
+    next_id = max(_max_id(cursor, table, key_column), _max_id(cursor, database_operations.ARCHIVE_TABLES[table], key_column)) + 1
+    cursor.execute(f"ALTER TABLE {table} AUTO_INCREMENT = {int(next_id)}")
+
+def _run_tasks(pool, tasks, label, totals):
+    started = time.perf_counter()
+    futures = [pool.submit(run_task, task) for task in tasks]
+    for done, future in enumerate(as_completed(futures), 1):
+        for table, count in future.result().items():
+            totals[table] = totals.get(table, 0) + count
+        print(f"\r  {label}: {done}/{len(tasks)} chunks", end='', flush=True)
+    if tasks:
+        print(f" in {time.perf_counter() - started:.1f}s")
+
+def generate(products, customers, sale_lines, years, seed=42, workers=GENERATE_WORKERS, method=METHOD_LOAD,
+             end_date=None, product_zipf=1.1, customer_zipf=0.8, store_id=None):
+    """Generates the dataset into one store's database. Returns {table: rows written}, or None with a printed reason."""
+    store_id = database_operations.STORE_ID if store_id is None else store_id
+    end_date = end_date or datetime.date.today()
+    conn = database_operations.create_connection(store_id)
+    if conn is None:
+        print("Failed to connect to the database.")
+        return None
+    try:
+        if not database_operations.ensure_extension_tables(conn):
+            print("Failed to create the supporting tables.")
+            return None
+        category_names = list(CATEGORIES)
+        category_ids = [database_operations.get_or_create_category(conn, name, CATEGORIES[name][0]) for name in category_names]
+        if None in category_ids:
+            print("Failed to create the categories.")
+            return None
+        cursor = conn.cursor(buffered=True)
+        if sale_lines and (_max_id(cursor, 'Sales', 'SaleID') or _max_id(cursor, 'SalesArchive', 'SaleID')):
+            print("The database already has sales; generated sales need an empty sales history. Use --sale-lines 0 or a new database.")
+            return None
+        plan = {
+            'store_id': store_id, 'seed': seed, 'method': method,
+            'category_names': category_names, 'category_ids': category_ids,
+            'first_product_id': _max_id(cursor, 'Products', 'ProductID') + 1, 'n_products': products,
+            'first_customer_id': _max_id(cursor, 'Customers', 'CustomerID') + 1, 'n_customers': customers,
+            'first_sale_id': 1, 'customer_share': CUSTOMER_SALE_SHARE,
+            'product_zipf': product_zipf, 'customer_zipf': customer_zipf,
+            'log_date_column': database_operations.get_inventory_log_date_column(conn),
+        }
+        conn.commit()
+        if sale_lines and not products:
+            print("Sales need generated products (--products).")
+            return None
+        if sale_lines and plan['log_date_column'] is None:
+            print(f"InventoryLogs has no date column '{database_operations.INVENTORY_LOG_DATE_COLUMN}'; set INVENTORY_LOG_DATE_COLUMN.")
+            return None
+        cutoff = archival.archive_cutoff() if archival.ARCHIVE_AFTER_MONTHS > 0 else None
+        sales_tasks = plan_sales_chunks(plan, sale_lines, years, end_date, cutoff) if sale_lines else []
+        catalog_tasks = [('products', index, first, min(PRODUCTS_PER_CHUNK, products - first))
+                         for index, first in enumerate(range(0, products, PRODUCTS_PER_CHUNK))]
+        catalog_tasks += [('customers', index, first, min(CUSTOMERS_PER_CHUNK, customers - first))
+                          for index, first in enumerate(range(0, customers, CUSTOMERS_PER_CHUNK))]
+
+        totals = {}
+        # Spawned workers open their own connections instead of inheriting the parent's pools
+        with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(plan,)) as pool:
+            _run_tasks(pool, catalog_tasks, "products and customers", totals)
+            # Archived sales first, then the hot tables continue their IDs after them
+            _run_tasks(pool, [task for task in sales_tasks if task[5]], "archived sales", totals)
+            if sales_tasks:
+                _continue_auto_increment(cursor, conn, 'SaleDetails')
+                _continue_auto_increment(cursor, conn, 'InventoryLogs')
+            _run_tasks(pool, [task for task in sales_tasks if not task[5]], "recent sales", totals)
+        cursor.close()
+
+        print("  Rebuilding the product listing and customer aggregates...")
+        database_operations.rebuild_product_listing(conn)
+        if sale_lines: database_operations.rebuild_customer_stats(conn)
+        database_operations.bump_data_versions(conn, database_operations.ENTITY_CATEGORY, database_operations.ENTITY_PRODUCT,
+                                               database_operations.ENTITY_CUSTOMER, database_operations.ENTITY_SALE)
+        return totals
+    except Error as e:
+        logger.error("Error generating data", exc_info=e)
+        print(f"Generation failed: {e}")
+        return None
+    finally:
+        if conn.is_connected(): conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a large synthetic dataset for profiling and benchmarks.")
+    parser.add_argument('--yes', action='store_true', help="Confirm that rows may be written to the configured database.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--sale-lines', type=int, default=500000, help="Approximate number of sale lines.")
+    parser.add_argument('--years', type=float, default=3, help="Length of the sales history.")
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=None, help="Day after the last sale (default: today).")
+    parser.add_argument('--product-zipf', type=float, default=1.1, help="Zipf exponent of product popularity.")
+    parser.add_argument('--customer-zipf', type=float, default=0.8, help="Zipf exponent of customer visit frequency.")
+    parser.add_argument('--workers', type=int, default=GENERATE_WORKERS)
+    parser.add_argument('--method', choices=[METHOD_LOAD, METHOD_INSERT], default=METHOD_LOAD)
+    parser.add_argument('--store', type=int, default=None, help="Store to generate into (default: STORE_ID).")
+    args = parser.parse_args(argv)
+    store_id = database_operations.STORE_ID if args.store is None else args.store
+    if store_id not in database_operations.STORE_CONFIGS:
+        print(f"Store {store_id} is not configured in DB_STORES.")
+        return 1
+    if not args.yes:
+        print(f"This writes {args.products} products, {args.customers} customers and about {args.sale_lines} sale lines "
+              f"to {database_operations.STORE_CONFIGS[store_id]['database']}. Re-run with --yes to continue.")
+        return 1
+
+    started = time.perf_counter()
+    totals = generate(args.products, args.customers, args.sale_lines, args.years, seed=args.seed, workers=args.workers,
+                      method=args.method, end_date=args.end_date, product_zipf=args.product_zipf,
+                      customer_zipf=args.customer_zipf, store_id=store_id)
+    if totals is None:
+        return 1
+    elapsed = time.perf_counter() - started
+    for table, count in sorted(totals.items()):
+        print(f"  {table}: {count} rows")
+    print(f"Done in {elapsed:.1f}s ({sum(totals.values()) / elapsed:.0f} rows/s).")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# http_caching.py
+import datetime
+import hashlib
+
+from flask import g, request, session, make_response
+
+import database_operations
+
+# Revalidate on every use, but let the browser keep the copy
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+def request_data_versions(conn, entity_types):
+    """Entity versions for this request, read once and shared by ETags and fragment cache keys.
+       Returns None if the versions could not be read.
+    """
+    cached = g.setdefault('_data_versions', {})
+    missing = [entity_type for entity_type in entity_types if entity_type not in cached]
+    if missing:
+        fetched = database_operations.get_data_versions(conn, missing)
+        if fetched is None:
+            return None
+        cached.update(fetched)
+    return {entity_type: cached[entity_type] for entity_type in entity_types}
+
+def data_version_token(conn, entity_types):
+    """Compact string identifying the current data versions, e.g. for fragment cache keys.
+       Returns None if the versions are unknown, which disables caching.
+    """
+    versions = request_data_versions(conn, entity_types)
+    if versions is None:
+        return None
+    return '|'.join(f"{entity_type}:{versions[entity_type]['Version']}" for entity_type in sorted(versions))
+
+def resource_validators(conn, resource_key, entity_types):
+    """Builds {'etag': str, 'last_modified': datetime|None} for a page derived from the given entity types.
+       resource_key should include anything else that shapes the page (query string, page number).
+       Returns None when the response must not be cached (pending flash messages are rendered into it).
+    """
+    if session.get('_flashes'):
+        return None
+    versions = request_data_versions(conn, list(entity_types))
+    if versions is None:
+        return None
+    fingerprint = resource_key + '|' + data_version_token(conn, entity_types)
+    updated_times = [v['UpdatedAt'] for v in versions.values() if v['UpdatedAt'] is not None]
+    last_modified = None
+    if updated_times:
+        last_modified = datetime.datetime.fromtimestamp(int(max(updated_times)), tz=datetime.timezone.utc)
+    # Weak: the representation varies by content encoding, not by meaning
+    return {'etag': hashlib.sha1(fingerprint.encode('utf-8')).hexdigest(), 'last_modified': last_modified}
+
+def content_validators(resource_key, content):
+    """Builds validators from the data a page shows rather than from entity versions, for small pages whose
+       rows are cheap to read but rarely change. content must have a stable repr (rows, tuples of rows).
+       Returns None when the response must not be cached, like resource_validators.
+    """
+    if session.get('_flashes'):
+        return None
+    fingerprint = f"{resource_key}|{content!r}"
+    return {'etag': hashlib.sha1(fingerprint.encode('utf-8')).hexdigest(), 'last_modified': None}
+
+def not_modified_response(validators):
+    """Returns a 304 response if the client's cached copy is still current, otherwise None."""
+    if not validators:
+        return None
+    if request.if_none_match:
+        if not request.if_none_match.contains_weak(validators['etag']):
+            return None
+    elif request.if_modified_since and validators['last_modified']:
+        if validators['last_modified'] > request.if_modified_since:
+            return None
+    else:
+        return None
+    return apply_validators(make_response('', 304), validators)
+
+def apply_validators(response, validators):
+    """Adds ETag/Last-Modified/Cache-Control to a response; marks it uncacheable when validators is None."""
+    if not validators:
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    response.set_etag(validators['etag'], weak=True)
+    if validators.get('last_modified'):
+        response.last_modified = validators['last_modified']
+    response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    return response
@@ -0,0 +1,327 @@
+# offline_sales.py
+import datetime
+import decimal
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+from mysql.connector import Error
+
+import app_logging
+import database_operations
+
+logger = app_logging.get_logger(__name__)
+
+OFFLINE_SALES_DB = os.environ.get('OFFLINE_SALES_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'offline_sales.sqlite3'))
+OFFLINE_SYNC_INTERVAL_SECONDS = float(os.environ.get('OFFLINE_SYNC_INTERVAL_SECONDS', '15'))
+OFFLINE_SYNC_BATCH_SIZE = int(os.environ.get('OFFLINE_SYNC_BATCH_SIZE', '50'))
+POS_SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('POS_SNAPSHOT_INTERVAL_SECONDS', '300'))
+# Database errors are retried; after this many attempts the sale is reported as a conflict
+MAX_SYNC_ATTEMPTS = 5
+# A claim older than this belongs to a process that died mid-sync
+STALE_CLAIM_SECONDS = 600
+
+STATUS_PENDING = 'pending'
+STATUS_SYNCING = 'syncing'
+STATUS_SYNCED = 'synced'
+STATUS_CONFLICT = 'conflict'
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS queued_sales (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           queued_at TEXT NOT NULL,
+           items_json TEXT NOT NULL,
+           customer_id INTEGER,
+           payment_method TEXT,
+           status TEXT NOT NULL DEFAULT 'pending',
+           claimed_by TEXT,
+           claimed_at TEXT,
+           attempts INTEGER NOT NULL DEFAULT 0,
+           sale_id INTEGER,
+           error TEXT,
+           synced_at TEXT,
+           client_token TEXT
+       )""",
+    "CREATE INDEX IF NOT EXISTS idx_queued_sales_status ON queued_sales (status, id)",
+    """CREATE TABLE IF NOT EXISTS pos_snapshot (
+           name TEXT PRIMARY KEY,
+           payload TEXT NOT NULL,
+           saved_at TEXT NOT NULL
+       )""",
+]
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+def _connect():
+    """Opens the local journal. Each call gets its own connection; SQLite handles cross-process locking."""
+    journal = sqlite3.connect(OFFLINE_SALES_DB, timeout=30, isolation_level=None)
+    journal.row_factory = sqlite3.Row
+    journal.execute("PRAGMA journal_mode=WAL")
+    journal.execute("PRAGMA synchronous=FULL") # A queued sale must survive power loss
+    for ddl in _SCHEMA:
+        journal.execute(ddl)
+    if 'client_token' not in {row['name'] for row in journal.execute("PRAGMA table_info(queued_sales)")}:
+        journal.execute("ALTER TABLE queued_sales ADD COLUMN client_token TEXT") # Journals written before idempotency keys
+    return journal
+
+def enqueue_sale(items_sold, customer_id=None, payment_method="Unknown", client_token=None):
+    """Durably records a sale for later replay. Returns the local queue ID or None.
+       client_token: idempotency key of the checkout attempt. Pass the key an interrupted online attempt
+       used, so that replaying does not record the sale again if that attempt was committed after all.
+    """
+    try:
+        journal = _connect()
+        try:
+            cur = journal.execute(
+                "INSERT INTO queued_sales (queued_at, items_json, customer_id, payment_method, client_token) VALUES (?, ?, ?, ?, ?)",
+                (_now(), json.dumps(items_sold, default=_json_default), customer_id, payment_method,
+                 client_token or uuid.uuid4().hex))
+            return cur.lastrowid
+        finally:
+            journal.close()
+    except sqlite3.Error as e:
+        logger.error("Error enqueuing sale", exc_info=e)
+        return None
+
+def fetch_queue(statuses=None, limit=200):
+    """Fetches queued sales, newest first. Returns a list of dicts or an empty list."""
+    try:
+        journal = _connect()
+        try:
+            sql = "SELECT * FROM queued_sales"
+            params = []
+            if statuses:
+                sql += f" WHERE status IN ({', '.join('?' * len(statuses))})"
+                params.extend(statuses)
+            sql += " ORDER BY id DESC LIMIT ?"
+            params.append(limit)
+            rows = [dict(row) for row in journal.execute(sql, params)]
+            for row in rows:
+                row['items'] = json.loads(row['items_json'])
+            return rows
+        finally:
+            journal.close()
+    except sqlite3.Error as e:
+        logger.error("Error fetching queue", exc_info=e)
+        return []
+
+def queue_counts():
+    """Gets {status: count} for the queue. Returns an empty dict on failure."""
+    try:
+        journal = _connect()
+        try:
+            return {row['status']: row['n'] for row in journal.execute("SELECT status, COUNT(*) AS n FROM queued_sales GROUP BY status")}
+        finally:
+            journal.close()
+    except sqlite3.Error as e:
+        logger.error("Error counting queue", exc_info=e)
+        return {}
+
+def dismiss_conflict(queue_id):
+    """Removes a conflict entry once it has been handled manually. Returns True if removed."""
+    try:
+        journal = _connect()
+        try:
+            cur = journal.execute("DELETE FROM queued_sales WHERE id = ? AND status = ?", (queue_id, STATUS_CONFLICT))
+            return cur.rowcount > 0
+        finally:
+            journal.close()
+    except sqlite3.Error as e:
+        logger.error("Error dismissing entry %s", queue_id, exc_info=e)
+        return False
+
+def recover_interrupted():
+    """Entries left 'syncing' by a crashed process may or may not have been committed. Those with an
+       idempotency key are safe to replay; older entries without one need review.
+    """
+    stale_before = (datetime.datetime.now() - datetime.timedelta(seconds=STALE_CLAIM_SECONDS)).isoformat(timespec='seconds')
+    try:
+        journal = _connect()
+        try:
+            journal.execute("UPDATE queued_sales SET status = ? WHERE status = ? AND claimed_at < ? AND client_token IS NOT NULL",
+                            (STATUS_PENDING, STATUS_SYNCING, stale_before))
+            journal.execute("UPDATE queued_sales SET status = ?, error = ? WHERE status = ? AND claimed_at < ?",
+                            (STATUS_CONFLICT, "Sync was interrupted; check Sales History before re-entering this sale.",
+                             STATUS_SYNCING, stale_before))
+        finally:
+            journal.close()
+    except sqlite3.Error as e:
+        logger.error("Error recovering interrupted entries", exc_info=e)
+
+def _claim_batch(journal, batch_size):
+    claim_token = uuid.uuid4().hex
+    journal.execute("BEGIN IMMEDIATE") # Only one process claims at a time
+    try:
+        journal.execute("""UPDATE queued_sales SET status = ?, claimed_by = ?, claimed_at = ?
+                           WHERE id IN (SELECT id FROM queued_sales WHERE status = ? ORDER BY id LIMIT ?)""",
+                        (STATUS_SYNCING, claim_token, _now(), STATUS_PENDING, batch_size))
+        journal.execute("COMMIT")
+    except sqlite3.Error:
+        journal.execute("ROLLBACK")
+        raise
+    return [dict(row) for row in journal.execute(
+        "SELECT * FROM queued_sales WHERE claimed_by = ? AND status = ? ORDER BY id", (claim_token, STATUS_SYNCING))]
+
+def replay_pending(conn, batch_size=OFFLINE_SYNC_BATCH_SIZE):
+    """Replays queued sales into process_new_sale, oldest first, in batches. Each sale keeps the time it
+       was queued as its SaleDate, and its idempotency key makes a replay whose commit went unacknowledged
+       safe to repeat. Returns {'synced': int, 'conflicts': int, 'retry': int}.
+    """
+    summary = {'synced': 0, 'conflicts': 0, 'retry': 0}
+    if not conn or not conn.is_connected():
+        return summary
+    try:
+        journal = _connect()
+    except sqlite3.Error as e:
+        logger.error("Error opening journal", exc_info=e)
+        return summary
+    try:
+        while conn.is_connected():
+            batch = _claim_batch(journal, batch_size)
+            if not batch:
+                break
+            for entry in batch:
+                if not conn.is_connected():
+                    # Lost the database mid-batch: hand the rest back to the queue
+                    journal.execute("UPDATE queued_sales SET status = ? WHERE id = ?", (STATUS_PENDING, entry['id']))
+                    summary['retry'] += 1
+                    continue
+                errors = []
+                sale_id = database_operations.process_new_sale(
+                    conn, json.loads(entry['items_json']), customer_id=entry['customer_id'],
+                    payment_method=entry['payment_method'], errors=errors,
+                    client_token=entry['client_token'], sale_date=datetime.datetime.fromisoformat(entry['queued_at']))
+                if sale_id:
+                    journal.execute("UPDATE queued_sales SET status = ?, sale_id = ?, error = NULL, synced_at = ? WHERE id = ?",
+                                    (STATUS_SYNCED, sale_id, _now(), entry['id']))
+                    summary['synced'] += 1
+                    continue
+                error = errors[0] if errors else None
+                attempts = entry['attempts'] + 1
+                if isinstance(error, Error) and attempts < MAX_SYNC_ATTEMPTS:
+                    journal.execute("UPDATE queued_sales SET status = ?, attempts = ?, error = ? WHERE id = ?",
+                                    (STATUS_PENDING, attempts, str(error), entry['id']))
+                    summary['retry'] += 1
+                else:
+                    # e.g. stock sold out while the till was offline
+                    journal.execute("UPDATE queued_sales SET status = ?, attempts = ?, error = ? WHERE id = ?",
+                                    (STATUS_CONFLICT, attempts, str(error) if error else "Sale could not be processed.", entry['id']))
+                    summary['conflicts'] += 1
+            if summary['retry']:
+                break # Retry the rest on the next sync cycle
+    except sqlite3.Error as e:
+        logger.error("Error replaying queue", exc_info=e)
+    finally:
+        journal.close()
+    if summary['synced'] or summary['conflicts']:
+        logger.info("Offline sync: %s synced, %s conflict(s), %s to retry.",
+                    summary['synced'], summary['conflicts'], summary['retry'], extra={'fields': summary})
+    return summary
+
+# --- POS Snapshot (lets the till render while the database is down) ---
+def _json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def save_pos_snapshot(products, customers):
+    """Stores the product and customer lists the POS page needs. Returns True on success."""
+    try:
+        journal = _connect()
+        try:
+            now = _now()
+            journal.execute("INSERT OR REPLACE INTO pos_snapshot (name, payload, saved_at) VALUES ('products', ?, ?)",
+                            (json.dumps(products, default=_json_default), now))
+            journal.execute("INSERT OR REPLACE INTO pos_snapshot (name, payload, saved_at) VALUES ('customers', ?, ?)",
+                            (json.dumps(customers, default=_json_default), now))
+            return True
+        finally:
+            journal.close()
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        logger.error("Error saving POS snapshot", exc_info=e)
+        return False
+
+def load_pos_snapshot():
+    """Returns {'products': list, 'customers': list, 'saved_at': str|None} from the last snapshot."""
+    snapshot = {'products': [], 'customers': [], 'saved_at': None}
+    try:
+        journal = _connect()
+        try:
+            for row in journal.execute("SELECT name, payload, saved_at FROM pos_snapshot"):
+                snapshot[row['name']] = json.loads(row['payload'])
+                snapshot['saved_at'] = row['saved_at']
+        finally:
+            journal.close()
+    except (sqlite3.Error, ValueError) as e:
+        logger.error("Error loading POS snapshot", exc_info=e)
+    return snapshot
+
+def refresh_pos_snapshot(conn):
+    products = database_operations.fetch_products_for_sale(conn)
+    if products is None: # Keep the last good snapshot rather than saving an empty product list
+        return
+    customers = database_operations.fetch_customers(conn)
+    if products or customers:
+        save_pos_snapshot(products, customers)
+
+class OfflineSyncWorker:
+    """Background thread that replays queued sales once the database is reachable again
+       and keeps the POS snapshot fresh while it is."""
+
+    def __init__(self, interval=OFFLINE_SYNC_INTERVAL_SECONDS, connection_factory=None):
+        self.interval = interval
+        self.connection_factory = connection_factory or database_operations.create_connection
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+        self._last_snapshot = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='offline-sale-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+
+    def sync_soon(self):
+        self._wake_event.set()
+
+    def run_once(self):
+        recover_interrupted()
+        counts = queue_counts()
+        snapshot_due = datetime.datetime.now().timestamp() - self._last_snapshot >= POS_SNAPSHOT_INTERVAL_SECONDS
+        if not counts.get(STATUS_PENDING) and not snapshot_due:
+            return None
+        conn = self.connection_factory()
+        if conn is None:
+            return None
+        try:
+            summary = replay_pending(conn) if counts.get(STATUS_PENDING) else None
+            if snapshot_due and conn.is_connected():
+                refresh_pos_snapshot(conn)
+                self._last_snapshot = datetime.datetime.now().timestamp()
+            return summary
+        finally:
+            if conn.is_connected(): conn.close()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error in sync worker", exc_info=e)
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+sync_worker = OfflineSyncWorker()
@@ -0,0 +1,357 @@
+# profiling.py
+"""On-demand sampling profiler for selected requests.
+
+Disabled unless PROFILE_TOKEN is set. A request is profiled when it carries the header
+X-Profile-Token: <PROFILE_TOKEN>, or when it matches a rule such as "every 50th POST to new_sale_route".
+Rules come from PROFILE_RULES ("endpoint:METHOD:every[:count]", comma-separated) and can be changed
+at runtime through /admin/profiling; they are stored in PROFILE_DIR/rules.json, which every worker
+re-reads when it changes, so no restart is needed.
+
+While a request is profiled, a sampler thread records its stack every PROFILE_INTERVAL_MS
+(wall-clock, so time waiting on the database counts too). Stacks are written to PROFILE_DIR in
+collapsed format ("frame;frame;frame count" per line), which flamegraph.pl and speedscope read
+directly. Frames are labelled module:function, and template code as template:<name>.
+
+Aggregate captured profiles with:
+    python profiling.py report [files or directories...] [--top 25] [--merge all.folded]
+"""
+import argparse
+import collections
+import datetime
+import glob
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import app_logging
+
+logger = app_logging.get_logger(__name__)
+
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '200'))
+PROFILE_RULES = os.environ.get('PROFILE_RULES', '')
+PROFILE_HEADER = 'X-Profile-Token'
+_UNSAFE_NAME_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+# Workers check rules.json for changes at most this often
+RULES_CHECK_SECONDS = 1.0
+
+CATEGORY_DATABASE = 'database'
+CATEGORY_TEMPLATE = 'template'
+CATEGORY_JSON = 'json'
+CATEGORY_OTHER = 'python'
+
+# --- Stack labelling ---
+def frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.endswith('.html'):
+        return f"template:{os.path.basename(filename)}"
+    module = frame.f_globals.get('__name__') or os.path.splitext(os.path.basename(filename))[0]
+    return f"{module}:{code.co_name}"
+
+def collapse_stack(frame):
+    """Returns the stack above frame as 'outermost;...;innermost', skipping logging timing wrappers."""
+    labels = []
+    while frame is not None:
+        if not (frame.f_code.co_name == 'timed' and frame.f_globals.get('__name__') == 'app_logging'):
+            labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+def label_category(label):
+    module = label.split(':', 1)[0]
+    if module == 'template' or module.startswith('jinja2'):
+        return CATEGORY_TEMPLATE
+    if module == 'database_operations' or module.startswith('mysql.'):
+        return CATEGORY_DATABASE
+    if module.startswith('json') or module == 'flask.json' or module.startswith('flask.json.'):
+        return CATEGORY_JSON
+    return CATEGORY_OTHER
+
+def stack_category(stack):
+    """Category of a sample: the first of database, template or JSON found from the innermost frame outwards."""
+    for label in reversed(stack.split(';')):
+        category = label_category(label)
+        if category != CATEGORY_OTHER:
+            return category
+    return CATEGORY_OTHER
+
+def summarize(stacks, top=25):
+    """Summary of a Counter of collapsed stacks: total samples, share per category, time per
+       database_operations function (outermost call) and the frames with the most self time."""
+    total = sum(stacks.values())
+    categories = collections.Counter()
+    database_functions = collections.Counter()
+    self_time = collections.Counter()
+    for stack, count in stacks.items():
+        categories[stack_category(stack)] += count
+        labels = stack.split(';')
+        self_time[labels[-1]] += count
+        outermost_db = next((label for label in labels if label.startswith('database_operations:')), None)
+        if outermost_db:
+            database_functions[outermost_db.split(':', 1)[1]] += count
+    share = lambda count: round(100.0 * count / total, 1) if total else 0.0
+    return {
+        'samples': total,
+        'categories': {name: {'samples': count, 'percent': share(count)} for name, count in categories.most_common()},
+        'database_functions': [{'function': name, 'samples': count, 'percent': share(count)}
+                               for name, count in database_functions.most_common(top)],
+        'top_self': [{'frame': label, 'samples': count, 'percent': share(count)} for label, count in self_time.most_common(top)],
+    }
+
+# --- Sampling ---
+class StackSampler:
+    """One background thread that samples the stacks of every thread currently being profiled."""
+
+    def __init__(self, interval=PROFILE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._targets = {} # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def begin(self, thread_id):
+        stacks = collections.Counter()
+        with self._lock:
+            self._targets[thread_id] = stacks
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+        self._active.set()
+        return stacks
+
+    def end(self, thread_id):
+        with self._lock:
+            stacks = self._targets.pop(thread_id, None)
+            if not self._targets:
+                self._active.clear()
+        return stacks
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+# --- Rules ---
+def parse_rules(setting):
+    """Parses "endpoint:METHOD:every[:count]" entries. Returns a list of rule dicts."""
+    rules = []
+    for entry in filter(None, (part.strip() for part in setting.split(','))):
+        parts = entry.split(':')
+        try:
+            rules.append({'endpoint': parts[0], 'method': parts[1].upper(), 'every': max(int(parts[2]), 1),
+                          'remaining': int(parts[3]) if len(parts) > 3 else None})
+        except (IndexError, ValueError):
+            logger.warning("Ignoring invalid profiling rule '%s'.", entry)
+    return rules
+
+class RequestProfiler:
+    """Decides which requests to profile, runs the sampler around them and writes the results."""
+
+    def __init__(self, token=PROFILE_TOKEN, profile_dir=PROFILE_DIR, sampler=None):
+        self.token = token
+        self.profile_dir = profile_dir
+        self.sampler = sampler or StackSampler()
+        self.rules = parse_rules(PROFILE_RULES)
+        self._seen = collections.Counter()
+        self._captured = collections.Counter() # Captures per rule in this worker, checked against 'remaining'
+        self._rules_mtime = None
+        self._rules_checked = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.token)
+
+    def token_matches(self, supplied):
+        # Compared as bytes: compare_digest rejects str with non-ASCII characters, which anyone can send in a header
+        return self.enabled and bool(supplied) and hmac.compare_digest(supplied.encode('utf-8'), self.token.encode('utf-8'))
+
+    # Rules are shared between workers through a file
+    def _rules_path(self):
+        return os.path.join(self.profile_dir, 'rules.json')
+
+    def _reload_rules(self):
+        now = time.monotonic()
+        if now - self._rules_checked < RULES_CHECK_SECONDS:
+            return
+        self._rules_checked = now
+        try:
+            mtime = os.path.getmtime(self._rules_path())
+        except OSError:
+            return
+        if mtime == self._rules_mtime:
+            return
+        try:
+            with open(self._rules_path(), encoding='utf-8') as f:
+                rules = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read profiling rules", exc_info=e)
+            return
+        with self._lock:
+            self.rules, self._rules_mtime = rules, mtime
+            self._seen.clear()
+            self._captured.clear()
+
+    def set_rules(self, rules):
+        """Replaces the rules for every worker. Returns True on success."""
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            temporary = self._rules_path() + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(rules, f)
+            os.replace(temporary, self._rules_path())
+        except OSError as e:
+            logger.error("Could not save profiling rules", exc_info=e)
+            return False
+        self._rules_checked = 0.0
+        self._reload_rules()
+        return True
+
+    def should_profile(self, endpoint, method, supplied_token=None):
+        if not self.enabled:
+            return False
+        if supplied_token is not None:
+            return self.token_matches(supplied_token)
+        self._reload_rules()
+        with self._lock:
+            for index, rule in enumerate(self.rules):
+                if rule['endpoint'] != endpoint or rule['method'] != method:
+                    continue
+                if rule.get('remaining') is not None and self._captured[index] >= rule['remaining']:
+                    continue
+                self._seen[index] += 1
+                if self._seen[index] % rule['every'] == 0:
+                    self._captured[index] += 1
+                    return True
+        return False
+
+    def begin(self):
+        return self.sampler.begin(threading.get_ident())
+
+    def finish(self, name):
+        """Stops sampling the current thread and writes its stacks. Returns the file path, or None."""
+        stacks = self.sampler.end(threading.get_ident())
+        if not stacks:
+            return None
+        # The name carries the client's X-Request-ID, so only a safe subset of it may reach the path
+        name = _UNSAFE_NAME_CHARS.sub('_', name)[:128]
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{datetime.datetime.now():%Y%m%d-%H%M%S-%f}_{name}.folded")
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            self._prune()
+        except OSError as e:
+            logger.error("Could not write profile", exc_info=e)
+            return None
+        logger.info("Profile captured: %s (%s samples)", path, sum(stacks.values()),
+                    extra={'event': 'profile.captured', 'fields': {'profile': path}})
+        return path
+
+    def _prune(self):
+        files = sorted(glob.glob(os.path.join(self.profile_dir, '*.folded')))
+        for path in files[:max(len(files) - PROFILE_MAX_FILES, 0)]:
+            os.remove(path)
+
+    def captured_files(self, limit=50):
+        return sorted(glob.glob(os.path.join(self.profile_dir, '*.folded')), reverse=True)[:limit]
+
+    def status(self):
+        self._reload_rules()
+        return {
+            'enabled': self.enabled,
+            'interval_ms': self.sampler.interval * 1000,
+            'rules': self.rules,
+            'profile_dir': os.path.abspath(self.profile_dir),
+            'recent_profiles': [os.path.basename(path) for path in self.captured_files(20)],
+        }
+
+    # --- Flask integration ---
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        from flask import g, request
+
+        @app.before_request
+        def start_profile():
+            if self.should_profile(request.endpoint, request.method, request.headers.get(PROFILE_HEADER)):
+                g.profile_thread = threading.get_ident()
+                self.begin()
+
+        @app.teardown_request
+        def finish_profile(error):
+            # Runs after streamed responses have finished rendering
+            if g.pop('profile_thread', None) is not None:
+                name = f"{request.endpoint or 'unknown'}_{request.method}_{g.get('request_id', 'request')}"
+                self.finish(name)
+
+profiler = RequestProfiler()
+
+# --- Command line ---
+def load_folded(paths):
+    """Reads collapsed-stack files (or every *.folded file in the given directories). Returns (Counter, files read)."""
+    stacks, files = collections.Counter(), []
+    for path in paths:
+        candidates = sorted(glob.glob(os.path.join(path, '*.folded'))) if os.path.isdir(path) else [path]
+        for candidate in candidates:
+            with open(candidate, encoding='utf-8') as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack and count.isdigit():
+                        stacks[stack] += int(count)
+            files.append(candidate)
+    return stacks, files
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate captured request profiles.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    report = commands.add_parser('report', help="Summarize collapsed-stack files.")
+    report.add_argument('paths', nargs='*', default=[PROFILE_DIR], help=f"Files or directories (default {PROFILE_DIR}).")
+    report.add_argument('--top', type=int, default=25)
+    report.add_argument('--merge', help="Also write all stacks combined into this .folded file (for flamegraph.pl or speedscope).")
+    report.add_argument('--json', action='store_true', help="Print the summary as JSON.")
+    args = parser.parse_args(argv)
+
+    stacks, files = load_folded(args.paths)
+    if not stacks:
+        print("No samples found.")
+        return 1
+    summary = summarize(stacks, args.top)
+    if args.merge:
+        with open(args.merge, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+    if args.json:
+        print(json.dumps(dict(summary, files=len(files)), indent=2))
+        return 0
+    print(f"{len(files)} profile(s), {summary['samples']} samples")
+    print("\nBy category:")
+    for name, entry in summary['categories'].items():
+        print(f"  {name:<10} {entry['percent']:>5}%  ({entry['samples']})")
+    print("\ndatabase_operations functions (inclusive):")
+    for entry in summary['database_functions']:
+        print(f"  {entry['percent']:>5}%  {entry['function']}")
+    print("\nTop frames by self time:")
+    for entry in summary['top_self']:
+        print(f"  {entry['percent']:>5}%  {entry['frame']}")
+    if args.merge:
+        print(f"\nMerged stacks written to {args.merge}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# query_cache.py
+"""Result cache for the product listing and search queries behind /products.
+
+Most catalog traffic asks for the first few pages and a handful of common search terms, and every
+uncached request runs both the COUNT and the page query. Results are kept per worker in a bounded
+LRU keyed by (normalized search term, page, page size), each entry for at most QUERY_CACHE_TTL_SECONDS.
+
+Entries are invalidated from the change feed: a stock change (a sale or stock count) drops only the
+cached pages showing that product, and any other product or category write drops everything, since it
+can move products between pages. The TTL bounds what the feed cannot see, such as a lagging replica.
+Identical requests that miss at the same time share one query: the first runs it and the others wait.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import change_feed
+import database_operations
+
+# 0 disables the cache
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', '512'))
+QUERY_CACHE_TTL_SECONDS = float(os.environ.get('QUERY_CACHE_TTL_SECONDS', '30'))
+# Deeper pages are rarely requested twice; caching them would only evict the popular ones
+QUERY_CACHE_MAX_PAGE = int(os.environ.get('QUERY_CACHE_MAX_PAGE', '5'))
+# A request waiting for an identical query gives up and runs its own after this long
+COALESCE_WAIT_SECONDS = 10.0
+
+class _Flight:
+    """A query in progress that identical requests wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.succeeded = False
+
+class QueryCache:
+    """Size-bounded LRU of query results with a per-entry TTL, tag-based invalidation and request coalescing.
+       Cached values are shared between requests and must not be modified.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, ttl=QUERY_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (value, expires_at, tags)
+        self._flights = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation; a result loaded across one is returned but not stored
+        self._generation = 0
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Returns the cached value for key, or calls loader() once for all concurrent callers.
+           loader returns (value, tags): tags is a collection of invalidation tags, or None to not cache value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry[0]
+                del self._entries[key]
+                self.stats['expired'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                generation = self._generation
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            if flight.done.wait(COALESCE_WAIT_SECONDS) and flight.succeeded:
+                return flight.value
+            return loader()[0] # The first request failed or is stuck; do not depend on it
+        try:
+            value, tags = loader()
+            flight.value, flight.succeeded = value, True
+        finally:
+            flight.done.set()
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+        if tags is not None:
+            self._store(key, value, tags, generation, self.ttl if ttl is None else ttl)
+        return value
+
+    def _store(self, key, value, tags, generation, ttl):
+        with self._lock:
+            if generation != self._generation:
+                return # Invalidated while loading; the value may already be stale
+            self._entries[key] = (value, time.monotonic() + ttl, frozenset(tags))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, tag=None):
+        """Drops the entries carrying tag, or all entries when tag is None."""
+        with self._lock:
+            self._generation += 1
+            self._flights.clear() # Later requests must not join a query started before the change
+            if tag is None:
+                self._entries.clear()
+            else:
+                for key in [key for key, entry in self._entries.items() if tag in entry[2]]:
+                    del self._entries[key]
+            self.stats['invalidations'] += 1
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries), in_flight=len(self._flights),
+                         max_entries=self.max_entries, ttl_seconds=self.ttl)
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+product_queries = QueryCache()
+
+def normalize_search_term(search_term):
+    """Search terms that match the same products share a cache entry (the LIKE comparison is case-insensitive)."""
+    search_term = (search_term or '').strip().lower()
+    return search_term or None
+
+def fetch_products_page(conn, search_term=None, page=1, items_per_page=10):
+    """Cached database_operations.fetch_products_with_category_names. Returns {'products': list, 'total_count': int}."""
+    search_term = normalize_search_term(search_term)
+    if product_queries.max_entries <= 0 or page > QUERY_CACHE_MAX_PAGE:
+        return database_operations.fetch_products_with_category_names(conn, search_term, page, items_per_page)
+
+    def load():
+        errors = []
+        result = database_operations.fetch_products_with_category_names(conn, search_term, page, items_per_page, errors=errors)
+        if errors:
+            return result, None # A failed query must not be served from the cache
+        return result, [product['ProductID'] for product in result['products']]
+
+    return product_queries.get_or_load(('products', search_term, page, items_per_page), load)
+
+def _on_product_change(entity_type, entity_id, change_type):
+    if change_type == 'stock':
+        product_queries.invalidate(entity_id) # Only pages showing the product display its stock
+    else:
+        product_queries.invalidate()
+
+change_feed.subscriber.subscribe(database_operations.ENTITY_PRODUCT, _on_product_change)
+change_feed.subscriber.subscribe(database_operations.ENTITY_CATEGORY, lambda *event: product_queries.invalidate())
+change_feed.subscriber.on_resync(product_queries.invalidate)
@@ -0,0 +1,226 @@
+# reconcile.py
+"""Integrity and reconciliation checker for the sales and inventory history.
+
+Checks that every sale's TotalAmount equals the sum of its lines, that each line's TotalPrice is
+Quantity * UnitPrice, that lines reference an existing sale and product, that inventory logs reference
+an existing product, and that the stock removed by sales (SaleDetails) matches the 'Sale' rows in
+InventoryLogs for every product. Hot and archive tables are both covered.
+
+The history is split into primary-key ranges of RECONCILE_CHUNK_SIZE IDs, checked by RECONCILE_WORKERS
+processes, each range in its own consistent-snapshot read (see database_operations). Workers read from
+a replica when one is configured and rest between ranges so that they are busy at most
+RECONCILE_DUTY_CYCLE of the time. Finished ranges are saved to a checkpoint file, so an interrupted
+run continues where it stopped:
+    python reconcile.py [--workers 4] [--chunk-size 50000] [--restart] [--report report.json]
+Exits with 0 when everything reconciles, 2 when discrepancies were found and 1 on failure.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app_logging
+import database_operations
+
+logger = app_logging.get_logger(__name__)
+
+RECONCILE_WORKERS = int(os.environ.get('RECONCILE_WORKERS', '4'))
+RECONCILE_CHUNK_SIZE = int(os.environ.get('RECONCILE_CHUNK_SIZE', '50000'))
+# Fraction of the time each worker spends querying; 0.5 rests as long as the last range took
+RECONCILE_DUTY_CYCLE = float(os.environ.get('RECONCILE_DUTY_CYCLE', '0.5'))
+# Sales younger than this may still be committing and are left for the next run
+RECONCILE_SETTLE_SECONDS = int(os.environ.get('RECONCILE_SETTLE_SECONDS', '300'))
+# Discrepancies listed per range and check; counts beyond it are flagged as truncated
+RECONCILE_DETAIL_LIMIT = int(os.environ.get('RECONCILE_DETAIL_LIMIT', '100'))
+RECONCILE_CHECKPOINT = os.environ.get('RECONCILE_CHECKPOINT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reconcile_checkpoint.json'))
+# The checkpoint is rewritten at most this often (and always when the run ends)
+CHECKPOINT_INTERVAL_SECONDS = 5
+
+SALES, LOGS = 'sales', 'logs'
+DISCREPANCY_LISTS = ('total_mismatches', 'line_mismatches', 'orphan_lines', 'orphan_logs')
+
+def plan_chunks(bounds, chunk_size):
+    """Splits the bounds into (kind, first_id, last_id) ranges."""
+    chunks = []
+    for kind, low, high in ((SALES, bounds['min_sale_id'], bounds['max_sale_id']),
+                            (LOGS, bounds['min_log_id'], bounds['max_log_id'])):
+        if low is None or high is None:
+            continue
+        for first in range(low, high + 1, chunk_size):
+            chunks.append((kind, first, min(first + chunk_size - 1, high)))
+    return chunks
+
+def chunk_key(kind, first_id, last_id):
+    return f"{kind}:{first_id}-{last_id}"
+
+def check_chunk(kind, first_id, last_id, max_sale_id, store_id, duty_cycle, detail_limit):
+    """Runs in a worker process: checks one range, then rests per the duty cycle. Returns the result dict or None."""
+    started = time.perf_counter()
+    conn = database_operations.create_read_connection(store_id)
+    if conn is None:
+        return None
+    try:
+        if kind == SALES:
+            result = database_operations.reconcile_sales_range(conn, first_id, last_id, detail_limit)
+        else:
+            result = database_operations.reconcile_inventory_logs_range(conn, first_id, last_id, max_sale_id, detail_limit)
+    finally:
+        if conn.is_connected(): conn.close()
+    if 0 < duty_cycle < 1:
+        time.sleep((time.perf_counter() - started) * (1 - duty_cycle) / duty_cycle)
+    return result
+
+def new_checkpoint(bounds, chunk_size, store_id):
+    return {'store_id': store_id, 'database': database_operations.STORE_CONFIGS[store_id]['database'],
+            'started_at': datetime.datetime.now().isoformat(timespec='seconds'), 'bounds': bounds,
+            'chunk_size': chunk_size, 'done': [], 'sold': {}, 'logged': {}, 'truncated': [],
+            **{name: [] for name in DISCREPANCY_LISTS}}
+
+def load_checkpoint(path, store_id):
+    """Returns the saved run for store_id, or None if there is none (or it belongs to another store)."""
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable checkpoint %s: %s", path, e)
+        return None
+    if checkpoint.get('store_id') != store_id or checkpoint.get('database') != database_operations.STORE_CONFIGS[store_id]['database']:
+        return None
+    return checkpoint
+
+def save_checkpoint(path, checkpoint):
+    """Writes the checkpoint atomically, so an interrupted write never loses the previous one."""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump(checkpoint, f, default=str)
+    os.replace(temporary_path, path)
+
+def merge_result(checkpoint, kind, first_id, last_id, result):
+    totals = checkpoint['sold' if kind == SALES else 'logged']
+    for product_id, quantity in result['sold' if kind == SALES else 'logged'].items():
+        totals[str(product_id)] = totals.get(str(product_id), 0) + quantity # JSON object keys are strings
+    for name in DISCREPANCY_LISTS:
+        checkpoint[name].extend(result.get(name, ()))
+    checkpoint['truncated'].extend(f"{name} in {chunk_key(kind, first_id, last_id)}" for name in result['truncated'])
+    checkpoint['done'].append(chunk_key(kind, first_id, last_id))
+
+def stock_mismatches(checkpoint):
+    """Products whose quantity sold (SaleDetails) differs from the quantity removed by their 'Sale' inventory logs."""
+    sold, logged = checkpoint['sold'], checkpoint['logged']
+    return [{'ProductID': int(product_id), 'Sold': sold.get(product_id, 0), 'Logged': logged.get(product_id, 0)}
+            for product_id in sorted(set(sold) | set(logged), key=int)
+            if sold.get(product_id, 0) != logged.get(product_id, 0)]
+
+def build_report(checkpoint):
+    report = {name: checkpoint[name] for name in DISCREPANCY_LISTS}
+    report['stock_mismatches'] = stock_mismatches(checkpoint)
+    report.update(store_id=checkpoint['store_id'], started_at=checkpoint['started_at'], bounds=checkpoint['bounds'],
+                  truncated=checkpoint['truncated'])
+    return report
+
+def run(workers=RECONCILE_WORKERS, chunk_size=RECONCILE_CHUNK_SIZE, duty_cycle=RECONCILE_DUTY_CYCLE,
+        checkpoint_path=RECONCILE_CHECKPOINT, restart=False, store_id=None, progress=None):
+    """Reconciles the history of one store (STORE_ID by default), resuming from checkpoint_path unless restart.
+       progress: optional callback(done, total) called after each range.
+       Returns the report dict, or None if the run could not finish (finished ranges stay in the checkpoint).
+    """
+    store_id = database_operations.STORE_ID if store_id is None else store_id
+    checkpoint = None if restart else load_checkpoint(checkpoint_path, store_id)
+    if checkpoint is None:
+        conn = database_operations.create_read_connection(store_id)
+        if conn is None:
+            return None
+        try:
+            bounds = database_operations.get_reconciliation_bounds(conn, RECONCILE_SETTLE_SECONDS)
+        finally:
+            if conn.is_connected(): conn.close()
+        if bounds is None:
+            return None
+        checkpoint = new_checkpoint(bounds, chunk_size, store_id)
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    done = set(checkpoint['done'])
+    chunks = [chunk for chunk in plan_chunks(checkpoint['bounds'], checkpoint['chunk_size']) if chunk_key(*chunk) not in done]
+    total = len(done) + len(chunks)
+    max_sale_id = checkpoint['bounds']['max_sale_id'] or 0
+    failed = 0
+    last_saved = time.monotonic()
+    # Spawned workers start with fresh connection pools instead of inheriting the parent's sockets and threads
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(check_chunk, *chunk, max_sale_id, store_id, duty_cycle, RECONCILE_DETAIL_LIMIT): chunk
+                   for chunk in chunks}
+        try:
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error("Error checking %s", chunk_key(*chunk), exc_info=e)
+                    result = None
+                if result is None:
+                    failed += 1
+                    continue
+                merge_result(checkpoint, *chunk, result)
+                if progress: progress(len(checkpoint['done']), total)
+                if time.monotonic() - last_saved >= CHECKPOINT_INTERVAL_SECONDS:
+                    save_checkpoint(checkpoint_path, checkpoint)
+                    last_saved = time.monotonic()
+        finally:
+            for future in futures:
+                future.cancel()
+            save_checkpoint(checkpoint_path, checkpoint)
+    if failed:
+        logger.error("%s of %s ranges could not be checked; re-run to retry them.", failed, total)
+        return None
+    return build_report(checkpoint)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the sales and inventory history for inconsistencies.")
+    parser.add_argument('--workers', type=int, default=RECONCILE_WORKERS, help="Worker processes.")
+    parser.add_argument('--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE, help="IDs per range (ignored when resuming).")
+    parser.add_argument('--duty-cycle', type=float, default=RECONCILE_DUTY_CYCLE, help="Fraction of time each worker may spend querying.")
+    parser.add_argument('--store', type=int, default=None, help="Store to check (default: STORE_ID).")
+    parser.add_argument('--checkpoint', default=RECONCILE_CHECKPOINT)
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start a new run.")
+    parser.add_argument('--report', help="Write the full report as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    report = run(workers=args.workers, chunk_size=args.chunk_size, duty_cycle=args.duty_cycle,
+                 checkpoint_path=args.checkpoint, restart=args.restart, store_id=args.store,
+                 progress=lambda done, total: print(f"\r  {done}/{total} ranges checked", end='', flush=True))
+    print()
+    if report is None:
+        print("Reconciliation did not finish; see the log. Re-run to continue from the checkpoint.")
+        return 1
+    bounds = report['bounds']
+    print(f"Checked sales {bounds['min_sale_id']}-{bounds['max_sale_id']} and inventory logs "
+          f"{bounds['min_log_id']}-{bounds['max_log_id']} in {time.perf_counter() - started:.1f}s.")
+    labels = {'total_mismatches': "Sales whose total differs from their lines",
+              'line_mismatches': "Sale lines whose total differs from quantity x price",
+              'orphan_lines': "Sale lines without a sale or product",
+              'orphan_logs': "Inventory logs without a product",
+              'stock_mismatches': "Products whose sold quantity differs from their sale inventory logs"}
+    found = 0
+    for name, label in labels.items():
+        found += len(report[name])
+        print(f"  {label}: {len(report[name])}")
+        for row in report[name][:10]:
+            print(f"    {json.dumps(row, default=str)}")
+    for note in report['truncated']:
+        print(f"  More {note} than listed (RECONCILE_DETAIL_LIMIT).")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, default=str, indent=2)
+        print(f"Report written to {args.report}.")
+    os.remove(args.checkpoint) # The run is complete; the next one starts fresh
+    return 2 if found else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
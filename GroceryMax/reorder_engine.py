@@ -0,0 +1,260 @@
+# reorder_engine.py
+import datetime
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+import app_logging
+import change_feed
+import database_operations
+import sales_analytics
+
+logger = app_logging.get_logger(__name__)
+
+REORDER_REFRESH_SECONDS = float(os.environ.get('REORDER_REFRESH_SECONDS', '60'))
+REORDER_LOOKBACK_DAYS = int(os.environ.get('REORDER_LOOKBACK_DAYS', '28'))
+# Recent days weigh more: a day this many days ago counts half as much as today
+REORDER_HALF_LIFE_DAYS = float(os.environ.get('REORDER_HALF_LIFE_DAYS', '7'))
+REORDER_LEAD_TIME_DAYS = float(os.environ.get('REORDER_LEAD_TIME_DAYS', '7'))
+# Suggested orders cover the lead time plus this many days until the next review
+REORDER_REVIEW_DAYS = float(os.environ.get('REORDER_REVIEW_DAYS', '7'))
+# Safety stock in standard deviations of daily demand (1.65 ~ 95% service level)
+REORDER_SAFETY_Z = float(os.environ.get('REORDER_SAFETY_Z', '1.65'))
+# Stock levels are kept current from the change feed; a full reload catches anything it missed
+REORDER_FULL_RELOAD_SECONDS = 3600.0
+
+PRIORITY_CRITICAL = 'critical' # Runs out before an order placed now would arrive
+PRIORITY_REORDER = 'reorder'   # At or below the reorder point
+
+def _grown(array, size, fill):
+    if len(array) >= size:
+        return array
+    return np.concatenate([array, np.full(size - len(array), fill, dtype=array.dtype)])
+
+class ReorderEngine:
+    """Forecasts days until stockout for every product and keeps a prioritized reorder list.
+
+    Demand is the exponentially weighted daily quantity from the sales analytics aggregates plus
+    non-sale stock removals from InventoryLogs, computed for all products at once as sparse
+    matrix-vector products. Stock levels are held in arrays indexed by ProductID and reloaded
+    only for products the change feed reports as changed. Reports read the last computed result.
+    Stock is read from the primary: a lagging replica would return the old level for a product whose
+    change notice has already been consumed. Demand history may come from a replica.
+    """
+
+    def __init__(self, analytics=None, stock_connection_factory=None):
+        self.analytics = analytics or sales_analytics.analytics
+        self.stock_connection_factory = stock_connection_factory or database_operations.create_connection
+        self._stock = np.zeros(0, dtype=np.int64)
+        self._price = np.zeros(0, dtype=np.float64)
+        self._exists = np.zeros(0, dtype=bool)
+        self._labels = {} # ProductID -> (ProductName, CategoryName)
+        self._dirty = set()
+        self._full_reload = True
+        self._last_full_reload = 0.0
+        self._dirty_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._result = {'suggestions': [], 'computed_at': None, 'compute_ms': None, 'products': 0}
+
+    # --- Change feed hooks ---
+    def on_product_change(self, entity_type, entity_id, change_type):
+        with self._dirty_lock:
+            self._dirty.add(entity_id)
+
+    def on_resync(self, *args):
+        with self._dirty_lock:
+            self._full_reload = True
+
+    def _take_dirty(self):
+        with self._dirty_lock:
+            full = self._full_reload or time.monotonic() - self._last_full_reload > REORDER_FULL_RELOAD_SECONDS
+            dirty = self._dirty
+            self._dirty, self._full_reload = set(), False
+            return full, dirty
+
+    def _requeue(self, full, dirty):
+        with self._dirty_lock:
+            self._full_reload = self._full_reload or full
+            self._dirty |= dirty
+
+    # --- Loading ---
+    def _load_stock(self):
+        full, dirty = self._take_dirty()
+        rows = None
+        conn = self.stock_connection_factory()
+        if conn is not None:
+            try:
+                rows = database_operations.fetch_stock_levels(conn, None if full else sorted(dirty))
+            finally:
+                if conn.is_connected(): conn.close()
+        if rows is None:
+            self._requeue(full, dirty)
+            return False
+        if full:
+            self._exists[:] = False
+            self._labels = {}
+            self._last_full_reload = time.monotonic()
+        else:
+            for product_id in dirty:
+                if product_id < len(self._exists):
+                    self._exists[product_id] = False # Deleted unless the reload returns it
+                self._labels.pop(product_id, None)
+        if rows:
+            size = max(row[0] for row in rows) + 1
+            self._stock = _grown(self._stock, size, 0)
+            self._price = _grown(self._price, size, 0.0)
+            self._exists = _grown(self._exists, size, False)
+            ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            self._stock[ids] = np.fromiter((row[4] or 0 for row in rows), dtype=np.int64, count=len(rows))
+            self._price[ids] = np.fromiter((float(row[3] or 0) for row in rows), dtype=np.float64, count=len(rows))
+            self._exists[ids] = True
+            self._labels.update((row[0], (row[1], row[2])) for row in rows)
+        return True
+
+    def _daily_demand(self, conn, first_day, last_day):
+        demand = self.analytics.daily_quantities(first_day, last_day)
+        outflows = database_operations.fetch_inventory_outflows(conn, sales_analytics.day_date(first_day))
+        if outflows:
+            days = np.fromiter((row[1] - first_day for row in outflows), dtype=np.int64, count=len(outflows))
+            product_ids = np.fromiter((row[0] for row in outflows), dtype=np.int64, count=len(outflows))
+            quantities = np.fromiter((int(row[2]) for row in outflows), dtype=np.int64, count=len(outflows))
+            in_window = (days >= 0) & (days < demand.shape[0])
+            n_products = max(demand.shape[1], int(product_ids.max()) + 1)
+            demand = sparse.csr_matrix((demand.data, demand.indices, demand.indptr), shape=(demand.shape[0], n_products))
+            demand = demand + sparse.csr_matrix(
+                (quantities[in_window], (days[in_window], product_ids[in_window])), shape=demand.shape)
+        return demand
+
+    # --- Forecasting ---
+    def refresh(self, conn):
+        """Reloads changed stock levels and recomputes all forecasts. Returns the number of suggestions, or None on error."""
+        with self._refresh_lock:
+            started = time.perf_counter()
+            conn.commit() # Start a fresh snapshot so recent stock changes are visible
+            if not self._load_stock():
+                return None
+
+            last_day = sales_analytics.day_number(datetime.date.today())
+            first_day = last_day - REORDER_LOOKBACK_DAYS + 1
+            demand = self._daily_demand(conn, first_day, last_day)
+
+            ages = np.arange(REORDER_LOOKBACK_DAYS - 1, -1, -1, dtype=np.float64) # Row 0 is the oldest day
+            weights = 0.5 ** (ages / REORDER_HALF_LIFE_DAYS)
+            weights /= weights.sum()
+            n = max(len(self._stock), demand.shape[1])
+            velocity = _grown(demand.T @ weights, n, 0.0)
+            second_moment = _grown(demand.multiply(demand).T @ weights, n, 0.0)
+            sigma = np.sqrt(np.maximum(second_moment - velocity ** 2, 0.0))
+            stock = _grown(self._stock, n, 0).astype(np.float64)
+            exists = _grown(self._exists, n, False)
+
+            lead, cover = REORDER_LEAD_TIME_DAYS, REORDER_LEAD_TIME_DAYS + REORDER_REVIEW_DAYS
+            reorder_point = velocity * lead + REORDER_SAFETY_Z * sigma * math.sqrt(lead)
+            target = velocity * cover + REORDER_SAFETY_Z * sigma * math.sqrt(cover)
+            days_left = np.full(n, np.inf)
+            np.divide(np.maximum(stock, 0), velocity, out=days_left, where=velocity > 0)
+
+            candidates = np.flatnonzero(exists & (velocity > 0) & (stock <= reorder_point))
+            candidates = candidates[np.lexsort((-velocity[candidates], days_left[candidates]))]
+            suggested = np.maximum(np.ceil(target[candidates] - stock[candidates]), 1).astype(np.int64)
+
+            suggestions = []
+            for product_id, quantity in zip(candidates.tolist(), suggested.tolist()):
+                name, category = self._labels.get(product_id, (f"Product #{product_id}", None))
+                suggestions.append({
+                    'ProductID': product_id,
+                    'ProductName': name,
+                    'CategoryName': category,
+                    'Price': float(self._price[product_id]),
+                    'StockQuantity': int(stock[product_id]),
+                    'DailyVelocity': round(float(velocity[product_id]), 3),
+                    'DaysUntilStockout': round(float(days_left[product_id]), 1),
+                    'ReorderPoint': int(math.ceil(reorder_point[product_id])),
+                    'SuggestedQuantity': quantity,
+                    'Priority': PRIORITY_CRITICAL if days_left[product_id] <= lead else PRIORITY_REORDER,
+                })
+            self._result = {
+                'suggestions': suggestions,
+                'computed_at': datetime.datetime.now(),
+                'compute_ms': round((time.perf_counter() - started) * 1000, 3),
+                'products': int(np.count_nonzero(exists)),
+            }
+            return len(suggestions)
+
+    # --- Queries ---
+    def suggestions(self, limit=None, priority=None):
+        """Reorder suggestions, most urgent first. Returns a list of dicts (see refresh)."""
+        rows = self._result['suggestions']
+        if priority:
+            rows = [row for row in rows if row['Priority'] == priority]
+        return rows[:limit] if limit else rows
+
+    def status(self):
+        result = self._result
+        rows = result['suggestions']
+        return {
+            'computed_at': result['computed_at'].isoformat(timespec='seconds') if result['computed_at'] else None,
+            'compute_ms': result['compute_ms'],
+            'products': result['products'],
+            'suggestions': len(rows),
+            'critical': sum(1 for row in rows if row['Priority'] == PRIORITY_CRITICAL),
+            'lookback_days': REORDER_LOOKBACK_DAYS,
+            'lead_time_days': REORDER_LEAD_TIME_DAYS,
+        }
+
+class ReorderRefreshWorker:
+    """Background thread that recomputes reorder suggestions."""
+
+    def __init__(self, engine, interval=REORDER_REFRESH_SECONDS, connection_factory=None):
+        self.engine = engine
+        self.interval = interval
+        self.connection_factory = connection_factory or database_operations.create_read_connection
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='reorder-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+
+    def refresh_soon(self):
+        self._wake_event.set()
+
+    def run_once(self):
+        conn = self.connection_factory()
+        if conn is None:
+            return None
+        try:
+            return self.engine.refresh(conn)
+        finally:
+            if conn.is_connected(): conn.close()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error in refresh worker", exc_info=e)
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+engine = ReorderEngine()
+refresh_worker = ReorderRefreshWorker(engine)
+
+change_feed.subscriber.subscribe(database_operations.ENTITY_PRODUCT, engine.on_product_change)
+# Category names are shown with each suggestion
+change_feed.subscriber.subscribe(database_operations.ENTITY_CATEGORY, engine.on_resync)
+change_feed.subscriber.on_resync(engine.on_resync)
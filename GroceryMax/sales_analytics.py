@@ -0,0 +1,356 @@
+# sales_analytics.py
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+import app_logging
+import database_operations
+
+logger = app_logging.get_logger(__name__)
+
+ANALYTICS_STATE_PATH = os.environ.get('ANALYTICS_STATE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analytics_state.npz'))
+ANALYTICS_REFRESH_SECONDS = float(os.environ.get('ANALYTICS_REFRESH_SECONDS', '60'))
+ANALYTICS_LOAD_BATCH_SALES = int(os.environ.get('ANALYTICS_LOAD_BATCH_SALES', '5000'))
+# Only SaleIDs this close to the newest sale can be missing because their transaction is still open;
+# older holes are rolled-back inserts and are not worth tracking
+SALES_GAP_WINDOW = 1000
+SALES_GAP_RECHECK_SECONDS = 120.0
+TOP_PAIRS_LIMIT = 200
+STATE_FORMAT_VERSION = 1
+
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+def day_number(date):
+    return (date - EPOCH_DATE).days
+
+def day_date(day):
+    return EPOCH_DATE + datetime.timedelta(days=int(day))
+
+def _empty_state():
+    return {
+        'watermark': 0,
+        'gaps': {}, # SaleID -> time (epoch seconds) it was first seen missing
+        'baskets': 0,
+        'lines': 0,
+        # Rows are days since 1970-01-01, columns are ProductIDs
+        'quantity': sparse.csr_matrix((0, 0), dtype=np.int64),
+        'revenue': sparse.csr_matrix((0, 0), dtype=np.float64),
+        # cooccurrence[a, b]: baskets containing both a and b; the diagonal is each product's basket count
+        'cooccurrence': sparse.csr_matrix((0, 0), dtype=np.int64),
+        'support': np.zeros(0, dtype=np.int64),
+        'top_pairs': [],
+        'refreshed_at': None,
+        'refresh_ms': None,
+    }
+
+def _resized(matrix, shape):
+    if matrix.shape == shape:
+        return matrix
+    coo = matrix.tocoo()
+    return sparse.csr_matrix((coo.data, (coo.row, coo.col)), shape=shape, dtype=matrix.dtype)
+
+def _lines_to_arrays(lines):
+    count = len(lines)
+    sale_ids = np.fromiter((line[0] for line in lines), dtype=np.int64, count=count)
+    product_ids = np.fromiter((line[1] for line in lines), dtype=np.int64, count=count)
+    quantities = np.fromiter((line[2] for line in lines), dtype=np.int64, count=count)
+    revenue = np.fromiter((float(line[3] or 0) for line in lines), dtype=np.float64, count=count)
+    days = np.fromiter((line[4] for line in lines), dtype=np.int64, count=count)
+    return sale_ids, product_ids, quantities, revenue, days
+
+def _top_pairs(cooccurrence, support, baskets, limit):
+    upper = sparse.triu(cooccurrence, k=1).tocoo()
+    if upper.nnz == 0:
+        return []
+    order = np.lexsort((upper.col, upper.row, -upper.data))[:limit]
+    pairs = []
+    for index in order:
+        a, b, together = int(upper.row[index]), int(upper.col[index]), int(upper.data[index])
+        pairs.append({
+            'ProductA': a,
+            'ProductB': b,
+            'TogetherCount': together,
+            'Lift': round(float(together * baskets / (support[a] * support[b])), 3),
+        })
+    return pairs
+
+class SalesAnalytics:
+    """Top sellers and basket co-occurrence, aggregated from SaleDetails into sparse matrices.
+
+    Sales are loaded incrementally by SaleID watermark; a sale's lines commit together, so each
+    basket is added exactly once and every aggregate is a plain sum. SaleIDs skipped near the
+    newest sale are re-checked for a while in case their transaction commits late.
+    Queries read an immutable snapshot of the state, so they never wait for a refresh.
+    """
+
+    def __init__(self, state_path=ANALYTICS_STATE_PATH):
+        self.state_path = state_path
+        self._state = _empty_state()
+        self._refresh_lock = threading.Lock()
+
+    # --- Loading ---
+    def refresh(self, conn):
+        """Loads sales committed since the last refresh. Returns the number of sales added, or None on error."""
+        with self._refresh_lock:
+            started = time.perf_counter()
+            state = dict(self._state)
+            state['gaps'] = dict(state['gaps'])
+            conn.commit() # Start a fresh snapshot so newly committed sales are visible
+            added = 0
+
+            if state['gaps']:
+                lines = database_operations.fetch_sale_lines_for_sales(conn, sorted(state['gaps']))
+                if lines is None:
+                    return None
+                found = {line[0] for line in lines}
+                for sale_id in found:
+                    del state['gaps'][sale_id]
+                added += self._accumulate(state, lines)
+                expired = time.time() - SALES_GAP_RECHECK_SECONDS
+                state['gaps'] = {sale_id: seen for sale_id, seen in state['gaps'].items() if seen >= expired}
+
+            new_gaps = []
+            while True:
+                sale_ids = database_operations.fetch_sale_ids_after(conn, state['watermark'], ANALYTICS_LOAD_BATCH_SALES)
+                if not sale_ids:
+                    if sale_ids is None and not added:
+                        return None
+                    break
+                lines = database_operations.fetch_sale_lines_in_range(conn, state['watermark'], sale_ids[-1])
+                if lines is None:
+                    break
+                expected = np.arange(max(state['watermark'] + 1, sale_ids[-1] - SALES_GAP_WINDOW), sale_ids[-1])
+                new_gaps.extend(np.setdiff1d(expected, sale_ids, assume_unique=True).tolist())
+                added += self._accumulate(state, lines)
+                state['watermark'] = sale_ids[-1]
+                if len(sale_ids) < ANALYTICS_LOAD_BATCH_SALES:
+                    break
+
+            now = time.time()
+            for sale_id in new_gaps:
+                if sale_id > state['watermark'] - SALES_GAP_WINDOW:
+                    state['gaps'].setdefault(sale_id, now)
+
+            if added:
+                state['support'] = state['cooccurrence'].diagonal()
+                state['top_pairs'] = _top_pairs(state['cooccurrence'], state['support'], state['baskets'], TOP_PAIRS_LIMIT)
+            state['refreshed_at'] = datetime.datetime.now()
+            state['refresh_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self._state = state
+            if added or new_gaps:
+                self.save()
+            return added
+
+    def _accumulate(self, state, lines):
+        """Adds sale lines to the aggregates in state. Returns the number of sales (baskets) added."""
+        if not lines:
+            return 0
+        sale_ids, product_ids, quantities, revenue, days = _lines_to_arrays(lines)
+        n_days = max(state['quantity'].shape[0], int(days.max()) + 1)
+        n_products = max(state['cooccurrence'].shape[0], int(product_ids.max()) + 1)
+
+        day_shape = (n_days, n_products)
+        state['quantity'] = _resized(state['quantity'], day_shape) + sparse.csr_matrix(
+            (quantities, (days, product_ids)), shape=day_shape, dtype=np.int64)
+        state['revenue'] = _resized(state['revenue'], day_shape) + sparse.csr_matrix(
+            (revenue, (days, product_ids)), shape=day_shape, dtype=np.float64)
+
+        basket_ids, basket_index = np.unique(sale_ids, return_inverse=True)
+        baskets = sparse.csr_matrix((np.ones(len(sale_ids), dtype=np.int64), (basket_index, product_ids)),
+                                    shape=(len(basket_ids), n_products))
+        baskets.data[:] = 1 # A product listed twice in one sale still counts once
+        pair_shape = (n_products, n_products)
+        state['cooccurrence'] = _resized(state['cooccurrence'], pair_shape) + (baskets.T @ baskets).tocsr()
+
+        state['baskets'] += len(basket_ids)
+        state['lines'] += len(sale_ids)
+        return len(basket_ids)
+
+    # --- Persistence ---
+    def save(self):
+        """Writes the current state to state_path atomically. Returns True on success."""
+        state = self._state
+        arrays = {
+            'format_version': np.array(STATE_FORMAT_VERSION),
+            'watermark': np.array(state['watermark']),
+            'gap_ids': np.array(list(state['gaps'].keys()), dtype=np.int64),
+            'gap_seen': np.array(list(state['gaps'].values()), dtype=np.float64),
+            'counts': np.array([state['baskets'], state['lines']], dtype=np.int64),
+        }
+        for name in ('quantity', 'revenue', 'cooccurrence'):
+            matrix = state[name]
+            arrays[f'{name}_data'] = matrix.data
+            arrays[f'{name}_indices'] = matrix.indices
+            arrays[f'{name}_indptr'] = matrix.indptr
+            arrays[f'{name}_shape'] = np.array(matrix.shape)
+        temp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(temp_path, self.state_path)
+            return True
+        except OSError as e:
+            logger.error("Error saving state to %s", self.state_path, exc_info=e)
+            return False
+
+    def load(self):
+        """Restores state saved by a previous run. Returns True if a saved state was loaded."""
+        if not os.path.exists(self.state_path):
+            return False
+        try:
+            with np.load(self.state_path, allow_pickle=False) as saved:
+                if int(saved['format_version']) != STATE_FORMAT_VERSION:
+                    logger.warning("Ignoring saved state with an unknown format in %s.", self.state_path)
+                    return False
+                state = _empty_state()
+                state['watermark'] = int(saved['watermark'])
+                state['gaps'] = dict(zip(saved['gap_ids'].tolist(), saved['gap_seen'].tolist()))
+                state['baskets'], state['lines'] = (int(n) for n in saved['counts'])
+                for name in ('quantity', 'revenue', 'cooccurrence'):
+                    state[name] = sparse.csr_matrix(
+                        (saved[f'{name}_data'], saved[f'{name}_indices'], saved[f'{name}_indptr']),
+                        shape=tuple(saved[f'{name}_shape']))
+        except (OSError, KeyError, ValueError) as e:
+            logger.error("Error loading state from %s", self.state_path, exc_info=e)
+            return False
+        state['support'] = state['cooccurrence'].diagonal()
+        state['top_pairs'] = _top_pairs(state['cooccurrence'], state['support'], state['baskets'], TOP_PAIRS_LIMIT)
+        self._state = state
+        return True
+
+    def reset(self):
+        """Drops all aggregates so the next refresh reloads every sale."""
+        with self._refresh_lock:
+            self._state = _empty_state()
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
+
+    # --- Queries ---
+    def top_sellers(self, period='day', periods=7, limit=10, end_date=None):
+        """Best-selling products by quantity for each of the last `periods` days or ISO weeks (newest first).
+           Returns a list of {'PeriodStart', 'PeriodEnd', 'Products': [{'ProductID', 'Quantity', 'Revenue'}]}.
+        """
+        state = self._state
+        end_day = day_number(end_date or datetime.date.today())
+        if period == 'week':
+            first_day = end_day - (end_day + 3) % 7 # 1970-01-01 was a Thursday; weeks start on Monday
+            ranges = [(first_day - 7 * i, first_day - 7 * i + 6) for i in range(periods)]
+        else:
+            ranges = [(end_day - i, end_day - i) for i in range(periods)]
+
+        results = []
+        for start, end in ranges:
+            products = []
+            rows = slice(max(start, 0), max(min(end + 1, state['quantity'].shape[0]), 0))
+            if rows.start < rows.stop:
+                quantity = np.asarray(state['quantity'][rows].sum(axis=0)).ravel()
+                revenue = np.asarray(state['revenue'][rows].sum(axis=0)).ravel()
+                sold = np.flatnonzero(quantity)
+                if len(sold) > limit:
+                    sold = sold[np.argpartition(-quantity[sold], limit - 1)[:limit]]
+                for product_id in sold[np.lexsort((sold, -quantity[sold]))]:
+                    products.append({'ProductID': int(product_id), 'Quantity': int(quantity[product_id]),
+                                     'Revenue': round(float(revenue[product_id]), 2)})
+            results.append({'PeriodStart': day_date(start), 'PeriodEnd': day_date(end), 'Products': products})
+        return results
+
+    def daily_quantities(self, first_day, last_day):
+        """Units sold per day for first_day..last_day (day numbers) as a CSR matrix: one row per day, one column per ProductID."""
+        matrix = self._state['quantity']
+        n_rows = last_day - first_day + 1
+        low, high = max(first_day, 0), min(last_day + 1, matrix.shape[0])
+        if low >= high:
+            return sparse.csr_matrix((n_rows, matrix.shape[1]), dtype=np.int64)
+        window = matrix[low:high].tocoo()
+        return sparse.csr_matrix((window.data, (window.row + (low - first_day), window.col)),
+                                 shape=(n_rows, matrix.shape[1]), dtype=np.int64)
+
+    def bought_together(self, product_id, limit=10):
+        """Products most often in the same sale as product_id.
+           Returns a list of {'ProductID', 'TogetherCount', 'Confidence', 'Lift'} or an empty list.
+        """
+        state = self._state
+        cooccurrence, support = state['cooccurrence'], state['support']
+        if product_id < 0 or product_id >= len(support) or not support[product_id]:
+            return []
+        row = cooccurrence.getrow(product_id)
+        others, counts = row.indices, row.data
+        keep = others != product_id
+        others, counts = others[keep], counts[keep]
+        order = np.lexsort((others, -counts))[:limit]
+        base = support[product_id]
+        return [{
+            'ProductID': int(others[i]),
+            'TogetherCount': int(counts[i]),
+            'Confidence': round(float(counts[i] / base), 3), # Share of this product's sales that included the other
+            'Lift': round(float(counts[i] * state['baskets'] / (base * support[others[i]])), 3),
+        } for i in order]
+
+    def top_pairs(self, limit=20):
+        """Most frequent product pairs across all sales. Returns a list of {'ProductA', 'ProductB', 'TogetherCount', 'Lift'}."""
+        return self._state['top_pairs'][:limit]
+
+    def status(self):
+        state = self._state
+        return {
+            'watermark': state['watermark'],
+            'pending_gaps': len(state['gaps']),
+            'baskets': state['baskets'],
+            'lines': state['lines'],
+            'products': int(np.count_nonzero(state['support'])),
+            'refreshed_at': state['refreshed_at'].isoformat(timespec='seconds') if state['refreshed_at'] else None,
+            'refresh_ms': state['refresh_ms'],
+        }
+
+class AnalyticsRefreshWorker:
+    """Background thread that restores the saved state once, then keeps it up to date."""
+
+    def __init__(self, engine, interval=ANALYTICS_REFRESH_SECONDS, connection_factory=None):
+        self.engine = engine
+        self.interval = interval
+        self.connection_factory = connection_factory or database_operations.create_read_connection
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='sales-analytics-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+
+    def refresh_soon(self):
+        self._wake_event.set()
+
+    def run_once(self):
+        conn = self.connection_factory()
+        if conn is None:
+            return None
+        try:
+            return self.engine.refresh(conn)
+        finally:
+            if conn.is_connected(): conn.close()
+
+    def _run(self):
+        self.engine.load()
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error in refresh worker", exc_info=e)
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+analytics = SalesAnalytics()
+refresh_worker = AnalyticsRefreshWorker(analytics)
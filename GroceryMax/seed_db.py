@@ -1,16 +1,23 @@
 # seed_db.py
+# Usage: python seed_db.py [store_id ... | all]   (default: the store in STORE_ID)
+import sys
 import database_operations as db_ops # Assuming database_operations.py is in the same directory
 
-def seed_data():
-    """Connects to the DB and seeds it with initial data."""
-    print("Attempting to seed database...")
-    conn = db_ops.create_connection()
+def seed_data(store_id=None):
+    """Connects to the DB (the given store's database, by default STORE_ID) and seeds it with initial data."""
+    print(f"Attempting to seed database of store {db_ops.STORE_ID if store_id is None else store_id}...")
+    conn = db_ops.create_connection(store_id)
 
     if not conn or not conn.is_connected():
         print("Failed to connect to the database. Seeding aborted.")
         return
 
     try:
+        # A new store's shard also needs the supporting tables before the first product is added
+        if not db_ops.ensure_extension_tables(conn):
+            print("Failed to create the supporting tables. Seeding aborted.")
+            return
+
         # --- Seed Categories ---
         print("\n--- Seeding Categories ---")
         cat_fruits_id = db_ops.get_or_create_category(conn, "Fruits", "Fresh and juicy fruits")
@@ -65,4 +72,9 @@ def seed_data():
 
 if __name__ == '__main__':
     # This makes the script executable
-    seed_data()
\ No newline at end of file
+    if sys.argv[1:] == ['all']:
+        store_ids = sorted(db_ops.STORE_CONFIGS)
+    else:
+        store_ids = [int(arg) for arg in sys.argv[1:]] or [None]
+    for store_id in store_ids:
+        seed_data(store_id)
\ No newline at end of file
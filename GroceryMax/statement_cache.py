@@ -0,0 +1,143 @@
+# statement_cache.py
+"""Server-side prepared statements for the fixed hot queries of the data layer.
+
+Each pooled connection keeps an LRU of prepared cursors keyed by SQL text (STATEMENT_CACHE_SIZE per
+connection). A statement is prepared once per connection and afterwards executed with the binary
+protocol, so the server skips parsing and the client skips text conversion of results. The cache
+belongs to the physical connection: it is dropped when the connection reconnects (the server frees
+its statements then) and rebuilt on demand.
+
+Unpooled connections live for a single request, so preparing there would cost more than it saves;
+they, and every connection when STATEMENT_CACHE_SIZE=0, use ordinary text-protocol cursors.
+
+The helpers always read results completely, so a cached cursor never leaves unread rows behind.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from mysql.connector import Error
+from mysql.connector import pooling
+
+STATEMENT_CACHE_SIZE = int(os.environ.get('STATEMENT_CACHE_SIZE', '32'))
+# Server error: the statement handle no longer exists (e.g. the session was reset)
+ER_UNKNOWN_STMT_HANDLER = 1243
+
+class PreparedStatementCache:
+    """LRU of prepared cursors for one physical connection."""
+
+    def __init__(self, connection_id, max_size=STATEMENT_CACHE_SIZE):
+        self.connection_id = connection_id
+        self.max_size = max_size
+        self._cursors = OrderedDict() # (sql, dictionary) -> (sql object used to prepare, cursor)
+        self.prepares = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def cursor_for(self, conn, sql, dictionary):
+        """Returns (sql, cursor). The returned sql is the exact string object the cursor was prepared with;
+           mysql-connector only skips re-preparing when execute() receives that same object."""
+        key = (sql, dictionary)
+        entry = self._cursors.get(key)
+        if entry is not None:
+            self._cursors.move_to_end(key)
+            self.hits += 1
+            return entry
+        entry = (sql, conn.cursor(prepared=True, dictionary=dictionary))
+        self._cursors[key] = entry
+        self.prepares += 1
+        while len(self._cursors) > self.max_size:
+            _, (_, evicted) = self._cursors.popitem(last=False)
+            self._close(evicted)
+            self.evictions += 1
+        return entry
+
+    def discard(self, sql, dictionary):
+        entry = self._cursors.pop((sql, dictionary), None)
+        if entry is not None:
+            self._close(entry[1])
+
+    def _close(self, cursor):
+        try:
+            cursor.close() # Sends COM_STMT_CLOSE, which has no reply
+        except Error:
+            pass
+
+    def __len__(self):
+        return len(self._cursors)
+
+_stats_lock = threading.Lock()
+_retired = {'prepares': 0, 'hits': 0, 'evictions': 0, 'invalidations': 0}
+_live_caches = {} # id(physical connection) -> PreparedStatementCache
+
+def _physical(conn):
+    # PooledMySQLConnection wraps the real connection, which outlives each checkout
+    return conn._cnx if isinstance(conn, pooling.PooledMySQLConnection) else conn
+
+def statements_for(conn):
+    """The statement cache of a pooled connection, or None when prepared statements are not used for it."""
+    if STATEMENT_CACHE_SIZE <= 0 or not isinstance(conn, pooling.PooledMySQLConnection):
+        return None
+    physical = _physical(conn)
+    cache = getattr(physical, '_statement_cache', None)
+    connection_id = physical.connection_id
+    if cache is None or cache.connection_id != connection_id:
+        with _stats_lock:
+            if cache is not None:
+                # Reconnected: the server already freed the old statements
+                _retired['invalidations'] += 1
+                for key in ('prepares', 'hits', 'evictions'):
+                    _retired[key] += getattr(cache, key)
+            cache = PreparedStatementCache(connection_id)
+            physical._statement_cache = cache
+            _live_caches[id(physical)] = cache
+    return cache
+
+def _run(conn, sql, params, dictionary, consume):
+    cache = statements_for(conn)
+    if cache is None:
+        cursor = conn.cursor(dictionary=dictionary, buffered=True)
+        try:
+            cursor.execute(sql, params)
+            return consume(cursor)
+        finally:
+            cursor.close()
+    for attempt in (1, 2):
+        prepared_sql, cursor = cache.cursor_for(conn, sql, dictionary)
+        try:
+            cursor.execute(prepared_sql, params)
+            return consume(cursor)
+        except Error as e:
+            if e.errno != ER_UNKNOWN_STMT_HANDLER:
+                raise # e.g. a lock wait timeout; the statement itself is still valid
+            cache.discard(sql, dictionary)
+            if attempt == 2:
+                raise
+
+def _rows(cursor):
+    return cursor.fetchall() if cursor.description else []
+
+def fetch_one(conn, sql, params=(), dictionary=False):
+    """Executes a query and returns its first row (or None). Raises mysql.connector.Error like cursor.execute."""
+    rows = _run(conn, sql, params, dictionary, _rows)
+    return rows[0] if rows else None
+
+def fetch_all(conn, sql, params=(), dictionary=False):
+    """Executes a query and returns all rows."""
+    return _run(conn, sql, params, dictionary, _rows)
+
+def execute(conn, sql, params=()):
+    """Executes a statement that returns no rows. Returns (rowcount, lastrowid)."""
+    return _run(conn, sql, params, False, lambda cursor: (cursor.rowcount, cursor.lastrowid))
+
+def metrics():
+    with _stats_lock:
+        totals = dict(_retired)
+        caches = list(_live_caches.values())
+    for cache in caches:
+        for key in ('prepares', 'hits', 'evictions'):
+            totals[key] += getattr(cache, key)
+    totals['connections'] = len(caches)
+    totals['cached_statements'] = sum(len(cache) for cache in caches)
+    totals['max_per_connection'] = STATEMENT_CACHE_SIZE
+    return totals
@@ -0,0 +1,116 @@
+# stress_checkout.py
+"""Stress harness for checkout: direct per-sale commits versus the group-commit queue.
+
+Simulates many tills checking out at once and prints throughput and latency for each configuration:
+    python stress_checkout.py --yes [--tills 32] [--sales-per-till 50] [--batch-sizes 8,20,50] [--max-wait-ms 2,5,10]
+It records real sales and reduces stock, so run it against a test database (seed_db.py).
+"""
+import argparse
+import random
+import statistics
+import sys
+import threading
+import time
+
+import checkout_queue
+import database_operations
+
+def pick_products(conn, count):
+    """Products with plenty of stock, so runs measure commits rather than rejected sales."""
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute("""SELECT ProductID, Price FROM Products WHERE StockQuantity >= 1000
+                          ORDER BY StockQuantity DESC LIMIT %s""", (count,))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def random_cart(products, lines):
+    chosen = random.sample(products, min(lines, len(products)))
+    return [{'product_id': p['ProductID'], 'quantity': random.randint(1, 3), 'unit_price': p['Price']} for p in chosen]
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def run_tills(tills, sales_per_till, checkout, products, lines):
+    """Runs `tills` threads, each checking out sales_per_till carts through checkout(cart).
+       Returns (elapsed_seconds, latencies_ms, failures)."""
+    latencies, failures = [], [0]
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(tills + 1)
+
+    def till():
+        start_barrier.wait()
+        for _ in range(sales_per_till):
+            cart = random_cart(products, lines)
+            started = time.perf_counter()
+            sale_id = checkout(cart)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if not sale_id: failures[0] += 1
+
+    threads = [threading.Thread(target=till) for _ in range(tills)]
+    for thread in threads: thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads: thread.join()
+    return time.perf_counter() - started, sorted(latencies), failures[0]
+
+def direct_checkout(cart):
+    conn = database_operations.create_connection()
+    try:
+        return database_operations.process_new_sale(conn, cart, payment_method="Stress test")
+    finally:
+        if conn is not None and conn.is_connected(): conn.close()
+
+def report(label, elapsed, latencies, failures, extra=''):
+    print(f"{label:<24} {len(latencies) / elapsed:9.1f} sales/s  p50 {percentile(latencies, 0.5):8.2f} ms  "
+          f"p95 {percentile(latencies, 0.95):8.2f} ms  p99 {percentile(latencies, 0.99):8.2f} ms  "
+          f"mean {statistics.mean(latencies):8.2f} ms  failed {failures}{extra}")
+
+def parse_list(text, cast):
+    return [cast(value) for value in text.split(',') if value.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure checkout throughput and latency with and without group commit.")
+    parser.add_argument('--yes', action='store_true', help="Confirm that real sales may be written to the configured database.")
+    parser.add_argument('--tills', type=int, default=32, help="Concurrent tills (threads).")
+    parser.add_argument('--sales-per-till', type=int, default=50)
+    parser.add_argument('--lines', type=int, default=3, help="Products per cart.")
+    parser.add_argument('--batch-sizes', default='8,20,50', help="Comma-separated CHECKOUT_BATCH_SIZE values to try.")
+    parser.add_argument('--max-wait-ms', default='2,5,10', help="Comma-separated CHECKOUT_MAX_WAIT_MS values to try.")
+    args = parser.parse_args(argv)
+    if not args.yes:
+        print(f"This records {args.tills * args.sales_per_till} sales per configuration in {database_operations.STORE_CONFIGS[database_operations.STORE_ID]['database']} (store {database_operations.STORE_ID}). Re-run with --yes to continue.")
+        return 1
+
+    conn = database_operations.create_connection()
+    if conn is None:
+        print("Failed to connect to the database.")
+        return 1
+    try:
+        products = pick_products(conn, 200)
+    finally:
+        if conn.is_connected(): conn.close()
+    if len(products) < args.lines:
+        print("Not enough products with stock >= 1000; seed or restock the test database first.")
+        return 1
+
+    print(f"{args.tills} tills x {args.sales_per_till} sales, {args.lines} lines per cart, DB_POOL_SIZE={database_operations.DB_POOL_SIZE}")
+    report('direct', *run_tills(args.tills, args.sales_per_till, direct_checkout, products, args.lines))
+    for batch_size in parse_list(args.batch_sizes, int):
+        for max_wait_ms in parse_list(args.max_wait_ms, float):
+            queue = checkout_queue.CheckoutQueue(batch_size=batch_size, max_wait_ms=max_wait_ms)
+            queue.start()
+            try:
+                result = run_tills(args.tills, args.sales_per_till, queue.process_sale, products, args.lines)
+            finally:
+                queue.stop()
+            metrics = queue.metrics()
+            report(f"queue b={batch_size} w={max_wait_ms:g}ms", *result,
+                   extra=f"  avg batch {metrics['avg_batch_size']}  retried batches {metrics['batch_retries']}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
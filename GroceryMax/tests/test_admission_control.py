@@ -0,0 +1,79 @@
+# tests/test_admission_control.py
+import threading
+import time
+
+import pytest
+
+from admission_control import CHECKOUT, INTERACTIVE, REPORTS, AdmissionController, Rejected, classify
+
+def test_classify_routes():
+    assert classify('new_sale_route', 'POST') == CHECKOUT
+    assert classify('new_sale_route', 'GET') == INTERACTIVE
+    assert classify('api_catalog_search', 'GET') == CHECKOUT
+    assert classify('sales_history_route', 'GET') == REPORTS
+    assert classify('show_products', 'GET') == INTERACTIVE
+
+def test_classify_exempt_routes():
+    assert classify(None, 'GET') is None
+    assert classify('static', 'GET') is None
+    assert classify('admin_profiling_route', 'POST') is None
+    assert classify('checkout_metrics_route', 'GET') is None
+
+def _controller(limits, queue_lengths=None, timeouts=None, max_concurrent=10):
+    return AdmissionController(limits=limits,
+                               queue_lengths=queue_lengths or {CHECKOUT: 5, INTERACTIVE: 5, REPORTS: 5},
+                               timeouts=timeouts or {CHECKOUT: 1.0, INTERACTIVE: 1.0, REPORTS: 1.0},
+                               max_concurrent=max_concurrent)
+
+def test_admits_up_to_the_class_limit_then_times_out():
+    controller = _controller({CHECKOUT: 2, INTERACTIVE: 1, REPORTS: 1}, timeouts={CHECKOUT: 1.0, INTERACTIVE: 1.0, REPORTS: 0.05})
+    ticket = controller.acquire(REPORTS)
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire(REPORTS)
+    assert rejected.value.reason == 'queue timeout'
+    assert rejected.value.retry_after >= 1
+    controller.acquire(INTERACTIVE) # Other classes have their own budget
+    ticket.release()
+    ticket.release() # Releasing twice frees one slot only
+    controller.acquire(REPORTS)
+    metrics = controller.metrics()
+    assert metrics['active'] == 2
+    assert metrics['classes'][REPORTS]['rejected_timeout'] == 1
+
+def test_full_queue_is_rejected_at_once():
+    controller = _controller({CHECKOUT: 1, INTERACTIVE: 1, REPORTS: 1}, queue_lengths={CHECKOUT: 0, INTERACTIVE: 0, REPORTS: 0})
+    controller.acquire(CHECKOUT)
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire(CHECKOUT)
+    assert rejected.value.reason == 'queue full'
+
+def test_waiting_request_is_admitted_when_a_slot_frees():
+    controller = _controller({CHECKOUT: 1, INTERACTIVE: 1, REPORTS: 1})
+    ticket = controller.acquire(INTERACTIVE)
+    threading.Timer(0.05, ticket.release).start()
+    started = time.perf_counter()
+    assert controller.acquire(INTERACTIVE).route_class == INTERACTIVE
+    assert time.perf_counter() - started >= 0.04
+    assert controller.metrics()['classes'][INTERACTIVE]['queued'] == 1
+
+def test_freed_slot_goes_to_the_higher_priority_class():
+    controller = _controller({CHECKOUT: 2, INTERACTIVE: 2, REPORTS: 2}, max_concurrent=1)
+    held = controller.acquire(REPORTS)
+    admitted = []
+
+    def wait_for(route_class):
+        try:
+            admitted.append(controller.acquire(route_class).route_class)
+        except Rejected:
+            admitted.append(None)
+
+    waiters = [threading.Thread(target=wait_for, args=(route_class,)) for route_class in (REPORTS, CHECKOUT)]
+    for waiter in waiters:
+        waiter.start()
+        time.sleep(0.05) # The reports request queues first
+    held.release()
+    waiters[1].join(timeout=2)
+    assert admitted == [CHECKOUT]
+    for waiter in waiters:
+        waiter.join(timeout=2)
+    assert admitted == [CHECKOUT, None] # Reports timed out behind the checkout request
@@ -0,0 +1,13 @@
+# tests/test_archival.py
+import datetime
+
+from archival import archive_cutoff
+
+def test_cutoff_is_the_first_day_of_an_earlier_month():
+    assert archive_cutoff(datetime.date(2024, 5, 15), months=3) == datetime.date(2024, 2, 1)
+    assert archive_cutoff(datetime.date(2024, 5, 1), months=0) == datetime.date(2024, 5, 1)
+
+def test_cutoff_crosses_year_boundaries():
+    assert archive_cutoff(datetime.date(2024, 2, 29), months=2) == datetime.date(2023, 12, 1)
+    assert archive_cutoff(datetime.date(2024, 1, 31), months=13) == datetime.date(2022, 12, 1)
+    assert archive_cutoff(datetime.date(2024, 12, 31), months=12) == datetime.date(2023, 12, 1)
@@ -0,0 +1,27 @@
+# tests/test_bulk_operations.py
+from bulk_operations import parse_stock_csv
+
+def test_reads_product_and_quantity_columns():
+    counts, errors = parse_stock_csv("product_id,quantity\n1,10\n2,0\n")
+    assert counts == [(1, 10), (2, 0)]
+    assert errors == []
+
+def test_header_names_are_case_insensitive_and_aliased():
+    counts, errors = parse_stock_csv("ID , Counted,Location\n5,3,aisle 2\n")
+    assert counts == [(5, 3)]
+    assert errors == []
+
+def test_keeps_negative_changes_and_repeated_products():
+    counts, _ = parse_stock_csv("productid,count\n4,-2\n4,-1\n")
+    assert counts == [(4, -2), (4, -1)]
+
+def test_reports_bad_rows_by_line_number():
+    counts, errors = parse_stock_csv("product_id,quantity\n1,10\nabc,5\n3,\n4,2.5\n")
+    assert counts == [(1, 10)]
+    assert [error.split(':')[0] for error in errors] == ['Line 3', 'Line 4', 'Line 5']
+
+def test_missing_columns_are_rejected():
+    counts, errors = parse_stock_csv("sku,qty\n1,2\n")
+    assert counts == []
+    assert len(errors) == 1
+    assert parse_stock_csv("") == ([], errors)
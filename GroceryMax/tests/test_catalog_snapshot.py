@@ -0,0 +1,71 @@
+# tests/test_catalog_snapshot.py
+import decimal
+
+from catalog_snapshot import CatalogSnapshot
+
+# (ProductID, ProductName, CategoryName, Price, StockQuantity)
+ROWS = [
+    (3, 'Bananas', 'Fruits', decimal.Decimal('0.59'), 120),
+    (1, 'Apples', 'Fruits', decimal.Decimal('1.99'), 50),
+    (7, 'Cheddar', 'Dairy', decimal.Decimal('4.25'), 8),
+]
+
+def _snapshot():
+    return CatalogSnapshot.empty().with_changes(ROWS, watermark='w1')
+
+def test_full_load_is_ordered_by_id():
+    snapshot = _snapshot()
+    assert snapshot.ids.tolist() == [1, 3, 7]
+    assert snapshot.lookup(3) == {'ProductID': 3, 'ProductName': 'Bananas', 'CategoryName': 'Fruits',
+                                  'Price': decimal.Decimal('0.59'), 'StockQuantity': 120}
+    assert snapshot.lookup(2) is None
+    assert [row['ProductName'] for row in snapshot.rows()] == ['Apples', 'Bananas', 'Cheddar']
+
+def test_delta_updates_existing_rows_in_place():
+    snapshot = _snapshot()
+    updated = snapshot.with_changes([(3, 'Bananas', 'Fruits', decimal.Decimal('0.65'), 100)], watermark='w2')
+    assert updated.lookup(3)['Price'] == decimal.Decimal('0.65')
+    assert updated.lookup(3)['StockQuantity'] == 100
+    assert updated.name_index is snapshot.name_index # No name changed
+    assert (updated.generation, updated.watermark) == (snapshot.generation + 1, 'w2')
+    assert snapshot.lookup(3)['StockQuantity'] == 120 # The old snapshot is untouched
+
+def test_delta_adds_new_products_and_categories():
+    updated = _snapshot().with_changes([(5, 'Baguette', 'Bakery', decimal.Decimal('2.10'), 30),
+                                        (2, 'Almonds', 'Snacks', decimal.Decimal('6.00'), 12)])
+    assert updated.ids.tolist() == [1, 2, 3, 5, 7]
+    assert updated.lookup(5)['CategoryName'] == 'Bakery'
+    assert [row['ProductID'] for row in updated.search('ba')] == [5, 3]
+    assert updated.watermark == 'w1' # Kept when the delta has none
+
+def test_later_duplicate_in_a_delta_wins():
+    updated = _snapshot().with_changes([(9, 'Milk', 'Dairy', 1, 10), (9, 'Whole Milk', 'Dairy', 1, 9)])
+    assert updated.ids.tolist().count(9) == 1
+    assert updated.lookup(9)['ProductName'] == 'Whole Milk'
+
+def test_rename_rebuilds_the_search_index():
+    updated = _snapshot().with_changes([(1, 'Green Apples', 'Fruits', decimal.Decimal('1.99'), 50)])
+    assert updated.search('apples') == []
+    assert [row['ProductID'] for row in updated.search('green')] == [1]
+
+def test_deletes_remove_products():
+    updated = _snapshot().with_changes([], deleted_ids={3, 42})
+    assert updated.ids.tolist() == [1, 7]
+    assert updated.lookup(3) is None
+    assert [row['ProductID'] for row in updated.search('b')] == []
+
+def test_search_by_id_and_prefix():
+    snapshot = _snapshot()
+    assert [row['ProductID'] for row in snapshot.search('7')] == [7]
+    assert [row['ProductID'] for row in snapshot.search('CH')] == [7]
+    assert snapshot.search('  ') == []
+
+def test_validate_cart_quotes_prices_and_reports_problems():
+    items, problems = _snapshot().validate_cart([
+        {'product_id': '1', 'quantity': '2'},
+        {'product_id': 99, 'quantity': 1},
+        {'product_id': 7, 'quantity': 0},
+        {'quantity': 1},
+    ])
+    assert items == [{'product_id': 1, 'quantity': 2, 'unit_price': decimal.Decimal('1.99')}]
+    assert len(problems) == 3
@@ -0,0 +1,39 @@
+# tests/test_checkout_queue.py
+import threading
+
+import pytest
+
+import database_operations
+from checkout_queue import PendingSale
+
+def _pending():
+    return PendingSale([{'product_id': 1, 'quantity': 1}], None, 'Cash', 'cart', client_token='token')
+
+def test_wait_returns_the_resolved_sale():
+    pending = _pending()
+    threading.Timer(0.01, pending.resolve, (42, None)).start()
+    assert pending.wait(timeout=5) == 42
+    assert pending.error is None
+
+def test_wait_times_out_with_a_connection_error():
+    pending = _pending()
+    assert pending.wait(timeout=0.01) is None
+    assert database_operations.is_connection_error(pending.error)
+    # A dispatcher answering after the timeout does not change the reported outcome
+    assert not pending.resolve(42, None)
+    assert pending.sale_id is None
+
+def test_client_token_defaults_to_a_new_one():
+    first, second = PendingSale([], None, 'Cash', None), PendingSale([], None, 'Cash', None)
+    assert first.sale['client_token'] != second.sale['client_token']
+    assert _pending().sale['client_token'] == 'token'
+
+def test_sale_items_are_normalised_to_integers():
+    items = database_operations.normalize_sale_items([{'product_id': '12', 'quantity': '3', 'note': 'x'}])
+    assert items == [{'product_id': 12, 'quantity': 3, 'note': 'x'}]
+    assert database_operations.normalize_sale_items(None) == []
+
+@pytest.mark.parametrize('item', [{'product_id': 'abc', 'quantity': 1}, {'quantity': 1}, {'product_id': 1}, None])
+def test_invalid_sale_items_are_rejected(item):
+    with pytest.raises(ValueError):
+        database_operations.normalize_sale_items([item])
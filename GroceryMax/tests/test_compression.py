@@ -0,0 +1,71 @@
+# tests/test_compression.py
+import gzip
+
+import pytest
+from flask import Flask, Response, stream_with_context
+
+import compression
+
+BODY = '<p>' + 'fresh produce ' * 200 + '</p>'
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    compression.init_app(app)
+
+    @app.route('/page')
+    def page():
+        return BODY
+
+    @app.route('/small')
+    def small():
+        return 'ok'
+
+    @app.route('/streamed')
+    def streamed():
+        return Response(stream_with_context(iter(['<p>', 'a' * 10000, '</p>'])), mimetype='text/html')
+
+    @app.route('/image')
+    def image():
+        return Response(b'\x89PNG' * 500, mimetype='image/png')
+
+    return app
+
+def test_negotiates_gzip_from_accept_encoding(app):
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip, deflate'}):
+        assert compression.negotiate_encoding() == 'gzip'
+    with app.test_request_context(headers={'Accept-Encoding': 'identity'}):
+        assert compression.negotiate_encoding() is None
+    with app.test_request_context():
+        assert compression.negotiate_encoding() is None
+
+def test_prefers_brotli_when_available(app, monkeypatch):
+    monkeypatch.setitem(compression.ENCODERS, 'br', object)
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip, br'}):
+        assert compression.negotiate_encoding() == 'br'
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip, br;q=0'}):
+        assert compression.negotiate_encoding() == 'gzip'
+
+def test_compresses_text_responses(app):
+    response = app.test_client().get('/page', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data).decode() == BODY
+
+def test_leaves_identity_requests_and_small_bodies_alone(app):
+    client = app.test_client()
+    response = client.get('/page')
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == b'ok'
+
+def test_skips_binary_mimetypes(app):
+    response = app.test_client().get('/image', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+def test_compresses_streamed_responses(app):
+    response = app.test_client().get('/streamed', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data).decode() == '<p>' + 'a' * 10000 + '</p>'
@@ -0,0 +1,67 @@
+# tests/test_fragment_cache.py
+import sys
+
+from flask import Flask, render_template_string
+
+import fragment_cache
+from fragment_cache import FragmentCache
+
+def test_get_returns_stored_value_and_counts_hits():
+    cache = FragmentCache(max_bytes=10000)
+    assert cache.get('a') is None
+    cache.set('a', 'rendered')
+    assert cache.get('a') == 'rendered'
+    metrics = cache.metrics()
+    assert (metrics['hits'], metrics['misses'], metrics['entries']) == (1, 1, 1)
+
+def test_evicts_least_recently_used_when_over_size():
+    size = sys.getsizeof('x' * 100)
+    cache = FragmentCache(max_bytes=size * 2)
+    cache.set('a', 'a' * 100)
+    cache.set('b', 'b' * 100)
+    cache.get('a') # 'b' is now the least recently used
+    cache.set('c', 'c' * 100)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'a' * 100
+    assert cache.get('c') == 'c' * 100
+    assert cache.metrics()['evictions'] == 1
+    assert cache.current_bytes <= cache.max_bytes
+
+def test_replacing_a_key_keeps_the_byte_count():
+    cache = FragmentCache(max_bytes=100000)
+    cache.set('a', 'x' * 10)
+    cache.set('a', 'y' * 50)
+    assert cache.current_bytes == sys.getsizeof('y' * 50)
+    assert cache.get('a') == 'y' * 50
+
+def test_oversized_fragment_is_not_stored():
+    cache = FragmentCache(max_bytes=10)
+    cache.set('big', 'x' * 1000)
+    assert cache.get('big') is None
+    assert cache.current_bytes == 0
+
+def _app():
+    app = Flask(__name__)
+    fragment_cache.init_app(app)
+    return app
+
+def test_cache_tag_reuses_the_rendered_fragment():
+    app = _app()
+    template = '{% cache "list", version %}{{ calls.append(1) or "" }}rows{% endcache %}'
+    calls = []
+    with app.app_context():
+        assert render_template_string(template, version='v1', calls=calls) == 'rows'
+        assert render_template_string(template, version='v1', calls=calls) == 'rows'
+        assert len(calls) == 1
+        render_template_string(template, version='v2', calls=calls) # A new data version renders again
+        assert len(calls) == 2
+
+def test_cache_tag_with_unknown_version_always_renders():
+    app = _app()
+    template = '{% cache "list", version %}{{ calls.append(1) or "" }}rows{% endcache %}'
+    calls = []
+    with app.app_context():
+        render_template_string(template, version=None, calls=calls)
+        render_template_string(template, version=None, calls=calls)
+    assert len(calls) == 2
+    assert app.jinja_env.fragment_cache.metrics()['entries'] == 0
@@ -0,0 +1,74 @@
+# tests/test_generate_data.py
+import datetime
+
+import numpy as np
+
+import generate_data
+
+END_DATE = datetime.date(2024, 6, 30)
+
+def _plan(seed=7):
+    plan = {
+        'store_id': 1, 'seed': seed, 'method': generate_data.METHOD_INSERT,
+        'category_names': list(generate_data.CATEGORIES), 'category_ids': list(range(1, len(generate_data.CATEGORIES) + 1)),
+        'first_product_id': 1, 'n_products': 500, 'first_customer_id': 1, 'n_customers': 200,
+        'first_sale_id': 1, 'customer_share': generate_data.CUSTOMER_SALE_SHARE,
+        'product_zipf': 1.1, 'customer_zipf': 0.8, 'log_date_column': 'LogDate',
+    }
+    return plan
+
+def _generate(seed=7, sale_lines=20000, cutoff=datetime.date(2024, 1, 1)):
+    plan = _plan(seed)
+    tasks = generate_data.plan_sales_chunks(plan, sale_lines, 1, END_DATE, cutoff)
+    generate_data._init_worker(plan)
+    rows = [generate_data._sales_rows(task[1], *task[2:5]) for task in tasks]
+    products = generate_data._products_rows(0, 0, plan['n_products'])
+    return plan, tasks, rows, products
+
+def test_same_seed_gives_the_same_data():
+    _, tasks, rows, products = _generate()
+    _, tasks_again, rows_again, products_again = _generate()
+    assert tasks == tasks_again
+    assert rows == rows_again
+    assert products == products_again
+
+def test_different_seed_gives_different_data():
+    assert _generate(seed=7)[2] != _generate(seed=8)[2]
+
+def test_chunks_are_independent_of_generation_order():
+    plan, tasks, rows, _ = _generate()
+    generate_data._init_worker(plan)
+    for task, expected in reversed(list(zip(tasks, rows))):
+        assert generate_data._sales_rows(task[1], *task[2:5]) == expected
+
+def test_chunks_cover_the_period_with_consecutive_sale_ids(monkeypatch):
+    monkeypatch.setattr(generate_data, 'SALES_PER_CHUNK', 500)
+    cutoff = datetime.date(2024, 1, 1)
+    plan, tasks, rows, _ = _generate(cutoff=cutoff)
+    assert len(tasks) > 2
+    next_sale_id = 1
+    for task, (sales, lines, logs) in zip(tasks, rows):
+        assert task[2] == next_sale_id
+        assert [sale[0] for sale in sales] == list(range(next_sale_id, next_sale_id + len(sales)))
+        next_sale_id += len(sales)
+        # Chunks never straddle the archive cutoff
+        dates = {sale[2][:10] for sale in sales}
+        archived = task[5]
+        assert all((date < cutoff.isoformat()) == archived for date in dates)
+        # Every line has its sale log, linked by SaleID
+        assert [(line[0], line[1], -line[2]) for line in lines] == [(log[4], log[0], log[2]) for log in logs]
+        sale_totals = {sale[0]: sale[3] for sale in sales}
+        for sale_id in {line[0] for line in lines}:
+            assert abs(sum(line[4] for line in lines if line[0] == sale_id) - sale_totals[sale_id]) < 0.005
+    assert next_sale_id - 1 == sum(sum(task[4]) for task in tasks)
+
+def test_sale_dates_follow_sale_ids():
+    _, _, rows, _ = _generate()
+    dates = [sale[2] for sales, _, _ in rows for sale in sales]
+    assert dates == sorted(dates)
+    assert dates[-1] < END_DATE.isoformat()
+
+def test_day_weights_peak_in_december():
+    weights = generate_data.day_weights(datetime.date(2023, 1, 2), 364) # Starts on a Monday
+    weekly = weights.reshape(52, 7).sum(axis=1)
+    assert np.argmax(weekly) >= 49
@@ -0,0 +1,69 @@
+# tests/test_profiling.py
+import collections
+import os
+
+import profiling
+from profiling import RequestProfiler, parse_rules, summarize
+
+class FakeSampler:
+    def __init__(self, stacks):
+        self.stacks = stacks
+
+    def begin(self, thread_id):
+        pass
+
+    def end(self, thread_id):
+        return self.stacks
+
+def test_parse_rules():
+    rules = parse_rules("show_products:get:10, api_catalog_search:GET:1:5,,broken,bad:GET:x")
+    assert rules == [
+        {'endpoint': 'show_products', 'method': 'GET', 'every': 10, 'remaining': None},
+        {'endpoint': 'api_catalog_search', 'method': 'GET', 'every': 1, 'remaining': 5},
+    ]
+    assert parse_rules("index:GET:0")[0]['every'] == 1
+    assert parse_rules("") == []
+
+def test_summarize_groups_samples_by_category_and_database_function():
+    stacks = collections.Counter({
+        'app:show_products;database_operations:fetch_products;mysql.connector.cursor:execute': 6,
+        'app:show_products;flask.templating:render_template;template:products.html': 3,
+        'app:api;flask.json:dumps;json.encoder:encode': 1,
+    })
+    summary = summarize(stacks)
+    assert summary['samples'] == 10
+    assert summary['categories'] == {
+        'database': {'samples': 6, 'percent': 60.0},
+        'template': {'samples': 3, 'percent': 30.0},
+        'json': {'samples': 1, 'percent': 10.0},
+    }
+    assert summary['database_functions'] == [{'function': 'fetch_products', 'samples': 6, 'percent': 60.0}]
+    assert summary['top_self'][0] == {'frame': 'mysql.connector.cursor:execute', 'samples': 6, 'percent': 60.0}
+
+def test_summarize_empty():
+    summary = summarize(collections.Counter())
+    assert summary == {'samples': 0, 'categories': {}, 'database_functions': [], 'top_self': []}
+
+def test_rules_sample_every_nth_request_up_to_the_limit(tmp_path):
+    profiler = RequestProfiler(token='secret', profile_dir=str(tmp_path), sampler=FakeSampler(None))
+    profiler.rules = parse_rules("show_products:GET:2:2")
+    decisions = [profiler.should_profile('show_products', 'GET') for _ in range(8)]
+    assert decisions == [False, True, False, True, False, False, False, False]
+    assert not profiler.should_profile('show_products', 'POST')
+
+def test_token_header_profiles_only_with_the_right_token(tmp_path):
+    profiler = RequestProfiler(token='secret', profile_dir=str(tmp_path), sampler=FakeSampler(None))
+    assert profiler.should_profile('index', 'GET', 'secret')
+    assert not profiler.should_profile('index', 'GET', 'wrong')
+    assert not profiler.should_profile('index', 'GET', 'sécret')
+    assert not RequestProfiler(token='', profile_dir=str(tmp_path)).should_profile('index', 'GET', '')
+
+def test_capture_file_name_is_restricted_to_safe_characters(tmp_path):
+    profiler = RequestProfiler(token='secret', profile_dir=str(tmp_path),
+                               sampler=FakeSampler(collections.Counter({'app:index': 3})))
+    path = profiler.finish('index_GET_../../etc/passwd')
+    assert os.path.dirname(path) == str(tmp_path)
+    assert os.path.basename(path).endswith('_index_GET_______etc_passwd.folded')
+    stacks, files = profiling.load_folded([str(tmp_path)])
+    assert stacks == collections.Counter({'app:index': 3})
+    assert files == [path]
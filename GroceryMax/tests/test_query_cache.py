@@ -0,0 +1,119 @@
+# tests/test_query_cache.py
+import threading
+import time
+
+import database_operations
+import query_cache
+from query_cache import QueryCache
+
+def _loader(value, tags=(), calls=None):
+    def load():
+        if calls is not None:
+            calls.append(value)
+        return value, tags
+    return load
+
+def test_hit_until_the_ttl_expires():
+    cache = QueryCache(max_entries=10, ttl=0.05)
+    calls = []
+    assert cache.get_or_load('k', _loader('a', calls=calls)) == 'a'
+    assert cache.get_or_load('k', _loader('b', calls=calls)) == 'a'
+    time.sleep(0.06)
+    assert cache.get_or_load('k', _loader('c', calls=calls)) == 'c'
+    assert calls == ['a', 'c']
+    assert cache.metrics()['expired'] == 1
+
+def test_evicts_the_least_recently_used_entry():
+    cache = QueryCache(max_entries=2, ttl=60)
+    cache.get_or_load('a', _loader(1))
+    cache.get_or_load('b', _loader(2))
+    cache.get_or_load('a', _loader(None)) # 'b' is now the least recently used
+    cache.get_or_load('c', _loader(3))
+    assert cache.get_or_load('b', _loader('reloaded')) == 'reloaded'
+    assert cache.get_or_load('c', _loader(None)) == 3
+    assert cache.metrics()['evictions'] == 2
+
+def test_untagged_results_are_not_cached():
+    cache = QueryCache(max_entries=10, ttl=60)
+    cache.get_or_load('k', _loader('failed', tags=None))
+    assert cache.get_or_load('k', _loader('ok')) == 'ok'
+
+def test_identical_misses_share_one_query():
+    cache = QueryCache(max_entries=10, ttl=60)
+    release = threading.Event()
+    calls = []
+
+    def slow_load():
+        calls.append(1)
+        release.wait(2)
+        return 'value', ()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('k', slow_load))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert results == ['value'] * 5
+    assert len(calls) == 1
+    assert cache.metrics()['coalesced'] == 4
+
+def test_invalidation_during_a_load_keeps_the_result_out_of_the_cache():
+    cache = QueryCache(max_entries=10, ttl=60)
+
+    def load_then_invalidate():
+        cache.invalidate() # A write lands while the query runs
+        return 'stale', ()
+
+    assert cache.get_or_load('k', load_then_invalidate) == 'stale'
+    assert cache.get_or_load('k', _loader('fresh')) == 'fresh'
+
+def test_tag_invalidation_drops_only_matching_entries():
+    cache = QueryCache(max_entries=10, ttl=60)
+    cache.get_or_load('page1', _loader('p1', tags=[1, 2]))
+    cache.get_or_load('page2', _loader('p2', tags=[3]))
+    cache.invalidate(2)
+    assert cache.get_or_load('page1', _loader('p1 again')) == 'p1 again'
+    assert cache.get_or_load('page2', _loader(None)) == 'p2'
+    cache.invalidate()
+    assert cache.get_or_load('page2', _loader('p2 again')) == 'p2 again'
+
+def test_products_page_is_invalidated_by_stock_changes_of_its_products(monkeypatch):
+    monkeypatch.setattr(query_cache, 'product_queries', QueryCache(max_entries=10, ttl=60))
+    calls = []
+
+    def fetch(conn, search_term, page, items_per_page, errors=None):
+        calls.append((search_term, page))
+        return {'products': [{'ProductID': 1}, {'ProductID': 2}], 'total_count': 2}
+
+    monkeypatch.setattr(database_operations, 'fetch_products_with_category_names', fetch)
+    query_cache.fetch_products_page(None, ' Apple ', 1)
+    query_cache.fetch_products_page(None, 'apple', 1)
+    assert calls == [('apple', 1)]
+    query_cache._on_product_change(database_operations.ENTITY_PRODUCT, 99, 'stock')
+    query_cache.fetch_products_page(None, 'apple', 1)
+    assert len(calls) == 1 # Product 99 is not on the page
+    query_cache._on_product_change(database_operations.ENTITY_PRODUCT, 2, 'stock')
+    query_cache.fetch_products_page(None, 'apple', 1)
+    assert len(calls) == 2
+    query_cache._on_product_change(database_operations.ENTITY_PRODUCT, 99, 'update')
+    query_cache.fetch_products_page(None, 'apple', 1)
+    assert len(calls) == 3
+
+def test_deep_pages_and_failed_queries_bypass_the_cache(monkeypatch):
+    monkeypatch.setattr(query_cache, 'product_queries', QueryCache(max_entries=10, ttl=60))
+    calls = []
+
+    def fetch(conn, search_term, page, items_per_page, errors=None):
+        calls.append(page)
+        if errors is not None and page == 1:
+            errors.append('query failed')
+        return {'products': [], 'total_count': 0}
+
+    monkeypatch.setattr(database_operations, 'fetch_products_with_category_names', fetch)
+    for _ in range(2):
+        query_cache.fetch_products_page(None, None, 1)
+        query_cache.fetch_products_page(None, None, query_cache.QUERY_CACHE_MAX_PAGE + 1)
+    assert len(calls) == 4
@@ -0,0 +1,50 @@
+# tests/test_reconcile.py
+import reconcile
+from reconcile import LOGS, SALES, merge_result, plan_chunks, stock_mismatches
+
+def _bounds(min_sale_id=1, max_sale_id=10, min_log_id=5, max_log_id=9):
+    return {'min_sale_id': min_sale_id, 'max_sale_id': max_sale_id, 'min_log_id': min_log_id,
+            'max_log_id': max_log_id, 'log_key_column': 'LogID'}
+
+def _checkpoint():
+    return {'store_id': 1, 'done': [], 'sold': {}, 'logged': {}, 'truncated': [],
+            **{name: [] for name in reconcile.DISCREPANCY_LISTS}}
+
+def test_plan_chunks_covers_both_ranges_without_gaps():
+    assert plan_chunks(_bounds(), 4) == [
+        (SALES, 1, 4), (SALES, 5, 8), (SALES, 9, 10),
+        (LOGS, 5, 8), (LOGS, 9, 9),
+    ]
+
+def test_plan_chunks_skips_empty_tables():
+    assert plan_chunks(_bounds(min_sale_id=None, max_sale_id=None), 100) == [(LOGS, 5, 9)]
+    assert plan_chunks(_bounds(None, None, None, None), 100) == []
+
+def test_merge_result_adds_up_quantities_per_product():
+    checkpoint = _checkpoint()
+    merge_result(checkpoint, SALES, 1, 4, {'sold': {1: 3, 2: 1}, 'truncated': [], 'total_mismatches': [{'SaleID': 2}]})
+    merge_result(checkpoint, SALES, 5, 8, {'sold': {1: 2}, 'truncated': ['line_mismatches']})
+    merge_result(checkpoint, LOGS, 5, 8, {'logged': {1: 5}, 'truncated': []})
+    assert checkpoint['sold'] == {'1': 5, '2': 1}
+    assert checkpoint['logged'] == {'1': 5}
+    assert checkpoint['total_mismatches'] == [{'SaleID': 2}]
+    assert checkpoint['truncated'] == ['line_mismatches in sales:5-8']
+    assert checkpoint['done'] == ['sales:1-4', 'sales:5-8', 'logs:5-8']
+
+def test_stock_mismatches_lists_products_whose_logs_differ_from_sales():
+    checkpoint = _checkpoint()
+    checkpoint['sold'] = {'1': 5, '2': 1, '10': 4}
+    checkpoint['logged'] = {'1': 5, '2': 3, '3': 2}
+    assert stock_mismatches(checkpoint) == [
+        {'ProductID': 2, 'Sold': 1, 'Logged': 3},
+        {'ProductID': 3, 'Sold': 0, 'Logged': 2},
+        {'ProductID': 10, 'Sold': 4, 'Logged': 0},
+    ]
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = reconcile.new_checkpoint(_bounds(), 4, reconcile.database_operations.STORE_ID)
+    merge_result(checkpoint, SALES, 1, 4, {'sold': {1: 3}, 'truncated': []})
+    reconcile.save_checkpoint(path, checkpoint)
+    assert reconcile.load_checkpoint(path, checkpoint['store_id']) == checkpoint
+    assert reconcile.load_checkpoint(str(tmp_path / 'missing.json'), checkpoint['store_id']) is None
@@ -0,0 +1,85 @@
+# tests/test_sales_analytics.py
+import datetime
+
+import sales_analytics
+from sales_analytics import SalesAnalytics, day_number
+
+TODAY = datetime.date(2024, 5, 15) # A Wednesday
+DAY = day_number(TODAY)
+
+def _engine(tmp_path, lines):
+    engine = SalesAnalytics(state_path=str(tmp_path / 'state.npz'))
+    state = sales_analytics._empty_state()
+    engine._accumulate(state, lines)
+    state['support'] = state['cooccurrence'].diagonal()
+    state['top_pairs'] = sales_analytics._top_pairs(state['cooccurrence'], state['support'], state['baskets'], 10)
+    engine._state = state
+    return engine
+
+# (SaleID, ProductID, Quantity, Revenue, day number)
+LINES = [
+    (1, 1, 2, 4.0, DAY), (1, 2, 1, 3.0, DAY),
+    (2, 1, 1, 2.0, DAY), (2, 3, 5, 5.0, DAY),
+    (3, 2, 4, 12.0, DAY - 1),
+    (4, 1, 3, 6.0, DAY - 8),
+]
+
+def test_accumulate_counts_baskets_lines_and_quantities(tmp_path):
+    engine = _engine(tmp_path, LINES)
+    state = engine._state
+    assert (state['baskets'], state['lines']) == (4, 6)
+    assert state['quantity'][DAY, 1] == 3
+    assert state['revenue'][DAY - 1, 2] == 12.0
+    assert state['cooccurrence'][1, 2] == 1 and state['cooccurrence'][1, 3] == 1
+    assert state['cooccurrence'][1, 1] == 3 # Baskets containing product 1
+
+def test_accumulate_counts_a_repeated_product_once_per_basket(tmp_path):
+    engine = _engine(tmp_path, [(1, 7, 1, 1.0, DAY), (1, 7, 2, 2.0, DAY), (1, 8, 1, 1.0, DAY)])
+    state = engine._state
+    assert state['quantity'][DAY, 7] == 3
+    assert state['cooccurrence'][7, 7] == 1
+    assert state['cooccurrence'][7, 8] == 1
+
+def test_accumulate_adds_to_existing_state(tmp_path):
+    state = sales_analytics._empty_state()
+    engine = SalesAnalytics(state_path=str(tmp_path / 'state.npz'))
+    assert engine._accumulate(state, LINES[:2]) == 1
+    assert engine._accumulate(state, LINES[2:]) == 3
+    assert state['quantity'][DAY, 1] == 3
+    assert engine._accumulate(state, []) == 0
+
+def test_top_sellers_by_day(tmp_path):
+    engine = _engine(tmp_path, LINES)
+    days = engine.top_sellers('day', periods=2, limit=2, end_date=TODAY)
+    assert [period['PeriodStart'] for period in days] == [TODAY, TODAY - datetime.timedelta(days=1)]
+    assert days[0]['Products'] == [{'ProductID': 3, 'Quantity': 5, 'Revenue': 5.0},
+                                   {'ProductID': 1, 'Quantity': 3, 'Revenue': 6.0}]
+    assert days[1]['Products'] == [{'ProductID': 2, 'Quantity': 4, 'Revenue': 12.0}]
+
+def test_top_sellers_by_week_starts_on_monday(tmp_path):
+    engine = _engine(tmp_path, LINES)
+    weeks = engine.top_sellers('week', periods=2, end_date=TODAY)
+    assert weeks[0]['PeriodStart'] == datetime.date(2024, 5, 13)
+    assert weeks[0]['PeriodEnd'] == datetime.date(2024, 5, 19)
+    assert {p['ProductID']: p['Quantity'] for p in weeks[0]['Products']} == {1: 3, 2: 5, 3: 5}
+    assert weeks[1]['Products'] == [{'ProductID': 1, 'Quantity': 3, 'Revenue': 6.0}]
+
+def test_top_sellers_outside_the_loaded_days_is_empty(tmp_path):
+    engine = _engine(tmp_path, LINES)
+    future = engine.top_sellers('day', periods=1, end_date=TODAY + datetime.timedelta(days=30))
+    assert future[0]['Products'] == []
+
+def test_bought_together_and_top_pairs(tmp_path):
+    engine = _engine(tmp_path, LINES)
+    together = engine.bought_together(1)
+    assert [row['ProductID'] for row in together] == [2, 3]
+    assert together[0]['Confidence'] == round(1 / 3, 3)
+    assert engine.bought_together(99) == []
+    assert {(pair['ProductA'], pair['ProductB']) for pair in engine.top_pairs()} == {(1, 2), (1, 3)}
+
+def test_state_survives_save_and_load(tmp_path):
+    engine = _engine(tmp_path, LINES)
+    assert engine.save()
+    restored = SalesAnalytics(state_path=engine.state_path)
+    assert restored.load()
+    assert restored.top_sellers('day', periods=1, end_date=TODAY) == engine.top_sellers('day', periods=1, end_date=TODAY)